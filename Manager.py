@@ -1,15 +1,34 @@
 """Manager class for Inventory tansactions."""
 
+import contextlib
+import io
 import logging
 import os
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import exists, or_, select, tuple_
+from sqlalchemy.orm import Session, sessionmaker
 
-from inventory import (Base,
+from audit import audited
+from graph import InventoryGraph, TABLES
+from inventory import (association_table,
                        Company,
                        Office,
                        Group,
                        Host,
                        )
+import export
+import facts
+import loading
+import membership
+import moves
+import revisions
+from integrity import check_integrity, repair_integrity
+from schema import check_schema
+from search import rebuild, reindex_hosts, search_hosts
+import snapshots
+import stats
+from sync import apply_sync, plan_sync
+from upsert import add_memberships, upsert
+import variables
 
 from pprint import pprint as pp
 LOG = logging.getLogger('Manager')
@@ -18,43 +37,547 @@ logging.basicConfig(format=FORMAT)
 LOG.setLevel(level=os.environ.get("LOGLEVEL", "INFO"))
 
 
-def create_manager(engine):
+# Rows per keyset page of the iter_* methods
+PAGE_SIZE = 1000
+
+
+def _keyset(query, keys, after=None, limit=None, page_size=PAGE_SIZE):
+    """Yield the rows of query ordered by keys, one page query at a time.
+
+    The rows must start with the keys columns.  Each page continues after the
+    last row of the previous one, so memory use is bounded by page_size and
+    every page costs a single query no matter how deep it is.
+
+    A cursor with fewer values than keys is a prefix: the rows continue
+    after every row starting with it, e.g. after=('Acme', 'Austin') of the
+    hosts starts at Acme's next office.  A longer cursor raises ValueError.
+    """
+    if isinstance(after, str):
+        after = (after,)
+    if after and len(after) > len(keys):
+        raise ValueError("The cursor {} has more values than the keys: "
+                         "{}".format(tuple(after), ', '.join(
+                             str(key) for key in keys)))
+    return _pages(query, keys, after, limit, page_size)
+
+
+def _pages(query, keys, after, limit, page_size):
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        page = query
+        if after:
+            if len(after) == 1:
+                page = page.filter(keys[0] > after[0])
+            else:
+                page = page.filter(tuple_(*keys[:len(after)]) >
+                                   tuple_(*after))
+        rows = page.order_by(*keys).limit(size).all()
+        for row in rows:
+            yield row
+        if len(rows) < size:
+            return
+        after = tuple(rows[-1])[:len(keys)]
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+def _describe_sync(arguments, plan):
+    # The spec itself can be huge: audit what it changed instead
+    arguments = {'prune': arguments.get('prune', False)}
+    return arguments, None, plan.summary()
+
+
+def _describe_repair(arguments, findings):
+    return (arguments, None,
+            dict((finding.kind, len(finding.rows)) for finding in findings))
+
+
+def _describe_ingest(arguments, report):
+    # The counts of the run, not the host_var rows it wrote
+    arguments = {'directory': arguments['directory'],
+                 'prefix': arguments.get('prefix', '')}
+    counts = None
+    if report is not None:
+        counts = dict((name, value) for name, value in report._asdict().items()
+                      if name != 'seconds')
+    return arguments, None, counts
+
+
+def create_manager(engine, **kwargs):
     """Return a Manager object."""
-    return Manager(engine)
+    return Manager(engine, **kwargs)
 
 
 class Manager():
     """Manager class for inventory transaction with sqlalchemy."""
 
-    def __init__(self, engine):
-        """Initialize the Session object."""
-        Session = sessionmaker(bind=engine)
-        self.session = Session()
-        Base.metadata.create_all(engine)
-
-    def __exit__(self):
+    def __init__(self, engine, audit=None, actor=None, strict=False):
+        """Initialize the Session object.
+
+        audit is an optional audit.AuditLog receiving every committed change
+        made through this Manager on behalf of actor. With strict=True the
+        relationships an operation's loading profile doesn't load raise
+        instead of loading lazily (see loading.py).
+        """
+        self._sessionmaker = sessionmaker(bind=engine)
+        self.session = self._sessionmaker()
+        check_schema(engine)
+        revisions.track(engine)
+        self.audit = audit
+        self.actor = actor
+        self.strict = strict
+        # Data revisions: bumped by every successful write so that derived,
+        # cached views (see get_graph) know when to refresh. They are
+        # combined with the database revisions, see data_revisions().
+        self.revision = 0
+        self.table_revisions = dict.fromkeys(TABLES, 0)
+        self._graph = None
+        self._resolver = None
+        self._resolver_revisions = None
+        # Audit records of the open batch(), see audit.audited
+        self.pending_audit = None
+        self._stats = None
+        self._stats_revisions = None
+        self._batch = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
         """Ensure self.session is closed upon exit."""
+        self.close()
+
+    def close(self):
+        """Flush the audit log and close the session.
+
+        The audit log is left open: its creator closes it once no Manager
+        uses it any more.
+        """
+        if self.audit:
+            self.audit.flush()
         if self.session:
             self.session.close()
 
+    def _bump(self, *tables):
+        """Record a committed change to tables."""
+        self.revision += 1
+        table_revisions = self.table_revisions
+        for table in tables:
+            table_revisions[table] = table_revisions.get(table, 0) + 1
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Run the Manager calls of the with block in one transaction.
+
+        Each call commits or rolls back its own savepoint, so a failing call
+        only undoes itself. The transaction is committed when the block
+        ends and rolled back if it raises::
+
+            with manager.batch():
+                manager.add_company(company_name='Acme')
+                manager.add_office(office_name='Austin', company_name='Acme')
+
+        Calls made inside a batch block join the outer batch. Their audit
+        records are written when the transaction commits.
+        """
+        if self._batch:
+            yield self
+            return
+
+        self._batch = True
+        self.pending_audit = []
+        self.session.close()
+        conn = self._sessionmaker.kw['bind'].connect()
+        transaction = conn.begin()
+        if conn.dialect.driver == 'pysqlite':
+            # pysqlite defers BEGIN, which would turn the first SAVEPOINT
+            # into the transaction itself
+            conn.exec_driver_sql('BEGIN')
+        self.session = Session(bind=conn,
+                               join_transaction_mode='create_savepoint')
+        try:
+            yield self
+        except BaseException:
+            transaction.rollback()
+            # Cached views may have seen the rolled back rows
+            self._bump(*TABLES + variables.VAR_TABLES)
+            raise
+        else:
+            transaction.commit()
+            for record in self.pending_audit:
+                self.audit.record(**record)
+        finally:
+            self.pending_audit = None
+            self.session.close()
+            conn.close()
+            self.session = self._sessionmaker()
+            self._batch = False
+
+    def data_revisions(self, tables=TABLES):
+        """Return {table: (database revision, local revision)} of tables.
+
+        The database revision counts the committed writes of every Manager
+        (see revisions.py), the local one those of this Manager, and the
+        rolled back batches its cached views may have seen.
+        """
+        database = revisions.read(self.session.connection())
+        return dict((table, (database.get(table),
+                             self.table_revisions.get(table, 0)))
+                    for table in tables)
+
+    def get_graph(self):
+        """Return an InventoryGraph refreshed to the current data revision.
+
+        The writes of other Managers are seen too, see data_revisions().
+        """
+        table_revisions = self.data_revisions()
+        if self._graph is None:
+            self._graph = InventoryGraph(self.session, table_revisions)
+        else:
+            self._graph.refresh(self.session, table_revisions)
+        return self._graph
+
+    def get_resolver(self):
+        """Return a variables.VariableResolver of the current revision."""
+        table_revisions = self.data_revisions(variables.TABLES)
+        if (self._resolver is None or
+                self._resolver_revisions != table_revisions):
+            self._resolver = variables.VariableResolver(
+                self.session.connection())
+            self._resolver_revisions = table_revisions
+        return self._resolver
+
+    def stats(self):
+        """Return the inventory statistics and capacity metrics.
+
+        See stats.py for the document. It is computed with aggregate
+        queries once per data revision, including the writes of other
+        Managers; repeated calls cost one revision lookup until something
+        changes: don't modify it.
+        """
+        table_revisions = self.data_revisions(stats.TABLES)
+        if self._stats is None or self._stats_revisions != table_revisions:
+            self._stats = stats.compute(self.session.connection())
+            self._stats_revisions = table_revisions
+        return self._stats
+
+    @audited(describe=_describe_sync)
+    def sync(self, spec, prune=False, dry_run=False):
+        """Reconcile the database with a company/office/group/host spec.
+
+        Only the missing rows are inserted and, with prune=True, the rows
+        not in the spec are deleted, all in one transaction. Returns the
+        SyncPlan; with dry_run=True nothing is written.
+        """
+        plan = plan_sync(self.session, spec, prune=prune)
+        if dry_run or not plan:
+            return plan
+
+        try:
+            changed = apply_sync(self.session, plan)
+            reindex_hosts(self.session, plan.host_ids())
+            self.session.commit()
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem syncing inventory: %s", ex)
+            return
+
+        else:
+            self._bump(*changed)
+            return plan
+
+    @audited(describe=_describe_repair)
+    def check_integrity(self, repair=False):
+        """Find (and with repair=True fix) inconsistent inventory rows.
+
+        Returns the list of integrity.Finding(kind, rows) found, see
+        integrity.py for the kinds of problems checked.
+        """
+        conn = self.session.connection()
+        findings = check_integrity(conn)
+        if not repair or not findings:
+            return findings
+
+        try:
+            host_ids = repair_integrity(conn, findings)
+            reindex_hosts(self.session, host_ids)
+            self.session.commit()
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem repairing inventory: %s", ex)
+
+        else:
+            self._bump(*TABLES + variables.VAR_TABLES)
+        return findings
+
+    def search_hosts(self, query, limit=20):
+        """Search hosts by host, group, office or company name.
+
+        'db-07' matches anywhere in a name, 'db*' matches host names that
+        start with 'db'. Returns up to limit dicts of host, company, office
+        and the host's company_office_group groups, best matches first.
+        """
+        return search_hosts(self.session, query, limit=limit)
+
+    def rebuild_search(self):
+        """Recreate the host search index from the inventory tables."""
+        rebuild(self.session.connection())
+        self.session.commit()
+
+    def hosts_by_group(self, fq_group_name=None):
+        """Return {company_office_group: [host names]}.
+
+        Read from the materialized inventory_membership table, optionally
+        for a single group.
+        """
+        group_hosts = {}
+        for group_name, host_name in membership.hosts_by_group(
+                self.session.connection(), fq_group_name):
+            group_hosts.setdefault(group_name, []).append(host_name)
+        return group_hosts
+
+    def export(self, format='json', out=None, at_revision=None):
+        """Write a static inventory in format (see export.WRITERS) to out.
+
+        Without out the export is returned as a string (bytes for msgpack).
+        With at_revision the inventory of that snapshot is written instead
+        of the current one (see snapshot()).
+        """
+        if format not in export.WRITERS:
+            LOG.error("Unknown export format: %s", format)
+            return
+        writer, binary = export.WRITERS[format]
+        conn = self.session.connection()
+        kwargs = {}
+        if at_revision is not None:
+            manifest = snapshots.get_manifest(conn, at_revision)
+            if manifest is None:
+                LOG.error("Snapshot doesnt exists: %s", at_revision)
+                return
+            groups = snapshots.groups(conn, manifest)
+            if format in export.HOSTVARS:
+                kwargs['hostvars'] = snapshots.hostvars(conn, manifest)
+        else:
+            groups = export.membership_groups(conn)
+            if format in export.HOSTVARS:
+                kwargs['hostvars'] = self.iter_effective_vars()
+        if out is not None:
+            writer(groups, out, **kwargs)
+            return
+        buffer = io.BytesIO() if binary else io.StringIO()
+        writer(groups, buffer, **kwargs)
+        return buffer.getvalue()
+
+    # -------------------------------------------------------------------------
+    # Snapshots (see snapshots.py)
+    # -------------------------------------------------------------------------
+    @audited()
+    def snapshot(self, label=None):
+        """Record the current inventory as a snapshot; return its revision.
+
+        Returns the latest revision when nothing changed since then.
+        """
+        try:
+            revision, created = snapshots.snapshot(
+                self.session, self.get_resolver(), label=label)
+            self.session.commit()
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem taking snapshot: %s", ex)
+
+        else:
+            if created:
+                self._bump('snapshot')
+            return revision
+
+    def list_snapshots(self, before=None, limit=None):
+        """Return the (revision, timestamp, label) of the snapshots.
+
+        Newest first, optionally only the ones taken before the timestamp
+        before: list_snapshots(before=time.time() - 86400, limit=1) is the
+        inventory as it was yesterday.
+        """
+        return snapshots.snapshots(self.session.connection(), before=before,
+                                   limit=limit)
+
+    def diff_snapshots(self, old_revision=None, new_revision=None):
+        """Return the group and host variables changes between snapshots."""
+        changes = snapshots.diff(self.session.connection(), old_revision,
+                                 new_revision)
+        if changes is None:
+            LOG.error("Snapshot doesnt exists: %s or %s", old_revision,
+                      new_revision)
+        return changes
+
+    @audited()
+    def prune_snapshots(self, keep=None, before=None):
+        """Delete old snapshots and the chunks only they used.
+
+        Deletes the snapshots taken before the timestamp before, except the
+        newest keep ones. Returns {'snapshots': deleted, 'chunks': deleted}.
+        """
+        try:
+            deleted, chunks = snapshots.prune(self.session, keep=keep,
+                                              before=before)
+            self.session.commit()
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem pruning snapshots: %s", ex)
+
+        else:
+            if deleted:
+                self._bump('snapshot')
+            return {'snapshots': deleted, 'chunks': chunks}
+
+    # -------------------------------------------------------------------------
+    # Variables (see variables.py)
+    # -------------------------------------------------------------------------
+    def effective_vars(self, hostname, company_name=None, office_name=None):
+        """Return the merged company, office, group and host variables."""
+        host = self.get_host(hostname, company_name=company_name,
+                             office_name=office_name)
+        if not host:
+            LOG.error("Host doesnt exists: %s", hostname)
+            return
+        return variables.effective_vars(self.session.connection(),
+                                        self.get_resolver(), host.id)
+
+    def iter_effective_vars(self):
+        """Yield (host name, variables) of every host, ordered by name.
+
+        The variables dicts are shared between hosts: don't modify them.
+        """
+        for _, name, host_vars in variables.iter_effective_vars(
+                self.session.connection(), self.get_resolver()):
+            yield name, host_vars
+
+    @audited()
+    def set_vars(self, values=None, company_name=None, office_name=None,
+                 group_name=None, hostname=None):
+        """Set variables of a company, office, group or host.
+
+        values is a {key: value} dict, None values delete the key. The
+        variables belong to the host if hostname is given, else to the
+        group, else the office, else the company. Returns the number of
+        variables set or deleted.
+        """
+        if not values or not company_name:
+            LOG.error("You must supply values and company_name")
+            return
+
+        if hostname:
+            level = 'host'
+            owner = self.get_host(hostname, company_name=company_name,
+                                  office_name=office_name)
+        elif group_name:
+            level = 'group'
+            owner = self.get_group(group_name, company_name=company_name,
+                                   office_name=office_name)
+        elif office_name:
+            level = 'office'
+            owner = self.get_office(office_name, company_name=company_name)
+        else:
+            level = 'company'
+            owner = self.get_company(company_name)
+        if not owner:
+            LOG.error("No such %s to set variables of", level)
+            return
+
+        try:
+            variables.set_vars(self.session, level, owner.id, values)
+            self.session.commit()
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem setting %s variables: %s", level, ex)
+
+        else:
+            self._bump(level + '_var')
+            return len(values)
+
+    @audited()
+    def set_group_priority(self, priority=None, group_name=None,
+                           company_name=None, office_name=None):
+        """Set the merge priority of a group's variables (default 1)."""
+        group = self.get_group(group_name, company_name=company_name,
+                               office_name=office_name)
+        if not group or priority is None:
+            LOG.error("You must supply priority and an existing group")
+            return
+
+        try:
+            group.priority = priority
+            self.session.commit()
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem setting group priority: %s: %s", group_name,
+                      ex)
+
+        else:
+            self._bump('group')
+            return priority
+
     def dump_hosts_by_group(self):
         """Dump all the information required in JSON format."""
-        group_hosts = {}
-        for company in self.session.query(Company):
-            for office in company.offices:
-                for group in office.groups:
-                    group_name = '{}_{}_{}'.format(company.name,
-                                                   office.name,
-                                                   group.name)
-                    _hosts = []
-                    for host in group.hosts:
-                        _hosts.append(host.name)
-                    group_hosts[group_name] = _hosts
-                    pp(group_hosts)
+        pp(self.hosts_by_group())
+
+    def rebuild_membership(self):
+        """Recreate the materialized inventory_membership table."""
+        membership.rebuild(self.session.connection())
+        self.session.commit()
+
+    def check_membership(self):
+        """Compare inventory_membership with the base tables.
+
+        Returns the membership.check() report, see membership.is_consistent.
+        """
+        return membership.check(self.session.connection())
+
+    @audited(describe=_describe_ingest)
+    def ingest_facts(self, directory, keys=facts.KEYS, prefix='', workers=4,
+                     processes=False, batch_size=facts.BATCH_SIZE):
+        """Upsert the facts of an Ansible jsonfile fact cache into host_var.
+
+        See facts.py. Returns a facts.IngestReport, with its throughput.
+        """
+        if not os.path.isdir(directory):
+            LOG.error("Fact cache directory doesnt exists: %s", directory)
+            return
+
+        try:
+            report = facts.ingest_facts(self.session, directory, keys=keys,
+                                        prefix=prefix, workers=workers,
+                                        processes=processes,
+                                        batch_size=batch_size)
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem ingesting facts: %s: %s", directory, ex)
+            # The batches committed before the error are kept
+            self._bump('host_var')
+
+        else:
+            if report.variables:
+                self._bump('host_var')
+            return report
+
+    def get_host_vars(self, hostname, company_name=None, office_name=None):
+        """Return {key: value} of the variables of a host."""
+        host = self.get_host(hostname, company_name=company_name,
+                             office_name=office_name)
+        if not host:
+            return
+        return facts.host_vars(self.session, host.id)
 
+    @audited()
     def add_company(self, company_name=None):
-        company = self.session.query(Company).filter(Company.name==company_name)
-        if company.one_or_none():
+        if self._company_query(company_name).one_or_none():
             LOG.error("Company exists: %s", company_name)
             return
 
@@ -68,15 +591,26 @@ class Manager():
             LOG.error("Problem adding company: %s: %s", company_name, ex)
 
         else:
+            self._bump('company')
             return company
 
+    @audited()
     def del_company(self, company_name=None):
-        company = self.session.query(Company).filter(Company.name==company_name).one_or_none()
+        company = self._company_query(company_name,
+                                      'bulk-write').one_or_none()
         if not company:
             LOG.error("Company doesnt exists: %s", company_name)
             return
 
+        if self._has_children(Office.company_id == company.id,
+                              Group.company_id == company.id,
+                              Host.company_id == company.id):
+            LOG.error("Company isnt empty: %s", company_name)
+            return
+
         try:
+            variables.forget(self.session, 'company', [company.id])
+            loading.mark_empty(company, 'offices', 'groups', 'hosts')
             self.session.delete(company)
             self.session.commit()
 
@@ -84,21 +618,83 @@ class Manager():
             self.session.rollback()
             LOG.error("Problem adding company: %s: %s", company_name, ex)
 
+        else:
+            self._bump('company', 'company_var')
+
+    def iter_companies(self, after=None, limit=None, like=None,
+                       page_size=PAGE_SIZE):
+        """Yield (company,) rows ordered by name, one keyset page at a time.
+
+        after is the last row (or name) already seen, limit caps the number
+        of rows and like is an optional SQL LIKE pattern on the name.
+        """
+        query = self.session.query(Company.name.label('company'))
+        if like:
+            query = query.filter(Company.name.like(like))
+        return _keyset(query, [Company.name], after, limit, page_size)
+
     def list_companies(self):
-        companies = self.session.query(Company)
-        # self.session.commit()
-        if not companies:
+        companies = self.iter_companies()
+        found = False
+        for row in companies:
+            found = True
+            print(row.company)
+        if not found:
             LOG.info("No companies found!")
-        for company in companies.all():
-            print(company.name)
 
     def get_company(self, company_name):
-        company = self.session.query(Company).filter(Company.name==company_name)
-        if not company.one_or_none():
+        company = self._company_query(company_name).one_or_none()
+        if not company:
             LOG.info("No such company '%s'", company_name)
             return
-        return company.one_or_none()
-
+        return company
+
+    # Single query lookups by name: every join has its condition, see
+    # tests/test_query_plans.py. profile and paths are the loading.options()
+    # of the relationships the caller reads.
+    def _load(self, profile, *paths):
+        return loading.options(profile, *paths, strict=self.strict)
+
+    def _company_query(self, company_name, profile='single-object',
+                       *paths):
+        return (self.session.query(Company)
+                .filter(Company.name == company_name)
+                .options(*self._load(profile, *paths)))
+
+    def _office_query(self, office_name, company_name,
+                      profile='single-object', *paths):
+        return (self.session.query(Office)
+                .join(Company, Office.company_id == Company.id)
+                .filter(Company.name == company_name,
+                        Office.name == office_name)
+                .options(*self._load(profile, *paths)))
+
+    def _group_query(self, group_name, company_name, office_name,
+                     profile='single-object', *paths):
+        return (self.session.query(Group)
+                .join(Office, Group.office_id == Office.id)
+                .join(Company, Group.company_id == Company.id)
+                .filter(Company.name == company_name,
+                        Office.name == office_name,
+                        Group.name == group_name)
+                .options(*self._load(profile, *paths)))
+
+    def _host_query(self, hostname, company_name, office_name,
+                    profile='single-object', *paths):
+        return (self.session.query(Host)
+                .join(Office, Host.office_id == Office.id)
+                .join(Company, Host.company_id == Company.id)
+                .filter(Company.name == company_name,
+                        Office.name == office_name,
+                        Host.name == hostname)
+                .options(*self._load(profile, *paths)))
+
+    def _has_children(self, *conditions):
+        """Return whether a row matches one of conditions, in one query."""
+        return self.session.execute(select(or_(*[
+            exists().where(condition) for condition in conditions]))).scalar()
+
+    @audited()
     def add_office(self, office_name=None, company_name=None):
         if not office_name and not company_name:
             LOG.error("Missing required office_name/company_name")
@@ -108,10 +704,12 @@ class Manager():
             LOG.error("Company does not Exists: %s", company_name)
             return
 
-        for office in company.offices:
-            if office.name == office_name:
-                LOG.error("Office already exists: %s", office_name)
-                return
+        exists = (self.session.query(Office.id)
+                  .filter(Office.company_id == company.id,
+                          Office.name == office_name).first())
+        if exists:
+            LOG.error("Office already exists: %s", office_name)
+            return
 
         try:
             office = Office(name=office_name, company=company)
@@ -123,21 +721,29 @@ class Manager():
             self.session.rollback()
 
         else:
+            self._bump('office')
             return office
 
+    @audited()
     def del_office(self, office_name=None, company_name=None):
         if not office_name or not company_name:
             LOG.error("You must supply office_name and company_name")
             return
 
-        query = self.session.query(Office).filter(Office.name==office_name,
-                                                  Company.name==company_name)
-        office = query.one_or_none()
+        office = self._office_query(office_name, company_name,
+                                    'bulk-write').one_or_none()
         if not office:
             LOG.error("Office doesnt exists: %s", office_name)
             return
 
+        if self._has_children(Group.office_id == office.id,
+                              Host.office_id == office.id):
+            LOG.error("Office isnt empty: %s", office_name)
+            return
+
         try:
+            variables.forget(self.session, 'office', [office.id])
+            loading.mark_empty(office, 'groups', 'hosts')
             self.session.delete(office)
             self.session.commit()
 
@@ -145,41 +751,56 @@ class Manager():
             self.session.rollback()
             LOG.error("Problem deleting company: %s: %s", company_name, ex)
 
+        else:
+            self._bump('office', 'office_var')
+
     def get_office(self, office_name=None, company_name=None):
         if not office_name or not company_name:
             LOG.error("You must supply office_name and company_name")
             return
 
-        company = self.get_company(company_name)
-        if not company:
+        office = self._office_query(office_name, company_name).one_or_none()
+        if not office and not self.get_company(company_name):
             LOG.error("Company does not Exists: %s", company_name)
             return
 
-        office = self.session.query(Office).filter(Office.company==company,
-                                                   Office.name==office_name)
-        return office.one_or_none()
+        return office
 
     def get_offices(self, company_name=None):
         if not company_name:
             LOG.error("You must company_name")
             return
 
-        company = self.get_company(company_name)
+        company = self._company_query(company_name, 'single-object',
+                                      (Company.offices,)).one_or_none()
         if not company:
             LOG.error("Company does not Exists: %s", company_name)
             return
 
         return company.offices
 
+    def iter_offices(self, company_name=None, after=None, limit=None,
+                     like=None, page_size=PAGE_SIZE):
+        """Yield (company, office) rows, see iter_companies()."""
+        query = (self.session.query(Company.name.label('company'),
+                                    Office.name.label('office'))
+                 .join(Company, Office.company_id == Company.id))
+        if company_name:
+            query = query.filter(Company.name == company_name)
+        if like:
+            query = query.filter(Office.name.like(like))
+        return _keyset(query, [Company.name, Office.name],
+                       after, limit, page_size)
+
     def list_offices(self, company_name='all'):
         if not company_name:
             LOG.error("You must supply company_name")
             return
 
         if company_name == 'all':
-            for office in self.session.query(Office).all():
+            for row in self.iter_offices():
                 print('Company: {:15} => Office: {:10}'.
-                      format(office.company.name, office.name))
+                      format(row.company, row.office))
             return
 
         company = self.get_company(company_name)
@@ -187,10 +808,11 @@ class Manager():
             LOG.error("Company does not Exists: %s", company_name)
             return
 
-        for office in company.offices:
+        for row in self.iter_offices(company_name=company_name):
             print('Office in company {} => {}'
-                  .format(company_name, office.name))
+                  .format(company_name, row.office))
 
+    @audited()
     def add_group(self, group_name=None, company_name=None, office_name=None):
         # Add a group to company.office
         company = self.get_company(company_name)
@@ -203,10 +825,12 @@ class Manager():
             LOG.error("Missing office: %s", office_name)
             return
 
-        for group in company.groups:
-            if group.name == group_name:
-                LOG.error("Group already exists: %s", group_name)
-                return
+        exists = (self.session.query(Group.id)
+                  .filter(Group.company_id == company.id,
+                          Group.name == group_name).first())
+        if exists:
+            LOG.error("Group already exists: %s", group_name)
+            return
 
         try:
             group = Group(name=group_name, company=company, office=office)
@@ -218,60 +842,88 @@ class Manager():
             LOG.error("Problem adding group: %s: %s", group_name, ex)
 
         else:
+            self._bump('group')
             return group
 
+    @audited()
     def del_group(self, group_name=None, company_name=None, office_name=None):
         if not office_name or not company_name:
             LOG.error("You must supply office_name and company_name")
             return
 
-        query = self.session.query(Group).filter(Group.name==group_name,
-                                                 Office.name==office_name,
-                                                 Company.name==company_name)
-        group = query.one_or_none()
+        group = self._group_query(group_name, company_name, office_name,
+                                  'bulk-write').one_or_none()
         if not group:
             LOG.error("Group doesnt exists: %s", group_name)
             return
 
         try:
+            host_ids = self.session.execute(
+                association_table.delete()
+                .where(association_table.c.group_id == group.id)
+                .returning(association_table.c.host_id)).scalars().all()
+            variables.forget(self.session, 'group', [group.id])
+            loading.mark_empty(group, 'hosts')
             self.session.delete(group)
+            self.session.flush()
+            reindex_hosts(self.session, host_ids)
             self.session.commit()
 
         except Exception as ex:
             self.session.rollback()
             LOG.error("Problem deleting group: %s: %s", group_name, ex)
 
+        else:
+            self._bump('group', 'association', 'group_var')
+
     def get_group(self, group_name, company_name=None, office_name=None):
         if not group_name or not company_name:
             LOG.error("You must supply group_name and company_name")
             return
 
-        company = self.get_company(company_name)
-        if not company:
-            LOG.error("Company does not Exists: %s", company_name)
+        if not office_name:
+            LOG.error("Missing office: %s", office_name)
             return
 
-        office = self.get_office(office_name, company_name=company_name)
-        if not office:
+        group = self._group_query(group_name, company_name,
+                                  office_name).one_or_none()
+        if not group and not self.get_office(office_name,
+                                             company_name=company_name):
             LOG.error("Missing office: %s", office_name)
             return
 
-        for group in company.groups:
-            if group.name == group_name:
-                return group
+        return group
 
     def get_groups(self, company_name=None, office_name=None):
-        company = self.get_company(company_name)
-        if not company:
-            LOG.error("Company does not Exists: %s", company_name)
+        if not office_name or not company_name:
+            LOG.error("You must supply office_name and company_name")
             return
 
-        office = self.get_office(office_name, company_name=company_name)
+        office = self._office_query(
+            office_name, company_name, 'single-object',
+            (Office.company, Company.groups)).one_or_none()
         if not office:
             LOG.error("Missing office: %s", office_name)
             return
 
-        return company.groups
+        return office.company.groups
+
+    def iter_groups(self, company_name=None, office_name=None, after=None,
+                    limit=None, like=None, page_size=PAGE_SIZE):
+        """Yield (company, office, group) rows, see iter_companies()."""
+        query = (self.session.query(Company.name.label('company'),
+                                    Office.name.label('office'),
+                                    Group.name.label('group'))
+                 .join(Office, Group.office_id == Office.id)
+                 .join(Company, Office.company_id == Company.id))
+        if company_name:
+            query = query.filter(Company.name == company_name)
+        if office_name:
+            query = query.filter(Office.name == office_name)
+        if like:
+            query = query.filter(Group.name.like(like))
+        return _keyset(query, [Company.name, Office.name, Group.name],
+                       after, limit, page_size)
 
     def list_groups(self, company_name='all', office_name='all'):
         if not company_name:
@@ -279,40 +931,61 @@ class Manager():
             return
 
         if company_name == 'all':
-            for group in self.session.query(Group).all():
-                print('Company: {:15} : Office: {:10} => Group: {:10}'
-                      .format(group.company.name,
-                              group.office.name,
-                              group.name))
-            return
+            rows = self.iter_groups()
 
-        company = self.get_company(company_name)
-        if not company:
-            LOG.error("Company does not Exists: %s", company_name)
-            return
+        else:
+            company = self.get_company(company_name)
+            if not company:
+                LOG.error("Company does not Exists: %s", company_name)
+                return
 
-        office = self.get_office(office_name, company_name=company_name)
-        if not office:
-            LOG.error("Office does not Exists: %s", office_name)
-            return
+            office = self.get_office(office_name, company_name=company_name)
+            if not office:
+                LOG.error("Office does not Exists: %s", office_name)
+                return
 
-        for group in office.groups:
+            rows = self.iter_groups(company_name=company_name,
+                                    office_name=office_name)
+
+        for row in rows:
             print('Company: {:15} : Office: {:10} => Group: {:10}'
-                  .format(group.company.name,
-                          group.office.name,
-                          group.name))
+                  .format(row.company, row.office, row.group))
+
+    def iter_hosts(self, company_name=None, office_name=None,
+                   group_name=None, after=None, limit=None, like=None,
+                   page_size=PAGE_SIZE):
+        """Yield (company, office, host) rows, see iter_companies().
+
+        With group_name only the members of that group are returned.
+        """
+        query = (self.session.query(Company.name.label('company'),
+                                    Office.name.label('office'),
+                                    Host.name.label('host'))
+                 .join(Office, Host.office_id == Office.id)
+                 .join(Company, Office.company_id == Company.id))
+        if company_name:
+            query = query.filter(Company.name == company_name)
+        if office_name:
+            query = query.filter(Office.name == office_name)
+        if group_name:
+            members = (select(association_table.c.host_id)
+                       .join(Group, association_table.c.group_id == Group.id)
+                       .where(Group.office_id == Office.id,
+                              Group.name == group_name))
+            query = query.filter(Host.id.in_(members))
+        if like:
+            query = query.filter(Host.name.like(like))
+        return _keyset(query, [Company.name, Office.name, Host.name],
+                       after, limit, page_size)
 
     def get_hosts(self, company_name=None, office_name=None):
         if not company_name:
             LOG.error("You must supply company_name")
             return
 
-        company = self.get_company(company_name)
-        if not company:
-            LOG.error("Missing company: %s", company_name)
-            return
-
-        office = self.get_office(office_name, company_name=company_name)
+        # Many hosts: one more SELECT beats repeating the office per host
+        office = self._office_query(office_name, company_name, 'export',
+                                    (Office.hosts,)).one_or_none()
         if not office:
             LOG.error("Missing office: %s", office_name)
             return
@@ -320,10 +993,14 @@ class Manager():
         return office.hosts
 
     def get_host(self, hostname, company_name=None, office_name=None):
-        for host in self.get_hosts(company_name=company_name, office_name=office_name):
-            if host.name == hostname:
-                return host
+        if not company_name or not office_name:
+            LOG.error("You must supply company_name and office_name")
+            return
 
+        return self._host_query(hostname, company_name,
+                                office_name).one_or_none()
+
+    @audited()
     def add_host(self, hostname=None, company_name=None, office_name=None, group_names=None):
         # Test for existence of company, office, groups
         if not company_name:
@@ -349,18 +1026,20 @@ class Manager():
             return
 
         # Ensure the group_names are correct
-        groups = []
-        for grp in office.groups:
-            if grp.name in group_names:
-                groups.append(grp)
-            else:
-                LOG.error("Missing group: %s", grp.name)
-                return
+        groups = (self.session.query(Group)
+                  .filter(Group.office_id == office.id,
+                          Group.name.in_(group_names)).all())
+        missing = set(group_names) - set(group.name for group in groups)
+        if missing:
+            LOG.error("Missing group: %s", ', '.join(sorted(missing)))
+            return
 
         try:
             # We've identified company, office, groups: We can attempt to add host.
             host = Host(name=hostname, company=company, office=office, groups=groups)
             self.session.add(host)
+            self.session.flush()
+            reindex_hosts(self.session, [host.id])
             self.session.commit()
 
         except Exception as ex:
@@ -368,25 +1047,261 @@ class Manager():
             LOG.error("Problem adding host: %s", ex)
 
         else:
+            self._bump('host', 'association')
             return host
 
+    @audited()
     def del_host(self, hostname=None, company_name=None, office_name=None):
         if not office_name or not company_name:
             LOG.error("You must supply office_name and company_name")
             return
 
-        query = self.session.query(Host).filter(Host.name==hostname,
-                                                Office.name==office_name,
-                                                Company.name==company_name)
-        host = query.one_or_none()
+        host = self._host_query(hostname, company_name, office_name,
+                                'bulk-write').one_or_none()
         if not host:
             LOG.error("Host doesnt exists: %s", hostname)
             return
 
         try:
+            host_id = host.id
+            facts.forget_hosts(self.session, [host_id])
+            self.session.execute(association_table.delete().where(
+                association_table.c.host_id == host_id))
+            loading.mark_empty(host, 'groups')
             self.session.delete(host)
+            self.session.flush()
+            reindex_hosts(self.session, [host_id])
             self.session.commit()
 
         except Exception as ex:
             self.session.rollback()
             LOG.error("Problem deleting host: %s: %s", hostname, ex)
+
+        else:
+            self._bump('host', 'association', 'host_var')
+
+    # -------------------------------------------------------------------------
+    # Bulk moves and renames (see moves.py)
+    # -------------------------------------------------------------------------
+    @audited()
+    def move_hosts(self, selector=None, to_company=None, to_office=None,
+                   group_mapping=None):
+        """Move the hosts of selector to another office in one transaction.
+
+        selector is a dict of company_name, office_name, group_name,
+        hostnames and like (see moves.select_hosts). The hosts keep their
+        variables; their groups are remapped by name onto the groups of
+        to_office, through group_mapping {group: target group or None}.
+        Nothing moves when a host name is taken in to_office or a target
+        group is missing. Returns the number of hosts moved.
+        """
+        if not selector or not selector.get('company_name'):
+            LOG.error("You must supply a selector with a company_name")
+            return
+
+        if not to_company or not to_office:
+            LOG.error("You must supply to_company and to_office")
+            return
+
+        office = self._office_query(to_office, to_company).one_or_none()
+        if not office:
+            LOG.error("Office doesnt exists: %s", to_office)
+            return
+
+        try:
+            hosts = moves.select_hosts(self.session, selector)
+        except moves.MoveError as ex:
+            LOG.error("%s", ex)
+            return
+        if not hosts:
+            LOG.error("No hosts selected: %s", selector)
+            return
+
+        try:
+            moved = moves.move_hosts(self.session, hosts, office,
+                                     group_mapping)
+            self.session.commit()
+
+        except moves.MoveError as ex:
+            self.session.rollback()
+            LOG.error("Cannot move hosts: %s", ex)
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem moving hosts: %s", ex)
+
+        else:
+            self._bump('host', 'association')
+            return moved
+
+    @audited()
+    def rename_hosts(self, mapping=None, company_name=None,
+                     office_name=None):
+        """Rename hosts after mapping {old name: new name} in one transaction.
+
+        Only the hosts of company_name and office_name are renamed, if
+        given. Nothing is renamed when a new name is taken in its office.
+        Returns the number of hosts renamed.
+        """
+        if not mapping or not all(mapping.values()):
+            LOG.error("You must supply a mapping of host names")
+            return
+
+        hosts = moves.select_hosts(self.session, {
+            'company_name': company_name, 'office_name': office_name,
+            'hostnames': sorted(mapping)})
+        missing = set(mapping) - set(host.name for host in hosts)
+        if missing:
+            LOG.error("Host doesnt exists: %s", ', '.join(sorted(missing)))
+            return
+
+        try:
+            renamed = moves.rename_hosts(self.session, hosts, mapping)
+            self.session.commit()
+
+        except moves.MoveError as ex:
+            self.session.rollback()
+            LOG.error("Cannot rename hosts: %s", ex)
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem renaming hosts: %s", ex)
+
+        else:
+            self._bump('host')
+            return renamed
+
+    # -------------------------------------------------------------------------
+    # Idempotent, race-free ensure_* (see upsert.py)
+    # -------------------------------------------------------------------------
+    def _upsert(self, changed, table, **values):
+        """Return the id of the row of values in table, adding it if needed.
+
+        The table name is appended to changed when the row is inserted.
+        """
+        id, inserted = upsert(self.session, table, **values)
+        if inserted:
+            changed.append(table.name)
+        return id
+
+    def _upsert_office(self, changed, office_name, company_name):
+        """Return (company_id, office_id), adding what is missing."""
+        company_id = self._upsert(changed, Company.__table__,
+                                  name=company_name)
+        office_id = self._upsert(changed, Office.__table__,
+                                 name=office_name, company_id=company_id)
+        return company_id, office_id
+
+    # The ensure_* calls only bump the revision (and so are only audited)
+    # when they added a row: repeating one invalidates no cache.
+
+    @audited()
+    def ensure_company(self, company_name=None):
+        """Return the id of company_name, adding the company if needed."""
+        if not company_name:
+            LOG.error("You must supply company_name")
+            return
+
+        changed = []
+        try:
+            company_id = self._upsert(changed, Company.__table__,
+                                      name=company_name)
+            self.session.commit()
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem ensuring company: %s: %s", company_name, ex)
+
+        else:
+            if changed:
+                self._bump(*changed)
+            return company_id
+
+    @audited()
+    def ensure_office(self, office_name=None, company_name=None):
+        """Return the id of the office, adding it and its company if needed."""
+        if not office_name or not company_name:
+            LOG.error("You must supply office_name and company_name")
+            return
+
+        changed = []
+        try:
+            _, office_id = self._upsert_office(changed, office_name,
+                                               company_name)
+            self.session.commit()
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem ensuring office: %s: %s", office_name, ex)
+
+        else:
+            if changed:
+                self._bump(*changed)
+            return office_id
+
+    @audited()
+    def ensure_group(self, group_name=None, company_name=None,
+                     office_name=None):
+        """Return the id of the group, adding it and its parents if needed."""
+        if not group_name or not office_name or not company_name:
+            LOG.error("You must supply group_name, office_name and "
+                      "company_name")
+            return
+
+        changed = []
+        try:
+            company_id, office_id = self._upsert_office(changed, office_name,
+                                                        company_name)
+            group_id = self._upsert(changed, Group.__table__,
+                                    name=group_name, company_id=company_id,
+                                    office_id=office_id)
+            self.session.commit()
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem ensuring group: %s: %s", group_name, ex)
+
+        else:
+            if changed:
+                self._bump(*changed)
+            return group_id
+
+    @audited()
+    def ensure_host(self, hostname=None, company_name=None, office_name=None,
+                    group_names=None):
+        """Return the id of the host, adding it and its parents if needed.
+
+        The host is added to group_names (creating missing groups); existing
+        group memberships are kept.
+        """
+        if not hostname or not office_name or not company_name:
+            LOG.error("You must supply hostname, office_name and "
+                      "company_name")
+            return
+
+        changed = []
+        try:
+            company_id, office_id = self._upsert_office(changed, office_name,
+                                                        company_name)
+            host_id = self._upsert(changed, Host.__table__,
+                                   name=hostname, company_id=company_id,
+                                   office_id=office_id)
+            group_ids = [self._upsert(changed, Group.__table__,
+                                      name=group_name, company_id=company_id,
+                                      office_id=office_id)
+                         for group_name in group_names or ()]
+            if add_memberships(self.session, host_id, group_ids):
+                changed.append(association_table.name)
+            if 'host' in changed or 'association' in changed:
+                # The index documents list the groups of the host
+                reindex_hosts(self.session, [host_id])
+            self.session.commit()
+
+        except Exception as ex:
+            self.session.rollback()
+            LOG.error("Problem ensuring host: %s: %s", hostname, ex)
+
+        else:
+            if changed:
+                self._bump(*changed)
+            return host_id
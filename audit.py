@@ -0,0 +1,205 @@
+"""Asynchronous audit log of inventory mutations.
+
+Manager methods decorated with @audited hand one small record per committed
+change (method, arguments, actor, before/after keys) to an AuditLog.  The
+AuditLog only puts it on an in-process queue; a background thread drains
+the queue in batches into a sink, so the write latency of the Manager
+methods is unaffected by the audit writes.
+
+Sinks:
+
+* JsonlSink(path): appends one JSON document per line to path.
+* TableSink(engine): appends rows to the ``audit_log`` table.  It uses its
+  own connections, so it needs a file backed (not ``sqlite://``) database.
+
+The queue is bounded: when it is full record() blocks (block=True, the
+default) until the writer catches up, or drops the record and counts it in
+AuditLog.dropped (block=False).
+
+    audit = AuditLog(JsonlSink('/var/log/inventory-audit.jsonl'))
+    manager = Manager(engine, audit=audit, actor='provisioning')
+    ...
+    manager.close()     # flushes the records of the manager
+    audit.close()       # stops the writer thread
+
+The AuditLog belongs to its creator: Managers (and the shards of a
+ShardedManager) may share one and only flush it.  record() raises once it
+is closed.
+"""
+
+import functools
+import inspect
+import json
+import logging
+import queue
+import threading
+import time
+
+from inventory import audit_log_table
+
+LOG = logging.getLogger('Manager')
+
+# Name arguments that make up the key of the object a method changes
+KEY_ARGUMENTS = ('company_name', 'office_name', 'group_name', 'hostname')
+
+_STOP = object()
+
+
+class JsonlSink(object):
+    """Append audit records to a JSON lines file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, records):
+        with open(self.path, 'a') as audit_file:
+            for record in records:
+                audit_file.write(json.dumps(record, sort_keys=True,
+                                            default=str))
+                audit_file.write('\n')
+
+
+class TableSink(object):
+    """Append audit records to the audit_log table."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def write(self, records):
+        rows = [{'timestamp': record['timestamp'],
+                 'actor': record['actor'],
+                 'method': record['method'],
+                 'arguments': json.dumps(record['arguments'], sort_keys=True,
+                                         default=str),
+                 'before': json.dumps(record['before']),
+                 'after': json.dumps(record['after'])}
+                for record in records]
+        with self.engine.begin() as conn:
+            conn.execute(audit_log_table.insert(), rows)
+
+
+class AuditLog(object):
+    """Bounded queue of audit records drained by a writer thread."""
+
+    def __init__(self, sink, max_queue=10000, batch_size=500,
+                 flush_interval=0.5, block=True):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = block
+        self.dropped = 0
+        self.written = 0
+        self.closed = False
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run,
+                                        name='inventory-audit')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, method, arguments, actor=None, before=None, after=None,
+               timestamp=None):
+        """Queue one mutation; only blocks when the queue is full."""
+        if self.closed:
+            raise RuntimeError("The audit log is closed, {} not recorded"
+                               .format(method))
+        record = {'timestamp': timestamp or time.time(),
+                  'actor': actor,
+                  'method': method,
+                  'arguments': arguments,
+                  'before': before,
+                  'after': after}
+        try:
+            self._queue.put(record, block=self.block)
+        except queue.Full:
+            self.dropped += 1
+            LOG.warning("Audit queue full, dropped %s record", method)
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            stop = item is _STOP
+            if not stop:
+                batch.append(item)
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            if batch:
+                try:
+                    self.sink.write(batch)
+                    self.written += len(batch)
+                except Exception as ex:
+                    LOG.error("Problem writing %s audit records: %s",
+                              len(batch), ex)
+            for _ in range(len(batch) + (1 if stop else 0)):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """Wait until every queued record has been written."""
+        self._queue.join()
+
+    def close(self):
+        """Flush and stop the writer thread."""
+        self.closed = True
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+
+def _key(arguments):
+    key = [arguments[name] for name in KEY_ARGUMENTS if arguments.get(name)]
+    return key or None
+
+
+def audited(describe=None):
+    """Decorate a Manager method to audit the changes it commits.
+
+    A call is recorded when it bumped the Manager's data revision.  Inside
+    Manager.batch() the records wait in Manager.pending_audit until the
+    batch commits, and are dropped if it rolls back.
+    add_* methods record the object key as after, del_* as before and
+    other methods as both.  describe(arguments, result), if given, returns
+    the (arguments, before, after) to record instead.
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.audit is None:
+                return method(self, *args, **kwargs)
+            revision = self.revision
+            result = method(self, *args, **kwargs)
+            if self.revision == revision:
+                return result
+
+            bound = signature.bind(self, *args, **kwargs)
+            arguments = dict(bound.arguments)
+            del arguments['self']
+            if describe:
+                arguments, before, after = describe(arguments, result)
+            else:
+                key = _key(arguments)
+                before = None if method.__name__.startswith('add_') else key
+                after = None if method.__name__.startswith('del_') else key
+            record = dict(method=method.__name__, arguments=arguments,
+                          actor=self.actor, before=before, after=after)
+            if self.pending_audit is not None:
+                record['timestamp'] = time.time()
+                self.pending_audit.append(record)
+            else:
+                self.audit.record(**record)
+            return result
+        return wrapper
+    return decorator
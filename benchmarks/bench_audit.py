@@ -0,0 +1,65 @@
+"""Benchmark the per-operation overhead of the audit log.
+
+Times ensure_host() on a file backed database without auditing, with a
+JSONL sink and with the audit_log table sink.
+
+    python -m benchmarks.bench_audit [operations]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from audit import AuditLog, JsonlSink, TableSink
+from Manager import create_manager
+
+
+def run(tmpdir, label, operations, make_audit):
+    path = os.path.join(tmpdir, label + '.db')
+    engine = create_engine('sqlite:///' + path)
+    audit = make_audit(tmpdir, engine)
+    manager = create_manager(engine, audit=audit, actor='bench')
+    start = time.time()
+    for number in range(operations):
+        manager.ensure_host(hostname='host{}'.format(number),
+                            company_name='Acme', office_name='Austin',
+                            group_names=['IT'])
+    elapsed = time.time() - start
+    manager.close()
+    if audit:
+        audit.close()
+    total = time.time() - start
+    engine.dispose()
+    return elapsed, total
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    operations = int(argv[0]) if argv else 1000
+    tmpdir = tempfile.mkdtemp()
+    sinks = (
+        ('none', lambda tmpdir, engine: None),
+        ('jsonl', lambda tmpdir, engine: AuditLog(
+            JsonlSink(os.path.join(tmpdir, 'audit.jsonl')))),
+        ('table', lambda tmpdir, engine: AuditLog(TableSink(engine))),
+    )
+    try:
+        baseline = None
+        for label, make_audit in sinks:
+            elapsed, total = run(tmpdir, label, operations, make_audit)
+            per_op = elapsed * 1e6 / operations
+            baseline = per_op if baseline is None else baseline
+            print('{:6} {:8.1f} us/op  overhead {:+6.1f} us/op  '
+                  '(incl. final flush {:.3f} s)'.format(
+                      label, per_op, per_op - baseline, total))
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""Cold-start benchmark: create_manager() against an existing database.
+
+Compares the schema version check done by Manager.__init__ with the old
+Base.metadata.create_all() on every start.  Each iteration uses a fresh
+engine, like a short-lived inventory script would.
+
+    python -m benchmarks.bench_cold_start [iterations]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from inventory import Base
+from Manager import create_manager
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    iterations = int(argv[0]) if argv else 200
+    tmpdir = tempfile.mkdtemp()
+    url = 'sqlite:///' + os.path.join(tmpdir, 'inventory.db')
+    try:
+        manager = create_manager(create_engine(url))
+        manager.add_company('Acme')
+        manager.session.close()
+
+        def version_check():
+            engine = create_engine(url)
+            create_manager(engine).session.close()
+            engine.dispose()
+
+        def create_all():
+            # What Manager.__init__ did before schema versioning
+            engine = create_engine(url)
+            session = sessionmaker(bind=engine)()
+            Base.metadata.create_all(engine)
+            session.close()
+            engine.dispose()
+
+        for name, func in (('create_all', create_all),
+                           ('version check', version_check)):
+            seconds = timeit.timeit(func, number=iterations)
+            print('{:15} {:8.3f} ms/start'.format(
+                name, seconds * 1000.0 / iterations))
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""Compare export size and speed of every format on a large inventory.
+
+    python -m benchmarks.bench_export [hosts]
+"""
+
+import io
+import sys
+import time
+
+from sqlalchemy import create_engine
+
+import export
+from benchmarks.bench_sync import make_spec
+from Manager import create_manager
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    hosts = int(argv[0]) if argv else 50000
+    manager = create_manager(create_engine('sqlite://'))
+    manager.sync(make_spec(hosts))
+
+    for format in sorted(export.WRITERS):
+        if format == 'msgpack' and export.msgpack is None:
+            print('{:8} skipped: msgpack is not installed'.format(format))
+            continue
+        binary = export.WRITERS[format][1]
+        out = io.BytesIO() if binary else io.StringIO()
+        start = time.time()
+        manager.export(format, out=out)
+        elapsed = time.time() - start
+        size = len(out.getvalue())
+        if not binary:
+            size = len(out.getvalue().encode('utf-8'))
+        print('{:8} {:8.3f} s {:10} bytes'.format(format, elapsed, size))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Compare fact-cache ingestion with per-host ORM updates.
+
+Writes one Ansible jsonfile fact file per host, then times a per-host ORM
+loop, ingest_facts() with threads and processes, and a second run over the
+unchanged cache.
+
+    python -m benchmarks.bench_facts [hosts]
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+import facts
+from inventory import Host, HostVar
+from Manager import create_manager
+
+
+def fact_document(number):
+    # About the size of real gathered facts: most of it isn't kept
+    document = dict(('ansible_extra_{}'.format(key), 'x' * 100)
+                    for key in range(200))
+    document.update({
+        'ansible_all_ipv4_addresses': ['10.0.{}.{}'.format(number // 250,
+                                                          number % 250)],
+        'ansible_distribution': 'Debian',
+        'ansible_distribution_version': '12',
+        'ansible_kernel': '6.1.0',
+        'ansible_memtotal_mb': 2048 + number,
+        'ansible_processor_vcpus': 4,
+    })
+    return document
+
+
+def orm_ingest(manager, directory):
+    """The naive way: one query per host and per fact."""
+    session = manager.session
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name)) as fact_file:
+            document = json.load(fact_file)
+        for host in session.query(Host).filter(Host.name == name):
+            for key in facts.KEYS:
+                if key not in document:
+                    continue
+                var = (session.query(HostVar)
+                       .filter(HostVar.host_id == host.id,
+                               HostVar.key == key).one_or_none())
+                if var is None:
+                    var = HostVar(host_id=host.id, key=key)
+                    session.add(var)
+                var.value = json.dumps(document[key], sort_keys=True)
+            session.commit()
+
+
+def timed(label, hosts, function):
+    start = time.time()
+    report = function()
+    elapsed = time.time() - start
+    print('{:20} {:8.3f} s {:10.0f} files/s'.format(label, elapsed,
+                                                     hosts / elapsed))
+    return report
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    hosts = int(argv[0]) if argv else 5000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        directory = os.path.join(tmpdir, 'facts')
+        os.mkdir(directory)
+        names = ['host{}'.format(number) for number in range(hosts)]
+        for number, name in enumerate(names):
+            with open(os.path.join(directory, name), 'w') as fact_file:
+                json.dump(fact_document(number), fact_file)
+        spec = {'Acme': {'Austin': {'all': names}}}
+
+        def manager(label):
+            engine = create_engine(
+                'sqlite:///' + os.path.join(tmpdir, label + '.db'))
+            manager = create_manager(engine)
+            manager.sync(spec)
+            return manager
+
+        orm = manager('orm')
+        timed('per-host ORM', hosts, lambda: orm_ingest(orm, directory))
+
+        threads = manager('threads')
+        timed('ingest, threads', hosts,
+              lambda: threads.ingest_facts(directory))
+        timed('re-run, unchanged', hosts,
+              lambda: threads.ingest_facts(directory))
+
+        processes = manager('processes')
+        timed('ingest, processes', hosts,
+              lambda: processes.ingest_facts(directory, processes=True))
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
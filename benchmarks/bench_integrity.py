@@ -0,0 +1,61 @@
+"""Benchmark Manager.check_integrity() on a million association rows.
+
+    python -m benchmarks.bench_integrity [hosts] [groups per host]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from inventory import association_table, Company, Group, Host, Office
+from Manager import create_manager
+
+
+def populate(engine, hosts, groups_per_host, offices=10, groups=50):
+    with engine.begin() as conn:
+        conn.execute(Company.__table__.insert(), [{'id': 1, 'name': 'Acme'}])
+        conn.execute(Office.__table__.insert(),
+                     [{'id': o, 'name': 'office{}'.format(o),
+                       'company_id': 1} for o in range(offices)])
+        conn.execute(Group.__table__.insert(),
+                     [{'id': o * groups + g, 'name': 'group{}'.format(g),
+                       'company_id': 1, 'office_id': o}
+                      for o in range(offices) for g in range(groups)])
+        conn.execute(Host.__table__.insert(),
+                     [{'id': h, 'name': 'host{}'.format(h), 'company_id': 1,
+                       'office_id': h % offices} for h in range(hosts)])
+        conn.execute(association_table.insert(),
+                     [{'host_id': h,
+                       'group_id': (h % offices) * groups + (h + i) % groups}
+                      for h in range(hosts) for i in range(groups_per_host)])
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    hosts = int(argv[0]) if argv else 100000
+    groups_per_host = int(argv[1]) if len(argv) > 1 else 10
+    tmpdir = tempfile.mkdtemp()
+    try:
+        engine = create_engine(
+            'sqlite:///' + os.path.join(tmpdir, 'inventory.db'))
+        manager = create_manager(engine)
+        start = time.time()
+        populate(engine, hosts, groups_per_host)
+        print('populate {} association rows: {:.3f} s'.format(
+            hosts * groups_per_host, time.time() - start))
+
+        start = time.time()
+        findings = manager.check_integrity()
+        print('check_integrity: {:.3f} s, {} findings'.format(
+            time.time() - start, len(findings)))
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""Compare default lazy loading with the loading profiles of loading.py.
+
+Runs each read or delete once with lazy loading (relationships loaded on
+access, or by the flush for deletes) and once with its profile, counting
+the statements and timing them:
+
+* get_offices, get_groups and get_hosts of one office, as the Manager
+  methods were written before and after the profiles (get_hosts uses
+  'export': joining thousands of hosts to their office is slower than a
+  second SELECT);
+* walking every company, office, group and host ('export');
+* deleting a large group and a host ('bulk-write'), up to the flush.
+
+    python -m benchmarks.bench_loading [hosts]
+"""
+
+import sys
+import time
+
+from sqlalchemy import create_engine, event, select
+
+import loading
+from inventory import association_table, Company, Group, Host, Office
+from Manager import create_manager
+
+
+def make_spec(hosts, offices=10, groups=10):
+    spec = {}
+    for number in range(hosts):
+        company = spec.setdefault(('Acme', 'Bell')[number % 2], {})
+        office = company.setdefault('office{}'.format(number % offices), {})
+        for group in (number % groups, (number + 1) % groups):
+            office.setdefault('group{}'.format(group), []).append(
+                'host{}'.format(number))
+    return spec
+
+
+def load(manager, query, profile=None, *paths):
+    if profile:
+        query = query.options(*loading.options(profile, *paths))
+    return manager.session.execute(query).unique().scalar_one()
+
+
+def company(manager, *args):
+    return load(manager, select(Company).where(Company.name == 'Acme'),
+                *args)
+
+
+def office(manager, *args):
+    return load(manager, select(Office)
+                .join(Company, Office.company_id == Company.id)
+                .where(Company.name == 'Acme', Office.name == 'office0'),
+                *args)
+
+
+def walk(manager, *args):
+    query = select(Company)
+    if args:
+        query = query.options(*loading.options(*args))
+    return sum(len(group.hosts)
+               for company in manager.session.execute(query).scalars()
+               for office in company.offices for group in office.groups)
+
+
+def delete(manager, model, name, collection, column, bulk=False):
+    query = (select(model).join(Office, model.office_id == Office.id)
+             .where(Office.name == 'office0', model.name == name,
+                    model.company_id == company(manager).id))
+    row = load(manager, query, 'bulk-write' if bulk else None)
+    if bulk:
+        manager.session.execute(association_table.delete().where(
+            column == row.id))
+        loading.mark_empty(row, collection)
+    manager.session.delete(row)
+    manager.session.flush()
+
+
+GROUP = (Group, 'group0', 'hosts', association_table.c.group_id)
+HOST = (Host, 'host20', 'groups', association_table.c.host_id)
+
+CASES = [
+    ('get_offices', lambda m: company(m).offices,
+     lambda m: company(m, 'single-object', (Company.offices,)).offices),
+    ('get_groups', lambda m: office(m).company.groups,
+     lambda m: office(m, 'single-object',
+                      (Office.company, Company.groups)).company.groups),
+    ('get_hosts', lambda m: office(m).hosts,
+     lambda m: office(m, 'export', (Office.hosts,)).hosts),
+    ('export walk', walk,
+     lambda m: walk(m, 'export', (Company.offices, Office.groups,
+                                  Group.hosts))),
+    ('del_group', lambda m: delete(m, *GROUP),
+     lambda m: delete(m, *GROUP, bulk=True)),
+    ('del_host', lambda m: delete(m, *HOST),
+     lambda m: delete(m, *HOST, bulk=True)),
+]
+
+
+def timed(engine, manager, function, repeat=5):
+    """Return the best time of function and its number of statements."""
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    best = None
+    event.listen(engine, 'before_cursor_execute', count)
+    for _ in range(repeat):
+        start = time.time()
+        function(manager)
+        elapsed = time.time() - start
+        manager.session.rollback()
+        best = elapsed if best is None else min(best, elapsed)
+    event.remove(engine, 'before_cursor_execute', count)
+    return best, len(statements) // repeat
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    hosts = int(argv[0]) if argv else 20000
+    engine = create_engine('sqlite://')
+    manager = create_manager(engine)
+    manager.sync(make_spec(hosts))
+
+    print('{:12} {:>21} {:>21}'.format('', 'lazy', 'profile'))
+    for label, lazy, profiled in CASES:
+        results = [timed(engine, manager, function)
+                   for function in (lazy, profiled)]
+        print('{:12} {}'.format(label, ' '.join(
+            '{:8.1f} ms {:5} stmt'.format(elapsed * 1000, statements)
+            for elapsed, statements in results)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
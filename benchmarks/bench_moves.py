@@ -0,0 +1,83 @@
+"""Compare per-host del_host + add_host with move_hosts and rename_hosts.
+
+Moves every host of one office to another office with the same groups,
+first the old way (del_host then add_host per host, which also loses the
+host's variables) and then with one move_hosts() call, counting the
+statements each runs.  Then renames every moved host with rename_hosts().
+
+    python -m benchmarks.bench_moves [hosts]
+"""
+
+import sys
+import time
+
+from sqlalchemy import create_engine, event
+
+from Manager import create_manager
+
+GROUPS = ['group{}'.format(number) for number in range(4)]
+
+
+def make_spec(hosts):
+    spec = {}
+    for office in ('source', 'target'):
+        groups = spec.setdefault('Acme', {}).setdefault(office, {})
+        for group in GROUPS:
+            groups[group] = []
+    for number in range(hosts):
+        for group in (GROUPS[number % 4], GROUPS[(number + 1) % 4]):
+            spec['Acme']['source'][group].append('host{}'.format(number))
+    return spec
+
+
+def timed(label, engine, function):
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    start = time.time()
+    function()
+    elapsed = time.time() - start
+    event.remove(engine, 'before_cursor_execute', count)
+    print('{:24} {:8.3f} s {:8} statements'.format(label, elapsed,
+                                                   len(statements)))
+
+
+def del_add(manager, hosts):
+    for row in list(manager.iter_hosts(company_name='Acme',
+                                       office_name='source')):
+        groups = [group for group in GROUPS if row.host in hosts[group]]
+        manager.del_host(hostname=row.host, company_name='Acme',
+                         office_name='source')
+        manager.add_host(hostname=row.host, company_name='Acme',
+                         office_name='target', group_names=groups)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    hosts = int(argv[0]) if argv else 1000
+    spec = make_spec(hosts)
+
+    engine = create_engine('sqlite://')
+    manager = create_manager(engine)
+    manager.sync(spec)
+    timed('del_host + add_host', engine,
+          lambda: del_add(manager, spec['Acme']['source']))
+
+    engine = create_engine('sqlite://')
+    manager = create_manager(engine)
+    manager.sync(spec)
+    timed('move_hosts', engine, lambda: manager.move_hosts(
+        {'company_name': 'Acme', 'office_name': 'source'},
+        to_company='Acme', to_office='target'))
+    mapping = dict(('host{}'.format(number), 'renamed{}'.format(number))
+                   for number in range(hosts))
+    timed('rename_hosts', engine, lambda: manager.rename_hosts(
+        mapping, company_name='Acme', office_name='target'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Measure snapshot storage growth and export-at-revision latency.
+
+Takes a snapshot after each of a series of small changes (one host added,
+one group variable changed) to a multi-company inventory.  Prints the bytes
+stored per revision next to what a compressed full JSON export per revision
+would cost, then times exports of the live inventory and of old revisions
+and a diff and a prune.
+
+    python -m benchmarks.bench_snapshots [hosts] [revisions]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+from sqlalchemy import create_engine, func, select
+
+from inventory import snapshot_chunk_table
+from Manager import create_manager
+
+
+def make_spec(hosts, companies=10, offices=5, groups=10):
+    # Unique host names: they don't compress away like host0..hostN
+    spec = {}
+    per_office = max(1, hosts // (companies * offices))
+    for c in range(companies):
+        company = spec.setdefault('company{}'.format(c), {})
+        for o in range(offices):
+            office = company.setdefault('office{}'.format(o), {})
+            for h in range(per_office):
+                host = 'c{}o{}-host{}'.format(c, o, h)
+                for g in (h % groups, (h + 1) % groups):
+                    office.setdefault('group{}'.format(g), []).append(host)
+    return spec
+
+
+def stored(manager):
+    table = snapshot_chunk_table
+    return manager.session.execute(
+        select(func.count(), func.coalesce(func.sum(
+            func.length(table.c.data)), 0))).one()
+
+
+def timed(label, function, repeat=5):
+    start = time.time()
+    for _ in range(repeat):
+        result = function()
+    elapsed = (time.time() - start) / repeat
+    print('{:28} {:8.1f} ms'.format(label, elapsed * 1000))
+    return result
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    hosts = int(argv[0]) if argv else 5000
+    revisions = int(argv[1]) if len(argv) > 1 else 50
+    tmpdir = tempfile.mkdtemp()
+    try:
+        engine = create_engine(
+            'sqlite:///' + os.path.join(tmpdir, 'snapshots.db'))
+        manager = create_manager(engine)
+        manager.sync(make_spec(hosts))
+        manager.set_vars({'ntp': 'pool.ntp.org'}, company_name='company0')
+
+        full = 0
+        start = time.time()
+        first = manager.snapshot()
+        print('first snapshot: {:.3f} s, {} chunks, {} bytes'.format(
+            time.time() - start, *stored(manager)))
+        full += len(zlib.compress(manager.export().encode('utf-8')))
+
+        elapsed = 0
+        for number in range(1, revisions):
+            manager.ensure_host(hostname='new{}'.format(number),
+                                company_name='company0',
+                                office_name='office0',
+                                group_names=['group0'])
+            manager.set_vars({'revision': number}, group_name='group1',
+                             company_name='company1', office_name='office1')
+            start = time.time()
+            last = manager.snapshot()
+            elapsed += time.time() - start
+            full += len(zlib.compress(manager.export().encode('utf-8')))
+        chunks, size = stored(manager)
+        print('{} revisions: {:.3f} s per snapshot, {} chunks, {} bytes '
+              '({:.1f}% of {} bytes of compressed full exports)'.format(
+                  revisions, elapsed / max(revisions - 1, 1), chunks, size,
+                  100.0 * size / full, full))
+
+        timed('export, live', manager.export)
+        timed('export, latest revision',
+              lambda: manager.export(at_revision=last))
+        timed('export, first revision',
+              lambda: manager.export(at_revision=first))
+        timed('diff first..latest',
+              lambda: manager.diff_snapshots(first, last))
+        result = timed('prune, keep 10',
+                       lambda: manager.prune_snapshots(keep=10), repeat=1)
+        print('pruned {snapshots} snapshots, {chunks} chunks'.format(
+            **result))
+        manager.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
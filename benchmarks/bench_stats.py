@@ -0,0 +1,84 @@
+"""Compare dashboard statistics walked over the ORM with Manager.stats().
+
+Computes hosts per company, office and group, the empty groups and the
+hosts in no group by iterating the relationships, then with the aggregate
+queries of stats.compute() and finally with the cached Manager.stats() of
+an unchanged revision, counting the statements each runs.
+
+    python -m benchmarks.bench_stats [hosts]
+"""
+
+import sys
+import time
+
+from sqlalchemy import create_engine, event, select
+
+import stats
+from inventory import Company
+from Manager import create_manager
+
+
+def make_spec(hosts, offices=20, groups=10):
+    spec = {}
+    for number in range(hosts):
+        company = spec.setdefault('company{}'.format(number % 2), {})
+        office = company.setdefault('office{}'.format(number % offices), {})
+        for group in range(groups):
+            office.setdefault('group{}'.format(group), [])
+        office['group{}'.format(number % (groups - 1))].append(
+            'host{}'.format(number))
+    return spec
+
+
+def walk(manager):
+    """The ORM way: load every relationship of every company."""
+    result = {'offices': [], 'groups': [], 'empty_groups': [],
+              'ungrouped_hosts': []}
+    for company in manager.session.execute(select(Company)).scalars():
+        for office in company.offices:
+            result['offices'].append((company.name, office.name,
+                                      len(office.hosts)))
+            for group in office.groups:
+                result['groups'].append((group.name, len(group.hosts)))
+                if not group.hosts:
+                    result['empty_groups'].append(group.name)
+            for host in office.hosts:
+                if not host.groups:
+                    result['ungrouped_hosts'].append(host.name)
+    manager.session.expire_all()
+    return result
+
+
+def timed(label, engine, function, repeat=5):
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    start = time.time()
+    for _ in range(repeat):
+        function()
+    elapsed = (time.time() - start) / repeat
+    event.remove(engine, 'before_cursor_execute', count)
+    print('{:24} {:10.2f} ms {:8} statements'.format(
+        label, elapsed * 1000, len(statements) // repeat))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    hosts = int(argv[0]) if argv else 20000
+    engine = create_engine('sqlite://')
+    manager = create_manager(engine)
+    manager.sync(make_spec(hosts))
+
+    timed('ORM relationships', engine, lambda: walk(manager))
+    timed('stats.compute', engine,
+          lambda: stats.compute(manager.session.connection()))
+    manager.stats()
+    timed('Manager.stats (cached)', engine, manager.stats, repeat=1000)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""Benchmark Manager.sync() of a large spec.
+
+Times the initial sync of a generated spec and a re-sync of the same,
+unchanged spec, which should only cost the set-based reads.
+
+    python -m benchmarks.bench_sync [hosts]
+"""
+
+import sys
+import time
+
+from sqlalchemy import create_engine
+
+from Manager import create_manager
+
+
+def make_spec(hosts, companies=10, offices=5, groups=10):
+    spec = {}
+    per_office = max(1, hosts // (companies * offices))
+    for c in range(companies):
+        company = spec.setdefault('company{}'.format(c), {})
+        for o in range(offices):
+            office = company.setdefault('office{}'.format(o), {})
+            for h in range(per_office):
+                host = 'host{}'.format(h)
+                # Every host is in two groups
+                for g in (h % groups, (h + 1) % groups):
+                    office.setdefault('group{}'.format(g), []).append(host)
+    return spec
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    hosts = int(argv[0]) if argv else 50000
+    manager = create_manager(create_engine('sqlite://'))
+    spec = make_spec(hosts)
+
+    for label in ('initial sync', 're-sync'):
+        start = time.time()
+        plan = manager.sync(spec)
+        print('{:15} {:8.3f} s  {}'.format(label, time.time() - start,
+                                           plan.summary()['add']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Compare per-host variable merging with the memoized VariableResolver.
+
+Builds a wide inventory (many hosts per office, few groups per host) and a
+deep one (few hosts, many groups per host), sets variables at every level,
+then times resolving every host's effective variables one query-and-merge
+per host, with iter_effective_vars() and with a JSON export.
+
+    python -m benchmarks.bench_variables [hosts]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, select
+
+import variables
+from inventory import association_table, Company, Group, Host, Office
+from Manager import create_manager
+
+
+def make_spec(hosts, offices, groups, groups_per_host):
+    spec = {}
+    company = spec.setdefault('Acme', {})
+    for number in range(hosts):
+        office = company.setdefault('office{}'.format(number % offices), {})
+        for group in range(groups_per_host):
+            office.setdefault(
+                'group{}'.format((number + group) % groups), []).append(
+                    'host{}'.format(number))
+    return spec
+
+
+def set_variables(manager):
+    """Set 10 variables per company, office and group, 2 per host."""
+    session = manager.session
+    for level, model in (('company', Company), ('office', Office),
+                         ('group', Group)):
+        for owner_id in session.execute(select(model.id)).scalars():
+            variables.set_vars(session, level, owner_id, dict(
+                ('{}_var{}'.format(level, key), [level, owner_id, key])
+                for key in range(10)))
+    for host_id in session.execute(select(Host.id)).scalars():
+        variables.set_vars(session, 'host', host_id,
+                           {'host_id': host_id, 'ansible_port': 22})
+    session.commit()
+    manager._bump(*variables.VAR_TABLES)
+
+
+def naive(manager):
+    """The naive way: load and merge every level for every host."""
+    conn = manager.session.connection()
+    hosts = conn.execute(select(Host.id, Host.company_id,
+                                Host.office_id)).all()
+    order = dict((group_id, (priority, name)) for group_id, priority, name
+                 in conn.execute(select(Group.id, Group.priority,
+                                        Group.name)))
+    for host_id, company_id, office_id in hosts:
+        group_ids = conn.execute(
+            select(association_table.c.group_id)
+            .where(association_table.c.host_id == host_id)).scalars().all()
+        merged = {}
+        merged.update(variables._load(conn, 'company',
+                                      [company_id]).get(company_id, {}))
+        merged.update(variables._load(conn, 'office',
+                                      [office_id]).get(office_id, {}))
+        group_vars = variables._load(conn, 'group', group_ids)
+        for group_id in sorted(group_ids, key=order.get):
+            merged.update(group_vars.get(group_id, {}))
+        merged.update(variables._load(conn, 'host',
+                                      [host_id]).get(host_id, {}))
+    return len(hosts)
+
+
+def timed(label, hosts, function):
+    start = time.time()
+    function()
+    elapsed = time.time() - start
+    print('{:28} {:8.3f} s {:10.0f} hosts/s'.format(label, elapsed,
+                                                     hosts / elapsed))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    hosts = int(argv[0]) if argv else 5000
+    shapes = [('wide', hosts, 10, 20, 2),
+              ('deep', hosts // 10, 2, 40, 30)]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for label, count, offices, groups, groups_per_host in shapes:
+            engine = create_engine(
+                'sqlite:///' + os.path.join(tmpdir, label + '.db'))
+            manager = create_manager(engine)
+            manager.sync(make_spec(count, offices, groups, groups_per_host))
+            set_variables(manager)
+            print('{}: {} hosts, {} groups per host'.format(
+                label, count, groups_per_host))
+
+            timed('  per-host merge', count, lambda: naive(manager))
+
+            def resolve():
+                for _ in manager.iter_effective_vars():
+                    pass
+                print('  {} merges'.format(manager.get_resolver().merges))
+            timed('  iter_effective_vars', count, resolve)
+            timed('  export, cached resolver', count, manager.export)
+            manager.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""Concurrent load test of the Manager against a file-backed database.
+
+Workers (threads, or processes with --processes) each open their own
+Manager and run a weighted mix of operations until --duration is over:
+
+* list:     Manager.export(), an Ansible ``--list``
+* host:     Manager.effective_vars() of a random host, an Ansible ``--host``
+* add_host: ensure_host() of a new host in company0/office0/group0
+* del_host: del_host() of a host the worker added
+
+::
+
+    python -m benchmarks.loadtest --workers 8 --mix list=45,host=45,\\
+        add_host=5,del_host=5 --journal-mode wal --output runs.jsonl
+    python -m benchmarks.loadtest --compare runs.jsonl
+
+Every operation's latency is recorded; the report gives per operation the
+count, throughput, p50/p95/p99/max latency and the rate of "database is
+locked" errors, be they raised or logged by the Manager.  --output appends
+the configuration and report as one JSON line, --compare prints the saved
+runs side by side.
+
+--no-cache opens a new Manager per read, like a dynamic inventory script
+run per Ansible invocation, instead of reusing the worker's Manager and its
+cached graph and variables.  --batch-size groups that many writes in one
+Manager.batch() transaction, recorded as one sample.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+
+from benchmarks.bench_sync import make_spec
+from Manager import create_manager
+
+LOG = logging.getLogger('Manager')
+
+READS = ('list', 'host')
+WRITES = ('add_host', 'del_host')
+DEFAULT_MIX = 'list=45,host=45,add_host=5,del_host=5'
+
+# The office and group the writers add their hosts to
+WRITE_TARGET = {'company_name': 'company0', 'office_name': 'office0'}
+WRITE_GROUP = 'group0'
+
+
+def parse_mix(mix):
+    """Return [(operation, weight)] of 'operation=weight,...'."""
+    weights = []
+    for item in mix.split(','):
+        operation, _, weight = item.partition('=')
+        operation = operation.strip()
+        if operation not in READS + WRITES:
+            raise ValueError("Unknown operation: {}".format(operation))
+        weights.append((operation, float(weight or 1)))
+    return weights
+
+
+def percentile(ordered, fraction):
+    """Return the nearest-rank percentile of an ordered list."""
+    if not ordered:
+        return None
+    rank = max(1, int(math.ceil(fraction * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+# SQLite busy errors, raised or logged by the Manager
+LOCK_ERRORS = ('database is locked', 'database table is locked')
+
+
+def is_lock_error(message):
+    return any(error in message for error in LOCK_ERRORS)
+
+
+class _LockErrors(logging.Handler):
+    """Count, per thread, the lock errors the Manager logs."""
+
+    def __init__(self):
+        logging.Handler.__init__(self, level=logging.ERROR)
+        self.local = threading.local()
+
+    def emit(self, record):
+        if is_lock_error(record.getMessage()):
+            self.local.count = self.count() + 1
+
+    def count(self):
+        return getattr(self.local, 'count', 0)
+
+
+def make_engine(config):
+    return create_engine('sqlite:///' + config['db'],
+                         connect_args={'timeout': config['busy_timeout']})
+
+
+def setup(config):
+    """Create the database of config; return the (host, company, office)s."""
+    engine = make_engine(config)
+    with engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA journal_mode={}'.format(
+            config['journal_mode']))
+    manager = create_manager(engine)
+    try:
+        manager.sync(make_spec(config['hosts']))
+        manager.set_vars({'ntp': 'pool.ntp.org'}, company_name='company0')
+        return [tuple(row) for row in manager.iter_hosts()]
+    finally:
+        manager.close()
+        engine.dispose()
+
+
+class Worker(object):
+    """Run the operation mix of one worker and time every operation."""
+
+    def __init__(self, config, number, hosts, lock_errors):
+        self.config = config
+        self.number = number
+        self.hosts = hosts
+        self.lock_errors = lock_errors
+        self.random = random.Random(config['seed'] + number)
+        self.engine = make_engine(config)
+        self.manager = create_manager(self.engine)
+        self.added = []
+        self.serial = 0
+
+    def close(self):
+        self.manager.close()
+        self.engine.dispose()
+
+    def reader(self):
+        if self.config['cache']:
+            return self.manager
+        return create_manager(self.engine)
+
+    def list(self):
+        manager = self.reader()
+        try:
+            return manager.export() is not None
+        finally:
+            if manager is not self.manager:
+                manager.close()
+
+    def host(self):
+        row = self.random.choice(self.hosts)
+        manager = self.reader()
+        try:
+            return manager.effective_vars(row[2], company_name=row[0],
+                                          office_name=row[1]) is not None
+        finally:
+            if manager is not self.manager:
+                manager.close()
+
+    def add_host(self):
+        self.serial += 1
+        hostname = 'load-{}-{}'.format(self.number, self.serial)
+        if self.manager.ensure_host(hostname=hostname,
+                                    group_names=[WRITE_GROUP],
+                                    **WRITE_TARGET) is None:
+            return False
+        self.added.append(hostname)
+        return True
+
+    def del_host(self):
+        if not self.added:
+            return self.add_host()
+        hostname = self.added.pop(self.random.randrange(len(self.added)))
+        # del_* return None either way: a committed write bumps the revision
+        revision = self.manager.revision
+        self.manager.del_host(hostname=hostname, **WRITE_TARGET)
+        return self.manager.revision != revision
+
+    def run_operation(self, operation):
+        """Return (seconds, status) of one operation.
+
+        status is 'ok', 'locked' or 'error'.
+        """
+        call = getattr(self, operation)
+        batch_size = self.config['batch_size']
+        lock_errors = self.lock_errors.count()
+        start = time.perf_counter()
+        try:
+            if operation in WRITES and batch_size > 1:
+                with self.manager.batch():
+                    ok = all([call() for _ in range(batch_size)])
+            else:
+                ok = call()
+        except Exception as ex:
+            self.manager.session.rollback()
+            status = 'locked' if is_lock_error(str(ex)) else 'error'
+        else:
+            if self.lock_errors.count() != lock_errors:
+                status = 'locked'
+            else:
+                status = 'ok' if ok else 'error'
+        return time.perf_counter() - start, status
+
+    def run(self):
+        operations, weights = zip(*self.config['mix'])
+        deadline = time.time() + self.config['duration']
+        samples = collections.defaultdict(list)
+        while time.time() < deadline:
+            operation = self.random.choices(operations, weights)[0]
+            samples[operation].append(self.run_operation(operation))
+        return dict(samples)
+
+
+_lock_errors = None
+
+
+def _install_lock_errors():
+    global _lock_errors
+    if _lock_errors is None:
+        _lock_errors = _LockErrors()
+        LOG.addHandler(_lock_errors)
+    return _lock_errors
+
+
+def run_worker(config, number, hosts):
+    """Run worker number; return {operation: [(seconds, status)]}."""
+    # The Manager logs every failed write: count them, don't print them
+    LOG.propagate = False
+    worker = Worker(config, number, hosts, _install_lock_errors())
+    try:
+        return worker.run()
+    finally:
+        worker.close()
+
+
+def report(samples, duration):
+    """Return {operation: statistics} of the merged worker samples."""
+    results = {}
+    for operation in sorted(samples):
+        operation_samples = samples[operation]
+        statuses = collections.Counter(status
+                                       for _, status in operation_samples)
+        latencies = sorted(seconds * 1000
+                           for seconds, status in operation_samples
+                           if status == 'ok')
+        count = len(operation_samples)
+        results[operation] = {
+            'count': count,
+            'ok': statuses['ok'],
+            'ops_per_second': statuses['ok'] / duration,
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': latencies[-1] if latencies else None,
+            'lock_errors': statuses['locked'],
+            'lock_error_rate': statuses['locked'] / count,
+            'errors': statuses['error'],
+        }
+    return results
+
+
+def run(config):
+    """Set up the database, run the workers; return the run document."""
+    hosts = setup(config)
+    executor_class = (concurrent.futures.ProcessPoolExecutor
+                      if config['processes']
+                      else concurrent.futures.ThreadPoolExecutor)
+    start = time.time()
+    try:
+        with executor_class(max_workers=config['workers']) as executor:
+            futures = [executor.submit(run_worker, config, number, hosts)
+                       for number in range(config['workers'])]
+            samples = collections.defaultdict(list)
+            for future in futures:
+                for operation, operation_samples in future.result().items():
+                    samples[operation].extend(operation_samples)
+    finally:
+        LOG.propagate = True
+    elapsed = time.time() - start
+    document = dict((key, value) for key, value in config.items()
+                    if key != 'db')
+    return {'config': document, 'seconds': elapsed,
+            'results': report(samples, elapsed)}
+
+
+def format_results(results):
+    lines = ['{:10} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+        'operation', 'count', 'ops/s', 'p50 ms', 'p95 ms', 'p99 ms',
+        'max ms', 'locked')]
+    for operation, stats in sorted(results.items()):
+        values = [stats[key] if stats[key] is not None else float('nan')
+                  for key in ('ops_per_second', 'p50_ms', 'p95_ms',
+                              'p99_ms', 'max_ms')]
+        lines.append('{:10} {:7} {:9.1f} {:9.2f} {:9.2f} {:9.2f} {:9.2f} '
+                     '{:7.1%}'.format(operation, stats['count'],
+                                      *values + [stats['lock_error_rate']]))
+    return '\n'.join(lines)
+
+
+def compare(path, out):
+    """Print the p99 latency and lock error rate of the saved runs."""
+    with open(path) as runs_file:
+        runs = [json.loads(line) for line in runs_file if line.strip()]
+    operations = sorted(set(operation for run in runs
+                            for operation in run['results']))
+    out.write('{:40} '.format('configuration') + ' '.join(
+        '{:>18}'.format(operation + ' p99/lock') for operation in operations)
+        + '\n')
+    for run in runs:
+        config = run['config']
+        label = '{} {}x{} {} cache={} batch={}'.format(
+            config.get('label') or '', config['workers'],
+            'proc' if config['processes'] else 'thread',
+            config['journal_mode'], 'on' if config['cache'] else 'off',
+            config['batch_size']).strip()
+        cells = []
+        for operation in operations:
+            stats = run['results'].get(operation)
+            if stats is None or stats['p99_ms'] is None:
+                cells.append('{:>18}'.format('-'))
+            else:
+                cells.append('{:>11.1f} {:>5.1%}'.format(
+                    stats['p99_ms'], stats['lock_error_rate']))
+        out.write('{:40} '.format(label[:40]) + ' '.join(cells) + '\n')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help="database file (default: a temporary "
+                        "file, deleted after the run)")
+    parser.add_argument('--hosts', type=int, default=2000,
+                        help="hosts of the initial inventory")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--processes', action='store_true',
+                        help="run the workers in processes, not threads")
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="seconds")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="operation weights (default: %(default)s)")
+    parser.add_argument('--journal-mode', default='wal',
+                        choices=('wal', 'delete', 'truncate', 'memory'))
+    parser.add_argument('--busy-timeout', type=float, default=5.0,
+                        help="seconds SQLite waits on a lock")
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help="open a new Manager per read")
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help="writes per transaction")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', help="name of the run in --compare")
+    parser.add_argument('--output', help="append the run to this JSON lines "
+                        "file")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="print the runs saved in FILE and exit")
+    return parser
+
+
+def main(argv=None, out=None):
+    out = sys.stdout if out is None else out
+    args = build_parser().parse_args(argv)
+    if args.compare:
+        compare(args.compare, out)
+        return 0
+
+    config = dict(vars(args))
+    del config['output'], config['compare']
+    tmpdir = None
+    if config['db'] is None:
+        tmpdir = tempfile.mkdtemp()
+        config['db'] = os.path.join(tmpdir, 'loadtest.db')
+    try:
+        document = run(config)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+    out.write(format_results(document['results']) + '\n')
+    if args.output:
+        with open(args.output, 'a') as output:
+            output.write(json.dumps(document, sort_keys=True) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
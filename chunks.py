@@ -0,0 +1,21 @@
+"""Bounded batches of ids and names for the bulk statements.
+
+The IN (...) clauses and the multi-row statements of sync.py, moves.py,
+search.py, snapshots.py and facts.py go through chunks(), so no statement
+binds more than a batch of parameters whatever the size of the input.
+"""
+
+# Maximum number of bound parameters in a single IN (...) clause
+CHUNK_SIZE = 500
+
+
+def chunks(items, size=CHUNK_SIZE):
+    """Yield the items of an iterable as lists of at most size items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
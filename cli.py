@@ -0,0 +1,341 @@
+"""Command line interface of the inventory Manager.
+
+Every subcommand runs one Manager operation and prints its result as JSON::
+
+    python cli.py --db sqlite:////var/lib/inventory.db add-company Acme
+    python cli.py add-office Austin -c Acme
+    python cli.py add-group IT -c Acme -o Austin
+    python cli.py add-host roadrunner -c Acme -o Austin -G IT
+    python cli.py hosts -c Acme
+    python cli.py export --format ini
+    python cli.py snapshot --label nightly
+    python cli.py export --at-revision 12
+    python cli.py export --format msgpack --output inventory.msgpack
+
+The database URL is --db, else $INVENTORY_DB, else DEFAULT_DB.
+
+batch reads newline delimited JSON operations from a file (or stdin) and
+applies them through one Manager, in one transaction: each line commits or
+rolls back its own savepoint (see Manager.batch) and prints one result
+line.  Operations name a Manager method and its keyword arguments::
+
+    {"op": "ensure_host", "hostname": "coyote", "company_name": "Acme",
+     "office_name": "Austin", "group_names": ["IT"]}
+
+    python cli.py batch changes.ndjson
+
+With --atomic the whole batch is rolled back when a line fails.
+Results are {"ok": true, "result": ...} or {"ok": false, "errors": [...]}
+and the exit status is 1 when any operation failed.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+from sqlalchemy import create_engine
+
+import export
+from audit import AuditLog, JsonlSink
+from Manager import create_manager
+from sync import load_spec
+
+LOG = logging.getLogger('Manager')
+
+DEFAULT_DB = 'sqlite:////tmp/sqlalchemy_example.db'
+
+# operation: (help, positional argument, options)
+COMMANDS = [
+    ('add_company', "Add a company", 'company_name', []),
+    ('del_company', "Delete a company", 'company_name', []),
+    ('ensure_company', "Add a company unless it exists", 'company_name', []),
+    ('add_office', "Add an office", 'office_name', ['company_name']),
+    ('del_office', "Delete an office", 'office_name', ['company_name']),
+    ('ensure_office', "Add an office unless it exists", 'office_name',
+     ['company_name']),
+    ('add_group', "Add a group", 'group_name',
+     ['company_name', 'office_name']),
+    ('del_group', "Delete a group", 'group_name',
+     ['company_name', 'office_name']),
+    ('ensure_group', "Add a group unless it exists", 'group_name',
+     ['company_name', 'office_name']),
+    ('add_host', "Add a host", 'hostname',
+     ['company_name', 'office_name', 'group_names']),
+    ('del_host', "Delete a host", 'hostname',
+     ['company_name', 'office_name']),
+    ('ensure_host', "Add a host unless it exists", 'hostname',
+     ['company_name', 'office_name', 'group_names']),
+    ('move_hosts', "Move the selected hosts to another office", None,
+     ['selector', 'to_company', 'to_office', 'group_mapping']),
+    ('rename_hosts', "Rename hosts", None,
+     ['mapping', 'company_name', 'office_name']),
+    ('iter_companies', "List companies", None, ['like', 'after', 'limit']),
+    ('iter_offices', "List offices", None,
+     ['company_name', 'like', 'after', 'limit']),
+    ('iter_groups', "List groups", None,
+     ['company_name', 'office_name', 'like', 'after', 'limit']),
+    ('iter_hosts', "List hosts", None,
+     ['company_name', 'office_name', 'group_name', 'like', 'after',
+      'limit']),
+    ('get_host_vars', "Show the variables of a host", 'hostname',
+     ['company_name', 'office_name']),
+    ('effective_vars', "Show the merged variables of a host", 'hostname',
+     ['company_name', 'office_name']),
+    ('set_vars', "Set (null: delete) company, office, group or host "
+     "variables", None,
+     ['values', 'company_name', 'office_name', 'group_name', 'host']),
+    ('set_group_priority', "Set the variables merge priority of a group",
+     'group_name', ['priority', 'company_name', 'office_name']),
+    ('hosts_by_group', "Show the hosts of every (or one) group", None,
+     ['fq_group_name']),
+    ('search_hosts', "Search hosts by name", 'query', ['limit']),
+    ('stats', "Show inventory statistics and capacity metrics", None, []),
+    ('sync', "Reconcile the inventory with a YAML/JSON spec file", 'spec',
+     ['prune', 'dry_run']),
+    ('check_integrity', "Find (and repair) inconsistent rows", None,
+     ['repair']),
+    ('check_membership', "Compare inventory_membership with the tables",
+     None, []),
+    ('rebuild_membership', "Recreate inventory_membership", None, []),
+    ('rebuild_search', "Recreate the host search index", None, []),
+    ('ingest_facts', "Ingest an Ansible jsonfile fact cache", 'directory',
+     ['prefix', 'workers', 'processes']),
+    ('snapshot', "Record a snapshot of the inventory", None, ['label']),
+    ('list_snapshots', "List the snapshots, newest first", None,
+     ['before', 'limit']),
+    ('diff_snapshots', "Compare two snapshots", None,
+     ['old_revision', 'new_revision']),
+    ('prune_snapshots', "Delete old snapshots", None, ['keep', 'before']),
+    ('export', "Write a static inventory", None,
+     ['format', 'at_revision', 'output']),
+]
+
+# Manager keyword: (flags, argparse keywords)
+OPTIONS = {
+    'company_name': (('-c', '--company'), {}),
+    'office_name': (('-o', '--office'), {}),
+    'group_name': (('-g', '--group'), {}),
+    'host': (('-H', '--host'), {'dest': 'hostname'}),
+    'group_names': (('-G', '--groups'), {'nargs': '+'}),
+    'fq_group_name': (('--fq-group',), {'help': "company_office_group"}),
+    'like': (('--like',), {'help': "SQL LIKE pattern"}),
+    'after': (('--after',), {'nargs': '+',
+                             'help': "continue after this row"}),
+    'limit': (('--limit',), {'type': int}),
+    'values': (('--values',), {'type': json.loads, 'required': True,
+                               'help': "JSON object of variables"}),
+    'priority': (('--priority',), {'type': int, 'required': True}),
+    'selector': (('--selector',), {'type': json.loads, 'required': True,
+                                   'help': 'JSON object, e.g. {"company_name"'
+                                   ': "Acme", "office_name": "Austin"}'}),
+    'to_company': (('--to-company',), {'required': True}),
+    'to_office': (('--to-office',), {'required': True}),
+    'group_mapping': (('--group-mapping',), {
+        'type': json.loads, 'help': "JSON object of group: target group"}),
+    'mapping': (('--mapping',), {'type': json.loads, 'required': True,
+                                 'help': "JSON object of old: new name"}),
+    'prune': (('--prune',), {'action': 'store_true'}),
+    'dry_run': (('--dry-run',), {'action': 'store_true'}),
+    'repair': (('--repair',), {'action': 'store_true'}),
+    'prefix': (('--prefix',), {'default': ''}),
+    'workers': (('--workers',), {'type': int, 'default': 4}),
+    'processes': (('--processes',), {'action': 'store_true'}),
+    'label': (('--label',), {}),
+    'before': (('--before',), {'type': float,
+                               'help': "UNIX timestamp"}),
+    'keep': (('--keep',), {'type': int,
+                           'help': "number of newest snapshots to keep"}),
+    'old_revision': (('--from',), {'type': int, 'required': True}),
+    'new_revision': (('--to',), {'type': int, 'required': True}),
+    'at_revision': (('--at-revision',), {'type': int,
+                                         'help': "export this snapshot"}),
+    'format': (('--format',), {'default': 'json',
+                               'choices': sorted(export.WRITERS)}),
+    'output': (('--output',), {'metavar': 'FILE',
+                               'help': "write to FILE (default: stdout)"}),
+}
+
+OPERATIONS = dict((command[0], command) for command in COMMANDS)
+
+
+class _Abort(Exception):
+    """Stop an --atomic batch at its first failure."""
+
+
+class _Errors(logging.Handler):
+    """Collect the errors the Manager logs during one operation."""
+
+    def __init__(self):
+        logging.Handler.__init__(self, level=logging.ERROR)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def to_json(value):
+    """Convert Manager results to JSON compatible values."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, dict):
+        return dict((str(key), to_json(item)) for key, item in value.items())
+    if hasattr(value, 'summary'):                       # sync.SyncPlan
+        return value.summary()
+    if hasattr(value, '_asdict'):                       # Rows, namedtuples
+        document = to_json(value._asdict())
+        if hasattr(value, 'files_per_second'):          # facts.IngestReport
+            document['files_per_second'] = value.files_per_second
+        return document
+    if hasattr(value, '__table__'):                     # ORM objects
+        return dict((column.name, getattr(value, column.name))
+                    for column in value.__table__.columns)
+    return [to_json(item) for item in value]
+
+
+def run_operation(manager, operation, arguments):
+    """Run one Manager operation; return its JSON result document."""
+    operation = operation.replace('-', '_')
+    if operation not in OPERATIONS:
+        return {'ok': False,
+                'errors': ["Unknown operation: {}".format(operation)]}
+    errors = _Errors()
+    LOG.addHandler(errors)
+    revision = manager.revision
+    try:
+        if operation == 'sync' and isinstance(arguments.get('spec'), str):
+            arguments = dict(arguments, spec=load_spec(arguments['spec']))
+        result = to_json(getattr(manager, operation)(**arguments))
+    except Exception as ex:
+        errors.messages.append('{}: {}'.format(type(ex).__name__, ex))
+        result = None
+    finally:
+        LOG.removeHandler(errors)
+
+    if errors.messages:
+        return {'ok': False, 'errors': errors.messages}
+    if (result is None and operation.startswith(('add_', 'del_')) and
+            manager.revision == revision):
+        return {'ok': False, 'errors': ["Nothing changed"]}
+    return {'ok': True, 'result': result}
+
+
+def run_batch(manager, lines, out, atomic=False):
+    """Run NDJSON operations in one transaction; return the failure count.
+
+    Writes one result line per operation line to out.
+    """
+    failures = 0
+    try:
+        with manager.batch():
+            for number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    arguments = json.loads(line)
+                    operation = arguments.pop('op')
+                except (ValueError, KeyError, AttributeError):
+                    response = {'ok': False,
+                                'errors': ["Not an operation: {}".format(
+                                    line.strip())]}
+                else:
+                    response = run_operation(manager, operation, arguments)
+                response['line'] = number
+                out.write(json.dumps(response, sort_keys=True, default=str))
+                out.write('\n')
+                if not response['ok']:
+                    failures += 1
+                    if atomic:
+                        raise _Abort()
+    except _Abort:
+        LOG.error("Batch rolled back at the first failure")
+    return failures
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=os.environ.get('INVENTORY_DB',
+                                                       DEFAULT_DB),
+                        help="SQLAlchemy database URL "
+                        "(default: $INVENTORY_DB or %(default)s)")
+    parser.add_argument('--audit-log', metavar='FILE',
+                        help="append the changes to this JSON lines file")
+    parser.add_argument('--actor', help="actor recorded in the audit log")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    for operation, description, positional, options in COMMANDS:
+        name = operation.replace('iter_', '').replace('get_', '')
+        command = commands.add_parser(name.replace('_', '-'),
+                                      help=description)
+        command.set_defaults(operation=operation)
+        if positional:
+            command.add_argument(positional,
+                                 metavar=positional.split('_')[0].upper())
+        for option in options:
+            flags, kwargs = OPTIONS[option]
+            kwargs = dict({'dest': option}, **kwargs)
+            command.add_argument(*flags, **kwargs)
+
+    batch = commands.add_parser('batch', help="Run NDJSON operations")
+    batch.set_defaults(operation='batch')
+    batch.add_argument('file', nargs='?', type=argparse.FileType('r'),
+                       default=sys.stdin,
+                       help="operations file (default: stdin)")
+    batch.add_argument('--atomic', action='store_true',
+                       help="roll everything back when a line fails")
+    return parser
+
+
+def _export(manager, out, output=None, **arguments):
+    """Stream an export to output or out (its bytes buffer if binary)."""
+    errors = _Errors()
+    LOG.addHandler(errors)
+    try:
+        binary = export.WRITERS[arguments['format']][1]
+        if output:
+            with open(output, 'wb' if binary else 'w') as stream:
+                manager.export(out=stream, **arguments)
+        elif binary:
+            out.flush()
+            manager.export(out=getattr(out, 'buffer', out), **arguments)
+        else:
+            manager.export(out=out, **arguments)
+    finally:
+        LOG.removeHandler(errors)
+    return 1 if errors.messages else 0
+
+
+def main(argv=None, out=None):
+    out = sys.stdout if out is None else out
+    args = build_parser().parse_args(argv)
+    audit = AuditLog(JsonlSink(args.audit_log)) if args.audit_log else None
+    manager = create_manager(create_engine(args.db), audit=audit,
+                             actor=args.actor)
+    try:
+        if args.operation == 'batch':
+            return 1 if run_batch(manager, args.file, out,
+                                  atomic=args.atomic) else 0
+
+        # The options not given fall back to the Manager's defaults
+        arguments = dict((name, value) for name, value in vars(args).items()
+                         if value is not None)
+        for name in ('db', 'audit_log', 'actor', 'command', 'operation'):
+            arguments.pop(name, None)
+        if args.operation == 'export':
+            # The inventory itself, not wrapped in a JSON result
+            return _export(manager, out, **arguments)
+
+        response = run_operation(manager, args.operation, arguments)
+        json.dump(response, out, indent=2, sort_keys=True, default=str)
+        out.write('\n')
+        return 0 if response['ok'] else 1
+    finally:
+        manager.close()
+        if audit:
+            audit.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
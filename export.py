@@ -0,0 +1,120 @@
+"""Streaming static inventory exports.
+
+Every writer consumes the same ordered (company_office_group, host) rows,
+read from the inventory_membership covering index, one group at a time, and
+writes as it goes: no dict of the whole inventory is ever built.
+
+Formats:
+
+* json: the Ansible dynamic inventory ``--list`` document, with the
+  effective variables of every host that has any (see variables.py)::
+
+      {"Acme_Austin_IT": {"hosts": ["coyote", "roadrunner"]},
+       "_meta": {"hostvars": {"coyote": {"ntp_server": "ntp.acme.com"}}}}
+
+  Host names are unique in an Ansible inventory: when offices share a
+  host name, only the variables of the first host of that name are written.
+
+* ini: a static Ansible INI inventory, one ``[group]`` section per group.
+* yaml: a static Ansible YAML inventory, ``all: children: group: hosts:``.
+* msgpack: a stream of ``[group, [hosts]]`` arrays, read back with
+  ``msgpack.Unpacker``.  Needs the optional msgpack package.
+"""
+
+import itertools
+import json
+import logging
+import operator
+
+import membership
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+LOG = logging.getLogger('Manager')
+
+
+def grouped(rows):
+    """Turn ordered (group, host) rows into (group, host iterator) pairs."""
+    for group, group_rows in itertools.groupby(rows,
+                                               key=operator.itemgetter(0)):
+        yield group, (host for _, host in group_rows)
+
+
+def membership_groups(conn):
+    """Yield (group, host iterator) pairs of the current inventory."""
+    return grouped(membership.hosts_by_group(conn))
+
+
+def write_json(groups, out, hostvars=()):
+    """hostvars are (host name, variables) pairs ordered by host name."""
+    out.write('{')
+    for group, hosts in groups:
+        out.write(json.dumps(group))
+        out.write(': {"hosts": [')
+        out.write(', '.join(json.dumps(host) for host in hosts))
+        out.write(']}, ')
+    out.write('"_meta": {"hostvars": {')
+    # Hosts sharing a group path share one variables dict: encode it once
+    encoded = {}
+    previous = None
+    for host, variables in hostvars:
+        if not variables or host == previous:
+            continue
+        if previous is not None:
+            out.write(', ')
+        previous = host
+        key = id(variables)
+        if key not in encoded:
+            encoded[key] = json.dumps(variables, sort_keys=True)
+        out.write(json.dumps(host))
+        out.write(': ')
+        out.write(encoded[key])
+    out.write('}}}\n')
+
+
+def write_ini(groups, out):
+    first = True
+    for group, hosts in groups:
+        if not first:
+            out.write('\n')
+        first = False
+        out.write('[{}]\n'.format(group))
+        for host in hosts:
+            out.write(host)
+            out.write('\n')
+
+
+def write_yaml(groups, out):
+    # JSON strings are valid YAML scalars and quote everything that needs it
+    out.write('all:\n  children:\n')
+    empty = True
+    for group, hosts in groups:
+        empty = False
+        out.write('    {}:\n      hosts:\n'.format(json.dumps(group)))
+        for host in hosts:
+            out.write('        {}: {{}}\n'.format(json.dumps(host)))
+    if empty:
+        out.write('    {}\n')
+
+
+def write_msgpack(groups, out):
+    if msgpack is None:
+        raise RuntimeError("The msgpack export needs the msgpack package")
+    packer = msgpack.Packer()
+    for group, hosts in groups:
+        out.write(packer.pack([group, list(hosts)]))
+
+
+# Formats whose writer takes the hostvars of the hosts
+HOSTVARS = ('json',)
+
+# format: (writer, binary output)
+WRITERS = {
+    'json': (write_json, False),
+    'ini': (write_ini, False),
+    'yaml': (write_yaml, False),
+    'msgpack': (write_msgpack, True),
+}
@@ -0,0 +1,224 @@
+"""Bulk ingestion of an Ansible jsonfile fact cache into host variables.
+
+Ansible's jsonfile cache plugin (``fact_caching = jsonfile``) keeps one JSON
+document of gathered facts per host in the ``fact_caching_connection``
+directory, named after the inventory hostname with the optional
+``fact_caching_prefix``.  ingest_facts() streams such a directory:
+
+* files whose mtime didn't change since the last run are skipped without
+  being opened, files whose sha1 didn't change are skipped without being
+  parsed (the fact_file table remembers both);
+* the other files are read, hashed and parsed in a thread (or process)
+  pool, keeping only the facts in keys;
+* the facts are upserted into host_var for every Host with the file's name
+  (the same name can exist in several offices), one executemany per batch
+  of files, and the facts gone from a file are deleted.
+
+Each batch is committed on its own: an interrupted run keeps what it wrote
+and the next run only parses the files it missed.  Files without a matching
+host or with invalid JSON are not remembered, so they are retried.
+
+    report = manager.ingest_facts('/var/cache/ansible/facts')
+    print(report.files_per_second)
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import and_, bindparam, select
+
+from chunks import chunks
+from inventory import fact_file_table, Host, HostVar
+from upsert import upsert_rows
+
+LOG = logging.getLogger('Manager')
+
+# Facts kept by default: what we query alongside the inventory
+KEYS = (
+    'ansible_all_ipv4_addresses',
+    'ansible_architecture',
+    'ansible_default_ipv4',
+    'ansible_distribution',
+    'ansible_distribution_version',
+    'ansible_fqdn',
+    'ansible_kernel',
+    'ansible_memtotal_mb',
+    'ansible_os_family',
+    'ansible_processor_vcpus',
+)
+
+# Files per transaction
+BATCH_SIZE = 500
+
+
+class IngestReport(collections.namedtuple('IngestReport', [
+        'files', 'skipped', 'unchanged', 'ingested', 'unknown', 'errors',
+        'variables', 'seconds'])):
+    """Counts of one ingest_facts() run.
+
+    files were found, skipped had the same mtime and unchanged the same
+    sha1 as last time, ingested were written to host_var, unknown had no
+    host and errors could not be read; variables is the number of host_var
+    rows written.
+    """
+
+    __slots__ = ()
+
+    @property
+    def files_per_second(self):
+        return self.files / self.seconds if self.seconds else 0.0
+
+
+def _parse(job):
+    """Read, hash and parse one fact file (runs in the pool).
+
+    Returns (name, mtime, sha1, facts, error); facts is None when the file
+    still has known_sha1.
+    """
+    name, path, mtime, known_sha1, keys = job
+    try:
+        with open(path, 'rb') as fact_file:
+            data = fact_file.read()
+        sha1 = hashlib.sha1(data).hexdigest()
+        if sha1 == known_sha1:
+            return name, mtime, sha1, None, None
+        document = json.loads(data)
+        if not isinstance(document, dict):
+            raise ValueError("not a JSON object")
+    except (OSError, ValueError) as ex:
+        return name, mtime, None, None, str(ex)
+    facts = dict((key, json.dumps(document[key], sort_keys=True))
+                 for key in keys if key in document)
+    return name, mtime, sha1, facts, None
+
+
+def _scan(directory, prefix):
+    """Yield (hostname, path, mtime) of the fact files in directory."""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if (entry.name.startswith('.') or
+                    not entry.name.startswith(prefix) or
+                    not entry.is_file()):
+                continue
+            yield (entry.name[len(prefix):], entry.path,
+                   entry.stat().st_mtime)
+
+
+def _host_ids(session, names):
+    """Return {hostname: [host ids]} of the hosts named in names."""
+    host_ids = {}
+    query = select(Host.id, Host.name).where(Host.name.in_(names))
+    for host_id, name in session.execute(query):
+        host_ids.setdefault(name, []).append(host_id)
+    return host_ids
+
+
+def _write(session, results, keys, counts):
+    """Write one batch of _parse results in one transaction."""
+    parsed = [result for result in results if result[3] is not None]
+    host_ids = _host_ids(session, [result[0] for result in parsed])
+    state = []
+    variables = []
+    stale = []
+    for name, mtime, sha1, facts, error in results:
+        if error:
+            counts['errors'] += 1
+            LOG.warning("Cannot ingest facts of %s: %s", name, error)
+            continue
+        if facts is None:
+            counts['unchanged'] += 1
+        elif name not in host_ids:
+            counts['unknown'] += 1
+            continue
+        else:
+            counts['ingested'] += 1
+            for host_id in host_ids[name]:
+                variables.extend({'host_id': host_id, 'key': key,
+                                  'value': value}
+                                 for key, value in facts.items())
+                stale.extend({'h_id': host_id, 'k': key}
+                             for key in keys if key not in facts)
+        state.append({'name': name, 'mtime': mtime, 'sha1': sha1})
+
+    table = HostVar.__table__
+    upsert_rows(session, table, variables, ('host_id', 'key'))
+    if stale:
+        session.execute(table.delete().where(and_(
+            table.c.host_id == bindparam('h_id'),
+            table.c.key == bindparam('k'))), stale)
+    upsert_rows(session, fact_file_table, state, ('name',))
+    session.commit()
+    counts['variables'] += len(variables)
+
+
+def ingest_facts(session, directory, keys=KEYS, prefix='', workers=4,
+                 processes=False, batch_size=BATCH_SIZE):
+    """Ingest the fact files of directory into host_var.
+
+    The files are parsed by workers threads, or processes with
+    processes=True (worth it for large fact files, as json parsing holds
+    the GIL).  Commits every batch_size files; returns an IngestReport.
+    """
+    start = time.time()
+    keys = tuple(keys)
+    known = dict((row.name, row)
+                 for row in session.execute(select(fact_file_table)))
+    counts = collections.Counter()
+
+    def jobs():
+        for name, path, mtime in _scan(directory, prefix):
+            counts['files'] += 1
+            row = known.get(name)
+            if row is not None and row.mtime == mtime:
+                counts['skipped'] += 1
+                continue
+            yield name, path, mtime, row.sha1 if row else None, keys
+
+    executor = (concurrent.futures.ProcessPoolExecutor if processes else
+                concurrent.futures.ThreadPoolExecutor)
+    with executor(max_workers=workers) as pool:
+        pending = None
+        for batch in chunks(jobs(), batch_size):
+            # Parse the next batch while the previous one is written
+            results = pool.map(_parse, batch,
+                               chunksize=max(1, len(batch) // workers))
+            if pending is not None:
+                _write(session, list(pending), keys, counts)
+            pending = results
+        if pending is not None:
+            _write(session, list(pending), keys, counts)
+
+    report = IngestReport(*[counts[field] for field in
+                            IngestReport._fields[:-1]],
+                          seconds=time.time() - start)
+    LOG.info("Ingested %s of %s fact files in %.2f s (%.0f files/s)",
+             report.ingested, report.files, report.seconds,
+             report.files_per_second)
+    return report
+
+
+def forget_hosts(session, host_ids):
+    """Delete the host_var rows and fact_file state of hosts being deleted.
+
+    Must run before the hosts are deleted: their facts are ingested again
+    if hosts with the same names are added later.
+    """
+    host_ids = list(host_ids)
+    names = select(Host.name).where(Host.id.in_(host_ids))
+    session.execute(fact_file_table.delete().where(
+        fact_file_table.c.name.in_(names)))
+    session.execute(HostVar.__table__.delete().where(
+        HostVar.host_id.in_(host_ids)))
+
+
+def host_vars(session, host_id):
+    """Return {key: value} of the host_var rows of host_id."""
+    query = select(HostVar.key, HostVar.value).where(
+        HostVar.host_id == host_id)
+    return dict((key, json.loads(value))
+                for key, value in session.execute(query))
@@ -0,0 +1,270 @@
+"""In-memory graph of the Company/Office/Group/Host inventory.
+
+InventoryGraph is built from one bulk read of the inventory tables and
+answers the Manager's read-only questions (hosts of an office, groups of an
+office, group -> hosts, host -> groups) from dict indexes, without touching
+the database or lazy loading ORM relationships.
+
+Group names follow the inventory convention::
+
+    company_office_group
+
+The graph remembers the per table data revisions it was built from, and
+refresh() only re-reads the tables whose revision has changed since then.
+"""
+
+import logging
+
+from inventory import (association_table,
+                       Company,
+                       Office,
+                       Group,
+                       Host,
+                       )
+
+LOG = logging.getLogger('Manager')
+
+# Tables in rebuild order: a change in one table invalidates the indexes
+# built from it and from every table after it.
+TABLES = ('company', 'office', 'group', 'host', 'association')
+_STAGES = {'company': 0, 'office': 0, 'group': 0, 'host': 1, 'association': 2}
+
+
+def fq_group_name(company_name, office_name, group_name):
+    """Return the fully qualified company_office_group name."""
+    return '{}_{}_{}'.format(company_name, office_name, group_name)
+
+
+class CompanyNode(object):
+    """Company with the ids of its offices."""
+
+    __slots__ = ('id', 'name', 'office_ids')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.office_ids = []
+
+
+class OfficeNode(object):
+    """Office with the ids of its groups and hosts."""
+
+    __slots__ = ('id', 'name', 'company_id', 'group_ids', 'host_ids')
+
+    def __init__(self, id, name, company_id):
+        self.id = id
+        self.name = name
+        self.company_id = company_id
+        self.group_ids = []
+        self.host_ids = []
+
+
+class GroupNode(object):
+    """Group with its fully qualified name and member host ids."""
+
+    __slots__ = ('id', 'name', 'company_id', 'office_id', 'fq_name',
+                 'host_ids')
+
+    def __init__(self, id, name, company_id, office_id, fq_name):
+        self.id = id
+        self.name = name
+        self.company_id = company_id
+        self.office_id = office_id
+        self.fq_name = fq_name
+        self.host_ids = set()
+
+
+class HostNode(object):
+    """Host with the ids of the groups it belongs to."""
+
+    __slots__ = ('id', 'name', 'company_id', 'office_id', 'group_ids')
+
+    def __init__(self, id, name, company_id, office_id):
+        self.id = id
+        self.name = name
+        self.company_id = company_id
+        self.office_id = office_id
+        self.group_ids = set()
+
+
+class InventoryGraph(object):
+    """Read-only, indexed snapshot of the inventory tables."""
+
+    def __init__(self, session, revisions=None):
+        """Build the graph with one bulk read per table."""
+        self._rows = {}
+        self.revisions = {}
+        self.companies = {}
+        self.offices = {}
+        self.groups = {}
+        self.hosts = {}
+        self.refresh(session, revisions)
+
+    def refresh(self, session, revisions=None):
+        """Re-read the tables whose revision changed and rebuild indexes.
+
+        With revisions=None every table is re-read.  Returns the names of
+        the tables that were reloaded.
+        """
+        if revisions is None:
+            changed = list(TABLES)
+        else:
+            changed = [table for table in TABLES
+                       if table not in self._rows or
+                       self.revisions.get(table) != revisions.get(table)]
+        if not changed:
+            return []
+
+        for table in changed:
+            self._rows[table] = self._load(session, table)
+        if revisions is not None:
+            self.revisions = dict(revisions)
+
+        stage = min(_STAGES[table] for table in changed)
+        if stage <= 0:
+            self._build_structure()
+        if stage <= 1:
+            self._build_hosts()
+        self._build_membership()
+        LOG.debug("Graph refreshed: %s", ', '.join(changed))
+        return changed
+
+    @staticmethod
+    def _load(session, table):
+        if table == 'company':
+            query = session.query(Company.id, Company.name)
+        elif table == 'office':
+            query = session.query(Office.id, Office.name, Office.company_id)
+        elif table == 'group':
+            query = session.query(Group.id, Group.name,
+                                  Group.company_id, Group.office_id)
+        elif table == 'host':
+            query = session.query(Host.id, Host.name,
+                                  Host.company_id, Host.office_id)
+        else:
+            query = session.query(association_table.c.host_id,
+                                  association_table.c.group_id)
+        return [tuple(row) for row in query]
+
+    def _build_structure(self):
+        self.companies = {}
+        self.company_by_name = {}
+        for id, name in self._rows['company']:
+            node = CompanyNode(id, name)
+            self.companies[id] = node
+            self.company_by_name[name] = node
+
+        self.offices = {}
+        self.office_by_key = {}
+        for id, name, company_id in self._rows['office']:
+            company = self.companies.get(company_id)
+            if company is None:
+                continue
+            node = OfficeNode(id, name, company_id)
+            self.offices[id] = node
+            self.office_by_key[(company.name, name)] = node
+            company.office_ids.append(id)
+
+        self.groups = {}
+        self.group_by_fq_name = {}
+        for id, name, company_id, office_id in self._rows['group']:
+            company = self.companies.get(company_id)
+            office = self.offices.get(office_id)
+            if company is None or office is None:
+                continue
+            node = GroupNode(id, name, company_id, office_id,
+                             fq_group_name(company.name, office.name, name))
+            self.groups[id] = node
+            self.group_by_fq_name[node.fq_name] = node
+            office.group_ids.append(id)
+
+    def _build_hosts(self):
+        for office in self.offices.values():
+            office.host_ids = []
+        self.hosts = {}
+        self.hosts_by_name = {}
+        self.host_by_key = {}
+        for id, name, company_id, office_id in self._rows['host']:
+            company = self.companies.get(company_id)
+            office = self.offices.get(office_id)
+            if company is None or office is None:
+                continue
+            node = HostNode(id, name, company_id, office_id)
+            self.hosts[id] = node
+            self.hosts_by_name.setdefault(name, []).append(node)
+            self.host_by_key[(company.name, office.name, name)] = node
+            office.host_ids.append(id)
+
+    def _build_membership(self):
+        for group in self.groups.values():
+            group.host_ids = set()
+        for host in self.hosts.values():
+            host.group_ids = set()
+        for host_id, group_id in self._rows['association']:
+            host = self.hosts.get(host_id)
+            group = self.groups.get(group_id)
+            if host is None or group is None:
+                continue
+            host.group_ids.add(group_id)
+            group.host_ids.add(host_id)
+
+    # -------------------------------------------------------------------------
+    # Lookups
+    # -------------------------------------------------------------------------
+    def get_company(self, company_name):
+        return self.company_by_name.get(company_name)
+
+    def get_office(self, office_name, company_name):
+        return self.office_by_key.get((company_name, office_name))
+
+    def get_offices(self, company_name):
+        company = self.company_by_name.get(company_name)
+        if not company:
+            return []
+        return [self.offices[id] for id in company.office_ids]
+
+    def get_groups(self, company_name, office_name):
+        office = self.office_by_key.get((company_name, office_name))
+        if not office:
+            return []
+        return [self.groups[id] for id in office.group_ids]
+
+    def get_group(self, group_name, company_name, office_name):
+        return self.group_by_fq_name.get(
+            fq_group_name(company_name, office_name, group_name))
+
+    def get_hosts(self, company_name, office_name):
+        office = self.office_by_key.get((company_name, office_name))
+        if not office:
+            return []
+        return [self.hosts[id] for id in office.host_ids]
+
+    def get_host(self, hostname, company_name, office_name):
+        return self.host_by_key.get((company_name, office_name, hostname))
+
+    def group_hosts(self, fq_name):
+        """Return the sorted host names of a company_office_group."""
+        group = self.group_by_fq_name.get(fq_name)
+        if not group:
+            return []
+        return sorted(self.hosts[id].name for id in group.host_ids)
+
+    def host_groups(self, hostname, company_name=None, office_name=None):
+        """Return the sorted company_office_group names of a host.
+
+        Without company_name/office_name every host called hostname is
+        considered, since host names are only unique within an office.
+        """
+        if company_name and office_name:
+            host = self.host_by_key.get((company_name, office_name, hostname))
+            hosts = [host] if host else []
+        else:
+            hosts = self.hosts_by_name.get(hostname, [])
+        return sorted(set(self.groups[id].fq_name
+                          for host in hosts for id in host.group_ids))
+
+    def hosts_by_group(self):
+        """Return {company_office_group: [host names]} for every group."""
+        return dict((group.fq_name, sorted(self.hosts[id].name
+                                           for id in group.host_ids))
+                    for group in self.groups.values())
@@ -0,0 +1,161 @@
+"""Set-based consistency checks of the inventory tables.
+
+The schema allows inconsistencies the Manager never creates itself but bulk
+imports or manual edits can:
+
+* group_company: a Group whose company_id isn't its office's company
+* host_company: a Host whose company_id isn't its office's company
+* samba_group_company / samba_user_company: the same for Samba rows
+* cross_office_membership: an association between a host and a group of
+  another office
+* dangling_membership: an association to a missing host or group
+* dangling_company_var, dangling_office_var, dangling_group_var,
+  dangling_host_var: a variable of a missing company, office, group or host
+
+Every check is one join or anti-join query and every repair is one
+bulk statement; nothing iterates over ORM objects.
+"""
+
+import collections
+import logging
+
+from sqlalchemy import and_, exists, or_, select
+
+from inventory import (association_table,
+                       Company,
+                       CompanyVar,
+                       Group,
+                       GroupVar,
+                       Host,
+                       HostVar,
+                       Office,
+                       OfficeVar,
+                       SambaGroup,
+                       SambaUser,
+                       )
+
+LOG = logging.getLogger('Manager')
+
+Finding = collections.namedtuple('Finding', ['kind', 'rows'])
+Finding.__doc__ = """Rows failing one check, as tuples of the check's ids."""
+
+_office = Office.__table__
+_association = association_table
+_host = Host.__table__
+_group = Group.__table__
+
+# kind: (variables table, owner table, owner id column name)
+_VARIABLES = collections.OrderedDict([
+    ('dangling_company_var', (CompanyVar.__table__, Company.__table__,
+                              'company_id')),
+    ('dangling_office_var', (OfficeVar.__table__, _office, 'office_id')),
+    ('dangling_group_var', (GroupVar.__table__, _group, 'group_id')),
+    ('dangling_host_var', (HostVar.__table__, _host, 'host_id')),
+])
+
+
+def _office_company(table):
+    """Correlated subquery: the company_id of table's office."""
+    return (select(_office.c.company_id)
+            .where(_office.c.id == table.c.office_id)
+            .scalar_subquery())
+
+
+def _company_check(table):
+    # (id, company_id, office company_id) of rows in another company
+    return (select(table.c.id, table.c.company_id, _office.c.company_id)
+            .join(_office, table.c.office_id == _office.c.id)
+            .where(table.c.company_id != _office.c.company_id))
+
+
+def _company_repair(table):
+    return (table.update()
+            .where(table.c.company_id != _office_company(table))
+            .values(company_id=_office_company(table)))
+
+
+def _cross_office():
+    return and_(_host.c.id == _association.c.host_id,
+                _group.c.id == _association.c.group_id,
+                _host.c.office_id != _group.c.office_id)
+
+
+def _dangling_var(kind):
+    table, owner, column = _VARIABLES[kind]
+    return ~exists().where(owner.c.id == table.c[column])
+
+
+def _dangling():
+    return or_(~exists().where(_host.c.id == _association.c.host_id),
+               ~exists().where(_group.c.id == _association.c.group_id))
+
+
+CHECKS = collections.OrderedDict([
+    ('group_company', _company_check(_group)),
+    ('host_company', _company_check(_host)),
+    ('samba_group_company', _company_check(SambaGroup.__table__)),
+    ('samba_user_company', _company_check(SambaUser.__table__)),
+    # (host_id, group_id)
+    ('cross_office_membership',
+     select(_association.c.host_id, _association.c.group_id)
+     .select_from(_association)
+     .join(_host, _host.c.id == _association.c.host_id)
+     .join(_group, _group.c.id == _association.c.group_id)
+     .where(_host.c.office_id != _group.c.office_id)),
+    # (host_id, group_id)
+    ('dangling_membership',
+     select(_association.c.host_id, _association.c.group_id)
+     .where(_dangling())),
+])
+# (variable id, owner id)
+CHECKS.update((kind, select(table.c.id, table.c[column])
+                     .where(_dangling_var(kind)))
+              for kind, (table, _, column) in _VARIABLES.items())
+
+
+def check_integrity(conn):
+    """Run every check; return the list of Findings that have rows."""
+    findings = []
+    for kind, query in CHECKS.items():
+        rows = [tuple(row) for row in conn.execute(query)]
+        if rows:
+            LOG.info("Integrity: %s: %s rows", kind, len(rows))
+            findings.append(Finding(kind, rows))
+    return findings
+
+
+def repair_integrity(conn, findings):
+    """Repair findings in bulk, in conn's transaction.
+
+    Company mismatches take the company of the row's office, bad
+    associations are deleted.
+    Returns the ids of the hosts whose company or memberships changed.
+    """
+    host_ids = set()
+    for finding in findings:
+        kind = finding.kind
+        if kind == 'group_company':
+            # The company_office_group names of the members change
+            host_ids.update(conn.execute(
+                select(_association.c.host_id).where(
+                    _association.c.group_id.in_(
+                        [row[0] for row in finding.rows]))).scalars())
+            conn.execute(_company_repair(_group))
+        elif kind == 'host_company':
+            conn.execute(_company_repair(_host))
+        elif kind == 'samba_group_company':
+            conn.execute(_company_repair(SambaGroup.__table__))
+        elif kind == 'samba_user_company':
+            conn.execute(_company_repair(SambaUser.__table__))
+        elif kind == 'cross_office_membership':
+            conn.execute(_association.delete().where(
+                exists().where(_cross_office())))
+        elif kind == 'dangling_membership':
+            conn.execute(_association.delete().where(_dangling()))
+        elif kind in _VARIABLES:
+            conn.execute(_VARIABLES[kind][0].delete().where(
+                _dangling_var(kind)))
+        if kind == 'host_company' or kind.endswith('membership'):
+            host_ids.update(row[0] for row in finding.rows)
+        LOG.info("Integrity: repaired %s", kind)
+    return host_ids
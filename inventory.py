@@ -20,7 +20,8 @@ This is sensible since otherwise there will be namespace issues.
 -----------------------------------------------------------------------------------
 """
 
-from sqlalchemy import Table, Column, Integer, ForeignKey, String
+from sqlalchemy import (Table, Column, Float, Index, Integer, ForeignKey,
+                        LargeBinary, String)
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import UniqueConstraint
@@ -28,10 +29,77 @@ from sqlalchemy import UniqueConstraint
 # NOTE: Make sure to import this base into all modules that need Base
 Base = declarative_base()
 association_table = Table('association', Base.metadata,
-                          Column('host_id', Integer, ForeignKey('host.id')),
-                          Column('group_id', Integer, ForeignKey('group.id'))
+                          Column('host_id', Integer, ForeignKey('host.id'),
+                                 index=True),
+                          Column('group_id', Integer, ForeignKey('group.id'),
+                                 index=True),
+                          # A host is in a group once, see upsert.py
+                          Index('ix_association_host_group',
+                                'host_id', 'group_id', unique=True),
                           )
 
+# Single row table holding the schema version, see schema.py
+schema_version_table = Table('inventory_schema', Base.metadata,
+                             Column('id', Integer, primary_key=True),
+                             Column('version', Integer, nullable=False)
+                             )
+
+# Materialized company_office_group -> host memberships, one row per
+# association row, kept up to date by the triggers in membership.py
+membership_table = Table('inventory_membership', Base.metadata,
+                         Column('fq_group_name', String, nullable=False),
+                         Column('host_name', String, nullable=False),
+                         Column('host_id', Integer, nullable=False),
+                         Column('group_id', Integer, nullable=False, index=True),
+                         Index('ix_inventory_membership_covering',
+                               'fq_group_name', 'host_name',
+                               'host_id', 'group_id'),
+                         Index('ix_inventory_membership_host_group',
+                               'host_id', 'group_id'),
+                         )
+
+# Per table data revisions incremented by every transaction that changed
+# the table, see revisions.py
+revision_table = Table('inventory_revision', Base.metadata,
+                       Column('table_name', String, primary_key=True),
+                       Column('revision', Integer, nullable=False)
+                       )
+
+# Append-only log of Manager mutations, see audit.py. arguments, before and
+# after are JSON documents.
+audit_log_table = Table('audit_log', Base.metadata,
+                        Column('id', Integer, primary_key=True),
+                        Column('timestamp', Float, nullable=False),
+                        Column('actor', String),
+                        Column('method', String, nullable=False),
+                        Column('arguments', String),
+                        Column('before', String),
+                        Column('after', String)
+                        )
+
+# Files of an Ansible fact cache already ingested into host_var, see facts.py.
+# A file is parsed again only when its mtime and its sha1 changed.
+fact_file_table = Table('fact_file', Base.metadata,
+                        Column('name', String, primary_key=True),
+                        Column('mtime', Float, nullable=False),
+                        Column('sha1', String, nullable=False)
+                        )
+
+# Content-addressed inventory snapshots, see snapshots.py. A chunk is zlib
+# compressed JSON keyed by the sha1 of that JSON; a snapshot names the chunk
+# of its manifest.
+snapshot_chunk_table = Table('snapshot_chunk', Base.metadata,
+                             Column('sha1', String, primary_key=True),
+                             Column('data', LargeBinary, nullable=False)
+                             )
+
+snapshot_table = Table('snapshot', Base.metadata,
+                       Column('revision', Integer, primary_key=True),
+                       Column('timestamp', Float, nullable=False, index=True),
+                       Column('label', String),
+                       Column('manifest', String, nullable=False)
+                       )
+
 
 class Company(Base):
     """Company class is the lowest level."""
@@ -50,7 +118,8 @@ class Office(Base):
     __tablename__ = 'office'
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
-    company_id = Column(Integer, ForeignKey('company.id'), nullable=False)
+    company_id = Column(Integer, ForeignKey('company.id'), nullable=False,
+                        index=True)
     company = relationship("Company", back_populates="offices")
     hosts = relationship("Host", back_populates="office")
     groups = relationship("Group", back_populates="office")
@@ -73,11 +142,15 @@ class Group(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     # Company ---------------------------------------------------------
-    company_id = Column(Integer, ForeignKey('company.id'), nullable=False)
+    company_id = Column(Integer, ForeignKey('company.id'), nullable=False,
+                        index=True)
     company = relationship("Company", back_populates="groups")
     # Office ----------------------------------------------------------
-    office_id = Column(Integer, ForeignKey('office.id'), nullable=False)
+    office_id = Column(Integer, ForeignKey('office.id'), nullable=False,
+                       index=True)
     office = relationship("Office", back_populates="groups")
+    # Merge order of the variables of a host's groups, see variables.py
+    priority = Column(Integer, nullable=False, default=1, server_default='1')
     # Unique ----------------------------------------------------------
     __table_args__ = (UniqueConstraint('name',
                                        'company_id',
@@ -97,10 +170,12 @@ class Host(Base):
     __tablename__ = 'host'
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
-    company_id = Column(Integer, ForeignKey('company.id'), nullable=False)
+    company_id = Column(Integer, ForeignKey('company.id'), nullable=False,
+                        index=True)
     company = relationship("Company", back_populates="hosts")
     # Office ----------------------------------------------------------
-    office_id = Column(Integer, ForeignKey('office.id'), nullable=False)
+    office_id = Column(Integer, ForeignKey('office.id'), nullable=False,
+                       index=True)
     office = relationship("Office", back_populates="hosts")
     # Unique ----------------------------------------------------------
     # Host can be in multiple groups to allow different configuraiton sets
@@ -114,6 +189,68 @@ class Host(Base):
                                        name='_company_office_host_uc'),
                       )
 
+
+class CompanyVar(Base):
+    """A variable of every host of a company, see variables.py.
+
+    value is the JSON encoded value of the variable.
+    """
+
+    __tablename__ = 'company_var'
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('company.id'), nullable=False)
+    key = Column(String, nullable=False)
+    value = Column(String, nullable=False)
+    __table_args__ = (UniqueConstraint('company_id',
+                                       'key',
+                                       name='_company_var_uc'),
+                      )
+
+
+class OfficeVar(Base):
+    """A variable of every host of an office."""
+
+    __tablename__ = 'office_var'
+    id = Column(Integer, primary_key=True)
+    office_id = Column(Integer, ForeignKey('office.id'), nullable=False)
+    key = Column(String, nullable=False)
+    value = Column(String, nullable=False)
+    __table_args__ = (UniqueConstraint('office_id',
+                                       'key',
+                                       name='_office_var_uc'),
+                      )
+
+
+class GroupVar(Base):
+    """A variable of every host of a group."""
+
+    __tablename__ = 'group_var'
+    id = Column(Integer, primary_key=True)
+    group_id = Column(Integer, ForeignKey('group.id'), nullable=False)
+    key = Column(String, nullable=False)
+    value = Column(String, nullable=False)
+    __table_args__ = (UniqueConstraint('group_id',
+                                       'key',
+                                       name='_group_var_uc'),
+                      )
+
+
+class HostVar(Base):
+    """A variable of a host, e.g. a gathered Ansible fact.
+
+    value is the JSON encoded value of the variable.
+    """
+
+    __tablename__ = 'host_var'
+    id = Column(Integer, primary_key=True)
+    host_id = Column(Integer, ForeignKey('host.id'), nullable=False)
+    key = Column(String, nullable=False)
+    value = Column(String, nullable=False)
+    __table_args__ = (UniqueConstraint('host_id',
+                                       'key',
+                                       name='_host_var_uc'),
+                      )
+
 # -----------------------------------------------------------------------------
 # Samba
 # -----------------------------------------------------------------------------
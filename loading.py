@@ -0,0 +1,78 @@
+"""Named relationship loading profiles of the Manager operations.
+
+Every relationship of inventory.py loads lazily ('select'): reading one
+that wasn't loaded quietly costs a query per object.  Manager operations
+that return ORM objects name what their callers read instead, through a
+profile:
+
+* 'single-object': one object and the relationships read from it, in one
+  SELECT (joinedload along each path);
+* 'export': many objects and their subtrees, one SELECT ... IN per level
+  (selectinload along each path), without the row multiplication of a
+  join;
+* 'bulk-write': objects loaded only to be deleted or changed: none of
+  their relationships is loaded (raiseload).
+
+The unit of work ignores loader options when it flushes a delete: it
+loads the collections it has to clear.  Bulk writes clear the association
+rows with set-based statements instead and tell the session with
+mark_empty().
+
+With strict=True (Manager(engine, strict=True), as the tests use) every
+relationship a profile doesn't name raises on access, so an accidental
+lazy load fails loudly instead of adding queries.
+"""
+
+import logging
+
+from sqlalchemy.orm import (joinedload,
+                            raiseload,
+                            selectinload,
+                            )
+from sqlalchemy.orm.attributes import set_committed_value
+
+LOG = logging.getLogger('Manager')
+
+# profile: loader strategy of the relationships it names (None: loads none)
+PROFILES = {
+    'single-object': joinedload,
+    'export': selectinload,
+    'bulk-write': None,
+}
+
+
+def options(profile, *paths, strict=False):
+    """Return the loader options of profile for the relationship paths.
+
+    Each path is a tuple of relationship attributes, every one read from
+    the objects of the previous one, e.g. (Office.company, Company.groups).
+    """
+    strategy = PROFILES[profile]
+    if strategy is None and paths:
+        raise ValueError("The {} profile loads no relationship".format(
+            profile))
+
+    loads = []
+    for path in paths:
+        load = None
+        for attribute in path:
+            if load is None:
+                load = strategy(attribute)
+            else:
+                load = getattr(load, strategy.__name__)(attribute)
+            if strict:
+                loads.append(load.raiseload('*'))
+        loads.append(load)
+    if strict or strategy is None:
+        loads.append(raiseload('*'))
+    return loads
+
+
+def mark_empty(instance, *keys):
+    """Mark the collections keys of instance as loaded and empty.
+
+    For rows whose association rows were deleted with a bulk statement: the
+    flush then neither loads nor deletes them again.
+    """
+    for key in keys:
+        set_committed_value(instance, key, [])
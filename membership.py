@@ -0,0 +1,180 @@
+"""Materialized group membership: the ``inventory_membership`` table.
+
+Each association row is mirrored as one (fq_group_name, host_name, host_id,
+group_id) row, where fq_group_name is the company_office_group name, so
+exports and group lookups are index scans of one table instead of a five
+table join that rebuilds the name strings.
+
+On SQLite the table is maintained incrementally by triggers on the
+association, host, group, office and company tables, so every write path
+(ORM, bulk sync, upserts, manual SQL) keeps it up to date.  Other databases
+have no triggers and need rebuild() after changes.
+
+check() compares the table with the base tables; rebuild() recreates it.
+"""
+
+import logging
+
+from sqlalchemy import DDL, event, func, select
+
+from inventory import (Base,
+                       association_table,
+                       membership_table,
+                       Company,
+                       Group,
+                       Host,
+                       Office,
+                       )
+
+LOG = logging.getLogger('Manager')
+
+# company_office_group name of the group with id {group_id}
+_FQ_NAME = ('(SELECT c.name || \'_\' || o.name || \'_\' || g.name '
+            'FROM "group" g JOIN office o ON o.id = g.office_id '
+            'JOIN company c ON c.id = g.company_id WHERE g.id = {group_id})')
+
+_INSERT = ('INSERT INTO inventory_membership '
+           '(fq_group_name, host_name, host_id, group_id) '
+           'SELECT ' + _FQ_NAME.format(group_id='{prefix}.group_id') + ', '
+           'h.name, h.id, {prefix}.group_id FROM host h '
+           'WHERE h.id = {prefix}.host_id '
+           'AND EXISTS (SELECT 1 FROM "group" WHERE id = {prefix}.group_id);')
+
+# One mirrored row per association row
+_DELETE = ('DELETE FROM inventory_membership WHERE rowid = ('
+           'SELECT rowid FROM inventory_membership '
+           'WHERE host_id = OLD.host_id AND group_id = OLD.group_id LIMIT 1);')
+
+_UPDATE_FQ_NAME = ('UPDATE inventory_membership SET fq_group_name = ' +
+                   _FQ_NAME.format(group_id='inventory_membership.group_id') +
+                   ' WHERE group_id IN ({group_ids});')
+
+TRIGGERS = {
+    'association_insert': 'AFTER INSERT ON association BEGIN ' +
+    _INSERT.format(prefix='NEW') + ' END',
+
+    'association_delete': 'AFTER DELETE ON association BEGIN ' +
+    _DELETE + ' END',
+
+    'association_update': 'AFTER UPDATE ON association BEGIN ' +
+    _DELETE + ' ' + _INSERT.format(prefix='NEW') + ' END',
+
+    # An UPDATE that sets name to its value still fires UPDATE OF name:
+    # only rewrite rows on a real change
+    'host_rename': 'AFTER UPDATE OF name ON host '
+    'WHEN OLD.name IS NOT NEW.name BEGIN '
+    'UPDATE inventory_membership SET host_name = NEW.name '
+    'WHERE host_id = NEW.id; END',
+
+    'host_delete': 'AFTER DELETE ON host BEGIN '
+    'DELETE FROM inventory_membership WHERE host_id = OLD.id; END',
+
+    'group_update': 'AFTER UPDATE OF name, company_id, office_id ON "group" '
+    'WHEN OLD.name IS NOT NEW.name OR OLD.company_id IS NOT NEW.company_id '
+    'OR OLD.office_id IS NOT NEW.office_id BEGIN ' +
+    _UPDATE_FQ_NAME.format(group_ids='NEW.id') + ' END',
+
+    'group_delete': 'AFTER DELETE ON "group" BEGIN '
+    'DELETE FROM inventory_membership WHERE group_id = OLD.id; END',
+
+    'office_rename': 'AFTER UPDATE OF name ON office '
+    'WHEN OLD.name IS NOT NEW.name BEGIN ' +
+    _UPDATE_FQ_NAME.format(
+        group_ids='SELECT id FROM "group" WHERE office_id = NEW.id') +
+    ' END',
+
+    'company_rename': 'AFTER UPDATE OF name ON company '
+    'WHEN OLD.name IS NOT NEW.name BEGIN ' +
+    _UPDATE_FQ_NAME.format(
+        group_ids='SELECT id FROM "group" WHERE company_id = NEW.id') +
+    ' END',
+}
+
+TRIGGER_DDL = [DDL('CREATE TRIGGER IF NOT EXISTS inventory_membership_{} {}'
+                   .format(name, body))
+               for name, body in sorted(TRIGGERS.items())]
+# The triggers need every table: create them after create_all()
+for ddl in TRIGGER_DDL:
+    event.listen(Base.metadata, 'after_create',
+                 ddl.execute_if(dialect='sqlite'))
+
+
+def _base_rows():
+    """Select the membership rows derived from the base tables."""
+    fq_name = Company.name + '_' + Office.name + '_' + Group.name
+    return (select(fq_name, Host.name,
+                   association_table.c.host_id, association_table.c.group_id)
+            .select_from(association_table)
+            .join(Host, association_table.c.host_id == Host.id)
+            .join(Group, association_table.c.group_id == Group.id)
+            .join(Office, Group.office_id == Office.id)
+            .join(Company, Group.company_id == Company.id))
+
+
+def recreate_triggers(conn):
+    """Replace the inventory_membership triggers on conn (SQLite only)."""
+    if conn.dialect.name != 'sqlite':
+        return
+    for name in sorted(TRIGGERS):
+        conn.exec_driver_sql(
+            'DROP TRIGGER IF EXISTS inventory_membership_{}'.format(name))
+    for ddl in TRIGGER_DDL:
+        conn.execute(ddl)
+
+
+def rebuild(conn):
+    """Recreate the inventory_membership rows (and triggers) on conn."""
+    membership_table.create(conn, checkfirst=True)
+    if conn.dialect.name == 'sqlite':
+        for ddl in TRIGGER_DDL:
+            conn.execute(ddl)
+    conn.execute(membership_table.delete())
+    conn.execute(membership_table.insert().from_select(
+        ['fq_group_name', 'host_name', 'host_id', 'group_id'], _base_rows()))
+
+
+def check(conn):
+    """Compare inventory_membership with the base tables.
+
+    Returns a dict of the rows missing from and the extra rows in
+    inventory_membership, and the row counts of both sides: the table is
+    consistent when both lists are empty and the counts are equal (EXCEPT
+    doesn't see duplicate rows).
+    """
+    materialized = select(membership_table.c.fq_group_name,
+                          membership_table.c.host_name,
+                          membership_table.c.host_id,
+                          membership_table.c.group_id)
+    base = _base_rows()
+
+    def count(query):
+        return conn.execute(
+            select(func.count()).select_from(query.subquery())).scalar()
+
+    return {'missing': [tuple(row) for row in
+                        conn.execute(base.except_(materialized))],
+            'extra': [tuple(row) for row in
+                      conn.execute(materialized.except_(base))],
+            'base_rows': count(base),
+            'rows': count(materialized)}
+
+
+def is_consistent(report):
+    """Return True for a check() report without differences."""
+    return (not report['missing'] and not report['extra'] and
+            report['base_rows'] == report['rows'])
+
+
+def hosts_by_group(conn, fq_group_name=None):
+    """Yield (fq_group_name, host_name) ordered by group then host.
+
+    A scan (or, with fq_group_name, a seek) of the covering index.
+    """
+    query = (select(membership_table.c.fq_group_name,
+                    membership_table.c.host_name)
+             .order_by(membership_table.c.fq_group_name,
+                       membership_table.c.host_name))
+    if fq_group_name is not None:
+        query = query.where(membership_table.c.fq_group_name == fq_group_name)
+    for row in conn.execute(query):
+        yield tuple(row)
@@ -0,0 +1,189 @@
+"""Bulk host moves between offices and companies, and bulk renames.
+
+Both work in three steps: select the hosts with one query, check every
+conflict with the host table's _company_office_host_uc constraint with one
+set-based query per target office, then apply the change with bulk
+statements.  The caller
+commits, so a move or rename is all or nothing.
+
+A move keeps the hosts' ids, and so their variables and facts.  Their
+memberships are remapped by group name onto the groups of the target
+office: group_mapping renames groups on the way (None drops the
+membership), the other groups keep their name.  The inventory_membership
+triggers follow the association and host.name changes.
+"""
+
+import collections
+import logging
+
+from sqlalchemy import bindparam, select
+
+from chunks import chunks
+from inventory import (association_table,
+                       fact_file_table,
+                       Company,
+                       Group,
+                       Host,
+                       Office,
+                       )
+from search import reindex_hosts
+
+LOG = logging.getLogger('Manager')
+
+# Keys of a move_hosts() selector
+SELECTOR_KEYS = ('company_name', 'office_name', 'group_name', 'hostnames',
+                 'like')
+
+
+class MoveError(Exception):
+    """A move or rename that can't be applied as asked."""
+
+
+def select_hosts(session, selector):
+    """Return the (id, name, company_id, office_id) rows of a selector.
+
+    selector is a dict of company_name, office_name, group_name, hostnames
+    (a list) and like (a SQL LIKE pattern of host names).  It must have a
+    company_name or hostnames.
+    """
+    unknown = set(selector) - set(SELECTOR_KEYS)
+    if unknown:
+        raise MoveError("Unknown selector keys: {}".format(
+            ', '.join(sorted(unknown))))
+    if not selector.get('company_name') and selector.get('hostnames') is None:
+        raise MoveError("The selector needs a company_name or hostnames")
+
+    query = (select(Host.id, Host.name, Host.company_id, Host.office_id)
+             .join(Office, Host.office_id == Office.id)
+             .join(Company, Host.company_id == Company.id))
+    if selector.get('company_name'):
+        query = query.where(Company.name == selector['company_name'])
+    if selector.get('office_name'):
+        query = query.where(Office.name == selector['office_name'])
+    if selector.get('group_name'):
+        members = (select(association_table.c.host_id)
+                   .join(Group, association_table.c.group_id == Group.id)
+                   .where(Group.office_id == Office.id,
+                          Group.name == selector['group_name']))
+        query = query.where(Host.id.in_(members))
+    if selector.get('like'):
+        query = query.where(Host.name.like(selector['like']))
+    if selector.get('hostnames') is not None:
+        query = query.where(Host.name.in_(selector['hostnames']))
+    return session.execute(query.order_by(Host.id)).all()
+
+
+def _conflicts(session, targets, host_ids):
+    """Return the sorted (name, company_id, office_id) targets that clash.
+
+    targets are the new keys of the hosts host_ids: they clash with each
+    other or with the hosts that keep their key.
+    """
+    counts = collections.Counter(targets)
+    conflicts = set(target for target, count in counts.items() if count > 1)
+    host_ids = set(host_ids)
+    # One name IN (...) per office: a row value IN isn't an index lookup
+    offices = {}
+    for name, company_id, office_id in counts:
+        offices.setdefault((company_id, office_id), []).append(name)
+    for (company_id, office_id), names in sorted(offices.items()):
+        for chunk in chunks(sorted(names)):
+            for host_id, name in session.execute(
+                    select(Host.id, Host.name)
+                    .where(Host.name.in_(chunk),
+                           Host.company_id == company_id,
+                           Host.office_id == office_id)):
+                if host_id not in host_ids:
+                    conflicts.add((name, company_id, office_id))
+    return sorted(conflicts)
+
+
+def move_hosts(session, hosts, office, group_mapping=None):
+    """Move the hosts rows to office, remapping their memberships.
+
+    Raises MoveError, before changing anything, on name conflicts in the
+    target office and on target groups that don't exist.
+    """
+    group_mapping = group_mapping or {}
+    host_ids = [host.id for host in hosts]
+    conflicts = _conflicts(session, [(host.name, office.company_id,
+                                      office.id) for host in hosts],
+                           host_ids)
+    if conflicts:
+        raise MoveError("Hosts already exist in the target office: "
+                        "{}".format(', '.join(sorted(set(
+                            name for name, _, _ in conflicts)))))
+
+    targets = dict(session.execute(
+        select(Group.name, Group.id)
+        .where(Group.office_id == office.id)).all())
+    memberships = set()
+    missing = set()
+    for chunk in chunks(host_ids):
+        for host_id, group_name in session.execute(
+                select(association_table.c.host_id, Group.name)
+                .join(Group, association_table.c.group_id == Group.id)
+                .where(association_table.c.host_id.in_(chunk))):
+            target = group_mapping.get(group_name, group_name)
+            if target is None:
+                continue
+            if target not in targets:
+                missing.add(target)
+            else:
+                memberships.add((host_id, targets[target]))
+    if missing:
+        raise MoveError("Missing groups in the target office: {}".format(
+            ', '.join(sorted(missing))))
+
+    for chunk in chunks(host_ids):
+        session.execute(Host.__table__.update()
+                        .where(Host.__table__.c.id.in_(chunk))
+                        .values(company_id=office.company_id,
+                                office_id=office.id))
+        session.execute(association_table.delete()
+                        .where(association_table.c.host_id.in_(chunk)))
+    if memberships:
+        session.execute(association_table.insert(),
+                        [{'host_id': host_id, 'group_id': group_id}
+                         for host_id, group_id in sorted(memberships)])
+    reindex_hosts(session, host_ids)
+    return len(host_ids)
+
+
+def rename_hosts(session, hosts, mapping):
+    """Rename the hosts rows after mapping {old name: new name}.
+
+    Raises MoveError, before changing anything, when a new name is taken in
+    its office.  Names may be swapped.
+    """
+    renames = [(host, mapping[host.name]) for host in hosts
+               if mapping[host.name] != host.name]
+    host_ids = [host.id for host, _ in renames]
+    conflicts = _conflicts(session, [(name, host.company_id, host.office_id)
+                                     for host, name in renames],
+                           host_ids)
+    if conflicts:
+        raise MoveError("Host names already taken: {}".format(
+            ', '.join(sorted(set(name for name, _, _ in conflicts)))))
+    if not renames:
+        return 0
+
+    table = Host.__table__
+    old_names = set(host.name for host, _ in renames)
+    if old_names & set(name for _, name in renames):
+        # The unique constraint is checked row by row: free the names first
+        for chunk in chunks(host_ids):
+            session.execute(table.update().where(table.c.id.in_(chunk))
+                            .values(name='~renaming~' +
+                                    table.c.id.cast(Host.name.type)))
+    session.execute(table.update().where(table.c.id == bindparam('_id'))
+                    .values(name=bindparam('_name')),
+                    [{'_id': host.id, '_name': name}
+                     for host, name in renames])
+    # Facts are cached by host name: the old names' state is stale now
+    for chunk in chunks(sorted(old_names)):
+        session.execute(fact_file_table.delete().where(
+            fact_file_table.c.name.in_(chunk),
+            fact_file_table.c.name.notin_(select(Host.name))))
+    reindex_hosts(session, host_ids)
+    return len(renames)
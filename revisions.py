@@ -0,0 +1,128 @@
+"""Database-level data revisions: the ``inventory_revision`` table.
+
+The table holds one counter per inventory table.  track(engine) makes
+every transaction on the engine increment, when it commits, the counters
+of the tables its INSERT, UPDATE and DELETE statements changed rows of:
+once per table and transaction, inside that transaction, whichever
+Manager, ORM flush or bulk statement wrote them.  Every Manager tracks its
+engine, so the Manager's cached views (see Manager.get_graph) notice the
+commits of other Managers and processes on the same database, not only
+their own.
+
+Writes made without SQLAlchemy (the sqlite3 shell, other programs) don't
+move the counters.
+"""
+
+import logging
+
+from sqlalchemy import event, select
+
+from inventory import revision_table
+
+LOG = logging.getLogger('Manager')
+
+# Tables with a counter: the inventory and the variables tables
+TABLES = ('company', 'office', 'group', 'host', 'association',
+          'company_var', 'office_var', 'group_var', 'host_var')
+
+# Connection.info keys: the tables changed by the open transaction, and
+# the (table, total_changes before it) of the last SQLite write statement
+_CHANGED = 'inventory_revision_changed'
+_PENDING = 'inventory_revision_pending'
+
+
+def _insert_rows(conn):
+    conn.execute(revision_table.insert(),
+                 [{'table_name': table, 'revision': 0} for table in TABLES])
+
+
+@event.listens_for(revision_table, 'after_create')
+def _after_create(target, conn, **kw):
+    _insert_rows(conn)
+
+
+def install(conn):
+    """Create the table and its rows on conn."""
+    revision_table.create(conn, checkfirst=True)
+    if not conn.execute(select(revision_table.c.table_name)).first():
+        _insert_rows(conn)
+
+
+def _written_table(context):
+    """Return the name of the counted table a DML statement writes."""
+    if context is None or not (context.isinsert or context.isupdate or
+                               context.isdelete):
+        return None
+    table = getattr(context.compiled.statement, 'table', None)
+    name = getattr(table, 'name', None)
+    return name if name in TABLES else None
+
+
+def _resolve(conn):
+    """Count the pending SQLite statement if it changed rows."""
+    pending = conn.info.pop(_PENDING, None)
+    if pending is not None:
+        name, total = pending
+        if conn.connection.dbapi_connection.total_changes != total:
+            conn.info.setdefault(_CHANGED, set()).add(name)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if conn.dialect.name != 'sqlite':
+        return
+    # SQLite counts the changes of an INSERT ... RETURNING once its rows
+    # are fetched: check a statement when the next one starts
+    _resolve(conn)
+    name = _written_table(context)
+    if name is not None:
+        conn.info[_PENDING] = (
+            name, conn.connection.dbapi_connection.total_changes)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if conn.dialect.name == 'sqlite':
+        return
+    name = _written_table(context)
+    if name is not None and cursor.rowcount != 0:
+        conn.info.setdefault(_CHANGED, set()).add(name)
+
+
+def _commit(conn):
+    # Runs before the DBAPI commit: the bump is part of the transaction
+    if conn.dialect.name == 'sqlite':
+        _resolve(conn)
+    changed = conn.info.pop(_CHANGED, None)
+    if not changed:
+        return
+    cursor = conn.connection.cursor()
+    try:
+        # The names are TABLES, never user input
+        cursor.execute("UPDATE inventory_revision SET revision = revision + 1 "
+                       "WHERE table_name IN ({})".format(
+                           ', '.join("'{}'".format(name)
+                                     for name in sorted(changed))))
+    finally:
+        cursor.close()
+
+
+def _rollback(conn):
+    conn.info.pop(_CHANGED, None)
+    conn.info.pop(_PENDING, None)
+
+
+def track(engine):
+    """Count the committed writes of engine's transactions (idempotent)."""
+    if event.contains(engine, 'commit', _commit):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'commit', _commit)
+    event.listen(engine, 'rollback', _rollback)
+
+
+def read(conn):
+    """Return {table: revision} of the counters in the database."""
+    return dict(conn.execute(select(revision_table.c.table_name,
+                                    revision_table.c.revision)).all())
@@ -0,0 +1,269 @@
+"""Schema versioning for the inventory database.
+
+The schema version lives in the single row ``inventory_schema`` table, so a
+Manager only needs one primary key lookup on startup instead of reflecting
+every table through ``Base.metadata.create_all``.
+
+A brand new (empty) database is created at SCHEMA_VERSION automatically.
+Existing databases are upgraded explicitly::
+
+    python schema.py upgrade sqlite:////tmp/sqlalchemy_example.db
+    python schema.py version sqlite:////tmp/sqlalchemy_example.db
+
+Each entry in MIGRATIONS upgrades the schema from version - 1 to version and
+must leave the database identical to what create_all() builds from the
+models in inventory.py.
+"""
+
+import argparse
+import logging
+import sys
+
+from sqlalchemy import (and_, bindparam, create_engine, func, inspect,
+                        select)
+from sqlalchemy.exc import DBAPIError
+
+import membership
+import revisions
+import search
+from inventory import (Base,
+                       association_table,
+                       audit_log_table,
+                       fact_file_table,
+                       schema_version_table,
+                       snapshot_chunk_table,
+                       snapshot_table,
+                       CompanyVar,
+                       Group,
+                       GroupVar,
+                       Host,
+                       HostVar,
+                       Office,
+                       OfficeVar,
+                       )
+
+LOG = logging.getLogger('Manager')
+
+
+class SchemaVersionError(Exception):
+    """The database schema does not match SCHEMA_VERSION."""
+
+
+# -----------------------------------------------------------------------------
+# Migrations
+# -----------------------------------------------------------------------------
+def _add_foreign_key_indexes(conn):
+    """Index the foreign keys used by every office/group/host lookup."""
+    for table in (Office.__table__, Group.__table__, Host.__table__,
+                  association_table):
+        for index in table.indexes:
+            # The unique association index comes with version 13
+            if not index.unique:
+                index.create(conn, checkfirst=True)
+
+
+def _add_host_search(conn):
+    """Create and fill the host_search FTS index (SQLite only)."""
+    search.rebuild(conn)
+
+
+def _add_audit_log(conn):
+    audit_log_table.create(conn, checkfirst=True)
+
+
+def _add_membership(conn):
+    """Create, fill and attach the triggers of inventory_membership."""
+    membership.rebuild(conn)
+
+
+def _add_host_vars(conn):
+    """Create host_var and the fact_file state of the fact ingestion."""
+    HostVar.__table__.create(conn, checkfirst=True)
+    fact_file_table.create(conn, checkfirst=True)
+
+
+def _rowid_host_search(conn):
+    """Rebuild host_search with the host ids as rowids (SQLite only)."""
+    search.rebuild(conn)
+
+
+def _add_variables(conn):
+    """Create the company, office and group variables and Group.priority."""
+    for model in (CompanyVar, OfficeVar, GroupVar):
+        model.__table__.create(conn, checkfirst=True)
+    columns = [column['name']
+               for column in inspect(conn).get_columns(Group.__tablename__)]
+    if 'priority' not in columns:
+        conn.exec_driver_sql('ALTER TABLE "group" ADD COLUMN priority '
+                             'INTEGER DEFAULT 1 NOT NULL')
+
+
+def _add_snapshots(conn):
+    snapshot_chunk_table.create(conn, checkfirst=True)
+    snapshot_table.create(conn, checkfirst=True)
+
+
+def _guard_membership_triggers(conn):
+    """Skip the membership rewrites of renames that keep the name."""
+    membership.recreate_triggers(conn)
+
+
+def _add_revisions(conn):
+    """Create inventory_revision, see revisions.py."""
+    revisions.install(conn)
+
+
+def _drop_revision_triggers(conn):
+    """Drop the per row revision triggers of version 11 (SQLite only)."""
+    if conn.dialect.name != 'sqlite':
+        return
+    for table in revisions.TABLES:
+        for event_name in ('insert', 'update', 'delete'):
+            conn.exec_driver_sql(
+                'DROP TRIGGER IF EXISTS inventory_revision_{}_{}'.format(
+                    table, event_name))
+
+
+def _unique_memberships(conn):
+    """Reduce the duplicated associations to one row, then index them
+    unique."""
+    table = association_table
+    pairs = [{'h_id': host_id, 'g_id': group_id}
+             for host_id, group_id in conn.execute(
+                 select(table.c.host_id, table.c.group_id)
+                 .group_by(table.c.host_id, table.c.group_id)
+                 .having(func.count() > 1))]
+    if pairs:
+        conn.execute(table.delete().where(and_(
+            table.c.host_id == bindparam('h_id'),
+            table.c.group_id == bindparam('g_id'))), pairs)
+        conn.execute(table.insert().values(
+            host_id=bindparam('h_id'), group_id=bindparam('g_id')), pairs)
+    for index in table.indexes:
+        if index.unique:
+            index.create(conn, checkfirst=True)
+
+
+# version: migration from version - 1
+MIGRATIONS = {
+    2: _add_foreign_key_indexes,
+    3: _add_host_search,
+    4: _add_audit_log,
+    5: _add_membership,
+    6: _add_host_vars,
+    7: _rowid_host_search,
+    8: _add_variables,
+    9: _add_snapshots,
+    10: _guard_membership_triggers,
+    11: _add_revisions,
+    12: _drop_revision_triggers,
+    13: _unique_memberships,
+}
+SCHEMA_VERSION = max(MIGRATIONS)
+
+
+# -----------------------------------------------------------------------------
+# Version handling
+# -----------------------------------------------------------------------------
+def get_version(engine):
+    """Return the stored schema version or None if there isn't one."""
+    query = select(schema_version_table.c.version).where(
+        schema_version_table.c.id == 1)
+    try:
+        with engine.connect() as conn:
+            return conn.execute(query).scalar()
+    except DBAPIError:
+        return None
+
+
+def _stamp(conn, version):
+    table = schema_version_table
+    if conn.execute(select(table.c.id).where(table.c.id == 1)).first():
+        conn.execute(table.update().where(table.c.id == 1)
+                     .values(version=version))
+    else:
+        conn.execute(table.insert().values(id=1, version=version))
+
+
+def create_schema(engine):
+    """Create all tables at SCHEMA_VERSION.
+
+    Databases created before schema versioning (tables but no version row)
+    are stamped as version 1 and left for upgrade_schema().
+    Returns the schema version of the database.
+    """
+    version = get_version(engine)
+    if version is not None:
+        return version
+
+    legacy = inspect(engine).has_table(Host.__tablename__)
+    with engine.begin() as conn:
+        if legacy:
+            schema_version_table.create(conn, checkfirst=True)
+            version = 1
+        else:
+            Base.metadata.create_all(conn)
+            version = SCHEMA_VERSION
+        _stamp(conn, version)
+
+    LOG.info("Created schema version %s", version)
+    return version
+
+
+def upgrade_schema(engine):
+    """Apply all pending migrations in one transaction.
+
+    Returns the schema version of the database.
+    """
+    version = create_schema(engine)
+    if version > SCHEMA_VERSION:
+        raise SchemaVersionError(
+            "Database schema version {} is newer than {}".format(
+                version, SCHEMA_VERSION))
+    if version == SCHEMA_VERSION:
+        return version
+
+    with engine.begin() as conn:
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            LOG.info("Upgrading schema to version %s", target)
+            MIGRATIONS[target](conn)
+        _stamp(conn, SCHEMA_VERSION)
+    return SCHEMA_VERSION
+
+
+def check_schema(engine):
+    """Fast startup check: one single row lookup on an existing database.
+
+    An empty database is created at SCHEMA_VERSION, anything else must
+    already be at SCHEMA_VERSION.
+    """
+    version = get_version(engine)
+    if version is None:
+        version = create_schema(engine)
+    if version != SCHEMA_VERSION:
+        raise SchemaVersionError(
+            "Database schema version is {}, expected {}: "
+            "run 'python schema.py upgrade <url>'".format(
+                version, SCHEMA_VERSION))
+    return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('create', 'upgrade', 'version'))
+    parser.add_argument('url', help="SQLAlchemy database URL")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.url)
+    if args.command == 'create':
+        version = create_schema(engine)
+    elif args.command == 'upgrade':
+        version = upgrade_schema(engine)
+    else:
+        version = get_version(engine)
+    print(version)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
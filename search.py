@@ -0,0 +1,214 @@
+"""Host search over host, group, office and company names.
+
+On SQLite the search is backed by the ``host_search`` FTS5 table, one row
+per host, using the trigram tokenizer so that both substring and prefix
+queries are answered from the index::
+
+    manager.search_hosts('db-07')      # substring, ranked with bm25
+    manager.search_hosts('db*')        # prefix of the host name
+
+The index is not maintained by triggers: the Manager write paths call
+reindex_hosts() with the ids of the hosts they touched, in the same
+transaction as the change itself.  rebuild() recreates it from scratch.
+The rowid of an index row is its host id, so reindexing a host is a rowid
+lookup rather than a scan of the whole index.
+
+Other databases have no host_search table and fall back to LIKE queries.
+"""
+
+import logging
+
+from sqlalchemy import (Column,
+                        DDL,
+                        Integer,
+                        MetaData,
+                        String,
+                        Table,
+                        event,
+                        func,
+                        or_,
+                        select,
+                        text,
+                        )
+
+from chunks import chunks
+from inventory import (association_table,
+                       Company,
+                       Office,
+                       Group,
+                       Host,
+                       )
+
+LOG = logging.getLogger('Manager')
+
+# Queries shorter than a trigram can't use the FTS index
+MIN_MATCH_LENGTH = 3
+# Relative weights of host_id, host, groups, office and company matches
+WEIGHTS = (0.0, 10.0, 4.0, 2.0, 1.0)
+
+HOST_SEARCH_DDL = DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS host_search USING fts5("
+    "host_id UNINDEXED, host, groups, office, company, "
+    "tokenize='trigram')")
+event.listen(Host.__table__, 'after_create',
+             HOST_SEARCH_DDL.execute_if(dialect='sqlite'))
+
+# Not part of Base.metadata: create_all() can't create virtual tables
+host_search_table = Table('host_search', MetaData(),
+                          Column('rowid', Integer),
+                          Column('host_id', Integer),
+                          Column('host', String),
+                          Column('groups', String),
+                          Column('office', String),
+                          Column('company', String),
+                          )
+
+
+def has_index(bind):
+    """Return True when the database of an Engine or Connection supports
+    the host_search index."""
+    return bind.dialect.name == 'sqlite'
+
+
+def _documents():
+    """Select one (rowid, host_id, host, groups, office, company) row per
+    host.
+
+    groups is the newline separated list of company_office_group names.
+    """
+    fq_name = Company.name + '_' + Office.name + '_' + Group.name
+    groups = (select(func.group_concat(fq_name, '\n'))
+              .select_from(association_table)
+              .join(Group, association_table.c.group_id == Group.id)
+              .join(Office, Group.office_id == Office.id)
+              .join(Company, Group.company_id == Company.id)
+              .where(association_table.c.host_id == Host.id)
+              .scalar_subquery())
+    HostOffice = Office.__table__.alias('host_office')
+    HostCompany = Company.__table__.alias('host_company')
+    return (select(Host.id.label('rowid'), Host.id, Host.name, groups,
+                   HostOffice.c.name, HostCompany.c.name)
+            .join(HostOffice, Host.office_id == HostOffice.c.id)
+            .join(HostCompany, Host.company_id == HostCompany.c.id))
+
+
+def reindex_hosts(session, host_ids):
+    """Refresh the index rows of host_ids (deleted hosts are dropped)."""
+    if not has_index(session.get_bind()):
+        return
+    for chunk in chunks(set(host_ids)):
+        session.execute(host_search_table.delete()
+                        .where(host_search_table.c.rowid.in_(chunk)))
+        session.execute(host_search_table.insert().from_select(
+            host_search_table.c.keys(),
+            _documents().where(Host.id.in_(chunk))))
+
+
+def rebuild(conn):
+    """Recreate the whole index on a Connection."""
+    if not has_index(conn):
+        return
+    conn.execute(HOST_SEARCH_DDL)
+    conn.execute(host_search_table.delete())
+    conn.execute(host_search_table.insert().from_select(
+        host_search_table.c.keys(), _documents()))
+
+
+def _result(host, groups, office, company):
+    return {'host': host,
+            'company': company,
+            'office': office,
+            'groups': sorted(groups.split('\n')) if groups else []}
+
+
+def _escape_like(query):
+    return (query.replace('\\', '\\\\')
+               .replace('%', '\\%').replace('_', '\\_'))
+
+
+def search_hosts(session, query, limit=20):
+    """Return up to limit (None: every) matching hosts, best matches first.
+
+    A query ending in '*' matches host names starting with the rest of it;
+    anything else is a substring match on host, group, office and company
+    names.  Each result is a dict of host, company, office and groups, the
+    fully qualified company_office_group names of the host.
+    """
+    query = (query or '').strip()
+    if not query:
+        return []
+    prefix = query.endswith('*')
+    term = query.rstrip('*')
+    if not term:
+        return []
+
+    if not has_index(session.get_bind()):
+        return _search_tables(session, term, prefix, limit)
+
+    columns = "host, groups, office, company"
+    # SQLite reads a negative LIMIT as no limit
+    params = {'limit': -1 if limit is None else limit}
+    if prefix:
+        # The trigram index can't serve LIKE ... ESCAPE, only escape if needed
+        escaped = _escape_like(term)
+        params['pattern'] = escaped + '%'
+        sql = ("SELECT {} FROM host_search WHERE host LIKE :pattern " +
+               ("ESCAPE '\\' " if escaped != term else "") +
+               "ORDER BY length(host), host LIMIT :limit")
+    elif len(term) < MIN_MATCH_LENGTH:
+        params['pattern'] = '%' + _escape_like(term) + '%'
+        sql = ("SELECT {} FROM host_search WHERE host_search.host LIKE "
+               ":pattern ESCAPE '\\' OR groups LIKE :pattern ESCAPE '\\' "
+               "OR office LIKE :pattern ESCAPE '\\' "
+               "OR company LIKE :pattern ESCAPE '\\' "
+               "ORDER BY length(host), host LIMIT :limit")
+    else:
+        # Exact host names first, then bm25 rank
+        params['term'] = term
+        params['match'] = '"{}"'.format(term.replace('"', '""'))
+        sql = ("SELECT {} FROM host_search WHERE host_search MATCH :match "
+               "ORDER BY lower(host) = lower(:term) DESC, "
+               "bm25(host_search, " +
+               ', '.join(str(weight) for weight in WEIGHTS) +
+               "), length(host), host LIMIT :limit")
+    rows = session.execute(text(sql.format(columns)), params)
+    return [_result(*row) for row in rows]
+
+
+def _search_tables(session, term, prefix, limit):
+    """LIKE based search for databases without the FTS index."""
+    if prefix:
+        condition = Host.name.like(_escape_like(term) + '%', escape='\\')
+    else:
+        pattern = '%' + _escape_like(term) + '%'
+        group_hosts = (select(association_table.c.host_id)
+                       .join(Group, association_table.c.group_id == Group.id)
+                       .where(Group.name.like(pattern, escape='\\')))
+        condition = or_(Host.name.like(pattern, escape='\\'),
+                        Office.name.like(pattern, escape='\\'),
+                        Company.name.like(pattern, escape='\\'),
+                        Host.id.in_(group_hosts))
+    query = (select(Host.id, Host.name, Office.name, Company.name)
+             .join(Office, Host.office_id == Office.id)
+             .join(Company, Host.company_id == Company.id)
+             .where(condition)
+             .order_by(func.length(Host.name), Host.name)
+             .limit(limit))
+    hosts = session.execute(query).all()
+    groups = {}
+    if hosts:
+        for host_id, company, office, group in session.execute(
+                select(association_table.c.host_id, Company.name,
+                       Office.name, Group.name)
+                .join(Group, association_table.c.group_id == Group.id)
+                .join(Office, Group.office_id == Office.id)
+                .join(Company, Group.company_id == Company.id)
+                .where(association_table.c.host_id.in_(
+                    [host[0] for host in hosts]))):
+            groups.setdefault(host_id, []).append(
+                '{}_{}_{}'.format(company, office, group))
+    return [{'host': host,
+             'company': company,
+             'office': office,
+             'groups': sorted(groups.get(host_id, []))}
+            for host_id, host, office, company in hosts]
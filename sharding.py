@@ -0,0 +1,417 @@
+"""Per-company database sharding.
+
+ShardRouter maps every company to its own SQLite file in a directory, so a
+bulk import into one company never locks the others and no single file
+holds every tenant.  ShardedManager exposes the Manager API on top of it:
+
+* methods with a company_name argument are routed to that company's shard
+  (add_*, ensure_* and sync create the shard, other methods only use
+  existing ones and behave as for a missing company otherwise);
+* cross-company methods (list_companies, iter_* without company_name,
+  export, hosts_by_group, search_hosts, check_integrity, ...) fan out over
+  all shards, in parallel threads where the results are collected; export
+  streams the shards one after another instead;
+* methods whose result is per shard (ingest_facts, snapshot,
+  list_snapshots, prune_snapshots) return {company: result};
+* move_hosts is routed on its selector's company_name and can't move
+  hosts to another company: that would cross shards.  Snapshot revisions
+  are numbered per shard, so diff_snapshots needs a company_name and
+  export(at_revision=...) is refused: use shard(company_name) for those.
+
+batch(), get_graph() and the other caches are per Manager: use
+shard(company_name) for them too.
+
+    manager = ShardedManager(ShardRouter('/var/lib/inventory'))
+    manager.add_company(company_name='Acme')     # creates Acme.db
+    manager.export('json')
+
+Every shard has its own transaction: sync() of a multi-company spec is
+atomic per company, not across companies.
+"""
+
+import concurrent.futures
+import heapq
+import inspect
+import io
+import itertools
+import logging
+import os
+from pprint import pprint as pp
+from urllib.parse import quote, unquote
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+
+import export
+import membership
+import stats
+import variables
+from Manager import Manager
+
+LOG = logging.getLogger('Manager')
+
+SUFFIX = '.db'
+# Methods that create a missing shard for their company
+CREATING = ('add_', 'ensure_')
+
+
+class ShardRouter(object):
+    """Map company names to per-company SQLite database files."""
+
+    def __init__(self, directory, **engine_kwargs):
+        self.directory = directory
+        self.engine_kwargs = engine_kwargs
+        self._engines = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, company_name):
+        return os.path.join(self.directory,
+                            quote(company_name, safe='') + SUFFIX)
+
+    def exists(self, company_name):
+        return (company_name in self._engines or
+                os.path.exists(self.path(company_name)))
+
+    def company_names(self):
+        """Return the sorted names of the companies that have a shard."""
+        names = set(self._engines)
+        for filename in os.listdir(self.directory):
+            if filename.endswith(SUFFIX):
+                names.add(unquote(filename[:-len(SUFFIX)]))
+        return sorted(names)
+
+    def engine(self, company_name):
+        """Return the engine of company_name's shard, creating the file."""
+        if company_name not in self._engines:
+            # URL.create: the quoted path must not be unquoted again
+            url = URL.create('sqlite', database=self.path(company_name))
+            self._engines[company_name] = create_engine(url,
+                                                        **self.engine_kwargs)
+        return self._engines[company_name]
+
+    def dispose(self):
+        for engine in self._engines.values():
+            engine.dispose()
+        self._engines = {}
+
+
+class ShardedManager(object):
+    """Manager API over a ShardRouter, one Manager per company."""
+
+    def __init__(self, router, max_workers=4, **manager_kwargs):
+        self.router = router
+        self.max_workers = max_workers
+        self.manager_kwargs = manager_kwargs
+        self._managers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for manager in self._managers.values():
+            manager.close()
+        self._managers = {}
+        self.router.dispose()
+
+    def shard(self, company_name, create=False):
+        """Return the Manager of company_name's shard, or None."""
+        if not company_name:
+            return None
+        if company_name not in self._managers:
+            if not create and not self.router.exists(company_name):
+                return None
+            self._managers[company_name] = Manager(
+                self.router.engine(company_name), **self.manager_kwargs)
+        return self._managers[company_name]
+
+    def shards(self):
+        """Return [(company_name, Manager)] of every shard, by company."""
+        return [(name, self.shard(name))
+                for name in self.router.company_names()]
+
+    def _map(self, function):
+        """Return {company: function(manager)} run in parallel threads."""
+        shards = self.shards()
+        if len(shards) < 2 or self.max_workers < 2:
+            return dict((name, function(manager)) for name, manager in shards)
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as pool:
+            futures = dict((name, pool.submit(function, manager))
+                           for name, manager in shards)
+            return dict((name, future.result())
+                        for name, future in futures.items())
+
+    # -------------------------------------------------------------------------
+    # Routed methods
+    # -------------------------------------------------------------------------
+    def __getattr__(self, name):
+        method = getattr(Manager, name, None)
+        if name.startswith('_') or not callable(method):
+            raise AttributeError(name)
+        signature = inspect.signature(method)
+        if 'company_name' not in signature.parameters:
+            raise AttributeError(
+                "{} has no company_name to route on".format(name))
+        create = name.startswith(CREATING)
+
+        def routed(*args, **kwargs):
+            bound = signature.bind(None, *args, **kwargs)
+            company_name = bound.arguments.get('company_name')
+            manager = self.shard(company_name, create=create)
+            if manager is None:
+                LOG.error("Company does not Exists: %s", company_name)
+                return
+            return getattr(manager, name)(*args, **kwargs)
+        routed.__name__ = name
+        return routed
+
+    def sync(self, spec, prune=False, dry_run=False):
+        """Sync each company of spec into its shard.
+
+        Returns {company: SyncPlan}.
+        """
+        plans = {}
+        for company_name in sorted(spec):
+            manager = self.shard(company_name, create=not dry_run)
+            if manager is None:
+                # Nothing of this company exists yet: plan on a new database
+                manager = Manager(create_engine('sqlite://'))
+            plans[company_name] = manager.sync(
+                {company_name: spec[company_name]}, prune=prune,
+                dry_run=dry_run)
+        return plans
+
+    # -------------------------------------------------------------------------
+    # Fan-out methods
+    # -------------------------------------------------------------------------
+    def _chain(self, method, company_name, after, **kwargs):
+        """Chain the keyset iterators of the shards, in company order."""
+        if company_name:
+            manager = self.shard(company_name)
+            if manager is None:
+                return iter(())
+            return getattr(manager, method)(company_name=company_name,
+                                            after=after, **kwargs)
+        if isinstance(after, str):
+            after = (after,)
+        limit = kwargs.pop('limit', None)
+        rows = []
+        for name, manager in self.shards():
+            if after and name < after[0]:
+                continue
+            shard_after = after if after and name == after[0] else None
+            rows.append(getattr(manager, method)(after=shard_after,
+                                                 **kwargs))
+        return itertools.islice(itertools.chain(*rows), limit)
+
+    def iter_companies(self, after=None, limit=None, like=None, **kwargs):
+        if isinstance(after, str):
+            after = (after,)
+        rows = []
+        for name, manager in self.shards():
+            if after and name <= after[0]:
+                continue
+            rows.append(manager.iter_companies(like=like, **kwargs))
+        return itertools.islice(itertools.chain(*rows), limit)
+
+    def iter_offices(self, company_name=None, after=None, **kwargs):
+        return self._chain('iter_offices', company_name, after, **kwargs)
+
+    def iter_groups(self, company_name=None, after=None, **kwargs):
+        return self._chain('iter_groups', company_name, after, **kwargs)
+
+    def iter_hosts(self, company_name=None, after=None, **kwargs):
+        return self._chain('iter_hosts', company_name, after, **kwargs)
+
+    def list_companies(self):
+        for row in self.iter_companies():
+            print(row.company)
+
+    def list_offices(self, company_name='all'):
+        if company_name != 'all':
+            return self.__getattr__('list_offices')(company_name=company_name)
+        for _, manager in self.shards():
+            manager.list_offices()
+
+    def list_groups(self, company_name='all', office_name='all'):
+        if company_name != 'all':
+            return self.__getattr__('list_groups')(company_name=company_name,
+                                                   office_name=office_name)
+        for _, manager in self.shards():
+            manager.list_groups()
+
+    def hosts_by_group(self, fq_group_name=None):
+        group_hosts = {}
+        for hosts in self._map(lambda manager: manager.hosts_by_group(
+                fq_group_name)).values():
+            group_hosts.update(hosts)
+        return group_hosts
+
+    def dump_hosts_by_group(self):
+        pp(self.hosts_by_group())
+
+    def _hostvars(self, shards):
+        """Yield (host name, variables) of the shards, merged by name."""
+        def hostvars(manager):
+            with manager.session.get_bind().connect() as conn:
+                for _, name, host_vars in variables.iter_effective_vars(
+                        conn, variables.VariableResolver(conn)):
+                    yield name, host_vars
+
+        return heapq.merge(*[hostvars(manager) for _, manager in shards],
+                           key=lambda item: item[0])
+
+    def iter_effective_vars(self):
+        """Yield (host name, variables) of every host, ordered by name.
+
+        Hosts of the same name in several companies are all yielded.
+        """
+        return self._hostvars(self.shards())
+
+    def export(self, format='json', out=None, at_revision=None):
+        """Export every shard as one inventory.
+
+        The shards are streamed through the writer one after another, in
+        company order, so no more than a group of rows is held at a time.
+        The host variables are merged by host name from one paged read
+        per shard (see variables.iter_effective_vars).  Snapshots are per
+        shard: export one with shard(company_name).export(at_revision=...).
+        """
+        if format not in export.WRITERS:
+            LOG.error("Unknown export format: %s", format)
+            return
+        if at_revision is not None:
+            LOG.error("Snapshot revisions are per company, export "
+                      "shard(company_name) at revision %s", at_revision)
+            return
+
+        def rows(manager):
+            with manager.session.get_bind().connect() as conn:
+                for row in membership.hosts_by_group(conn):
+                    yield row
+
+        shards = self.shards()
+        groups = export.grouped(itertools.chain.from_iterable(
+            rows(manager) for _, manager in shards))
+        kwargs = {}
+        if format in export.HOSTVARS:
+            kwargs['hostvars'] = self._hostvars(shards)
+        writer, binary = export.WRITERS[format]
+        if out is not None:
+            writer(groups, out, **kwargs)
+            return
+        buffer = io.BytesIO() if binary else io.StringIO()
+        writer(groups, buffer, **kwargs)
+        return buffer.getvalue()
+
+    def search_hosts(self, query, limit=20):
+        """Search every shard; exact host names first, then by shard rank."""
+        results = self._map(
+            lambda manager: manager.search_hosts(query, limit=limit))
+        term = (query or '').strip().rstrip('*').lower()
+        ranked = []
+        for name in sorted(results):
+            for rank, result in enumerate(results[name]):
+                ranked.append((result['host'].lower() != term, rank, name,
+                               result))
+        ranked.sort(key=lambda item: item[:3])
+        return [item[3] for item in ranked[:limit]]
+
+    def stats(self):
+        """Return the statistics of every shard merged, see stats.py."""
+        shard_stats = self._map(lambda manager: manager.stats())
+        return stats.merge(shard_stats[name] for name in sorted(shard_stats))
+
+    def check_integrity(self, repair=False):
+        """Return {company: [Finding]} of the shards with findings."""
+        findings = self._map(
+            lambda manager: manager.check_integrity(repair=repair))
+        return dict((name, found) for name, found in findings.items()
+                    if found)
+
+    def check_membership(self):
+        return self._map(lambda manager: manager.check_membership())
+
+    def rebuild_membership(self):
+        self._map(lambda manager: manager.rebuild_membership())
+
+    def rebuild_search(self):
+        self._map(lambda manager: manager.rebuild_search())
+
+    def ingest_facts(self, directory, **kwargs):
+        """Ingest a fact cache into every shard, see Manager.ingest_facts.
+
+        Each shard stores the facts of its hosts; the hosts of other
+        companies count as unknown. Returns {company: IngestReport}.
+        """
+        return self._map(
+            lambda manager: manager.ingest_facts(directory, **kwargs))
+
+    # -------------------------------------------------------------------------
+    # Per shard methods
+    # -------------------------------------------------------------------------
+    def move_hosts(self, selector=None, to_company=None, to_office=None,
+                   group_mapping=None):
+        """Move hosts to another office of their company, see
+        Manager.move_hosts.
+
+        Each company has its own shard: hosts can't be moved to another
+        company (to_company must be the selector's company_name).
+        """
+        company_name = (selector or {}).get('company_name')
+        if not company_name:
+            LOG.error("You must supply a selector with a company_name")
+            return
+        if to_company and to_company != company_name:
+            LOG.error("Cannot move hosts from %s to %s: each company has its "
+                      "own shard", company_name, to_company)
+            return
+        manager = self.shard(company_name)
+        if manager is None:
+            LOG.error("Company does not Exists: %s", company_name)
+            return
+        return manager.move_hosts(selector=selector, to_company=to_company,
+                                  to_office=to_office,
+                                  group_mapping=group_mapping)
+
+    def snapshot(self, label=None):
+        """Snapshot every shard; return {company: revision}."""
+        return self._map(lambda manager: manager.snapshot(label=label))
+
+    def list_snapshots(self, before=None, limit=None, company_name=None):
+        """Return the snapshots of company_name's shard, or of every shard
+        as {company: snapshots}, see Manager.list_snapshots.
+        """
+        if company_name:
+            manager = self.shard(company_name)
+            if manager is None:
+                LOG.error("Company does not Exists: %s", company_name)
+                return
+            return manager.list_snapshots(before=before, limit=limit)
+        return self._map(lambda manager: manager.list_snapshots(
+            before=before, limit=limit))
+
+    def diff_snapshots(self, old_revision=None, new_revision=None,
+                       company_name=None):
+        """Compare two snapshots of company_name's shard.
+
+        Snapshot revisions are numbered per shard: company_name is needed.
+        """
+        if not company_name:
+            LOG.error("Snapshot revisions are per company: you must supply "
+                      "company_name")
+            return
+        manager = self.shard(company_name)
+        if manager is None:
+            LOG.error("Company does not Exists: %s", company_name)
+            return
+        return manager.diff_snapshots(old_revision=old_revision,
+                                      new_revision=new_revision)
+
+    def prune_snapshots(self, keep=None, before=None):
+        """Prune the snapshots of every shard; return {company: deleted}."""
+        return self._map(lambda manager: manager.prune_snapshots(
+            keep=keep, before=before))
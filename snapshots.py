@@ -0,0 +1,265 @@
+"""Content-addressed snapshots of the inventory (time travel).
+
+snapshot() records what the JSON export writes, the hosts of every group
+and the effective variables of every host, as chunks of JSON stored in
+snapshot_chunk under the sha1 of that JSON:
+
+* one chunk per distinct group host list,
+* one chunk per distinct host variables dict,
+* BUCKETS chunks of sorted [group, hosts sha1] pairs and BUCKETS chunks of
+  sorted [host, variables sha1] pairs, the groups and hosts spread over
+  their buckets by the crc32 of their name,
+* the manifest: the sha1s of the group and of the hostvars buckets.
+
+A chunk is stored once, so a new revision only costs the chunks of the
+groups, variables and buckets that changed, plus its fixed size manifest;
+snapshotting an unchanged inventory returns the previous revision.  prune()
+drops old revisions, then deletes the chunks no remaining snapshot
+references.
+"""
+
+import hashlib
+import json
+import logging
+import time
+import zlib
+
+from sqlalchemy import select
+
+import export
+import variables
+# chunks are the snapshot documents here
+from chunks import chunks as _batches
+from inventory import snapshot_chunk_table, snapshot_table
+from upsert import insert_missing
+
+LOG = logging.getLogger('Manager')
+
+BUCKETS = 64
+
+
+def _encode(document):
+    data = json.dumps(document, sort_keys=True,
+                      separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(data).hexdigest(), data
+
+
+def _bucket(name):
+    return zlib.crc32(name.encode('utf-8')) % BUCKETS
+
+
+def _store(session, chunks):
+    """Insert the {sha1: JSON} chunks not stored yet; return their number."""
+    table = snapshot_chunk_table
+    missing = dict(chunks)
+    for batch in _batches(sorted(chunks)):
+        for sha1 in session.execute(select(table.c.sha1)
+                                    .where(table.c.sha1.in_(batch))).scalars():
+            del missing[sha1]
+    insert_missing(session, table,
+                   [{'sha1': sha1, 'data': zlib.compress(data)}
+                    for sha1, data in sorted(missing.items())],
+                   ('sha1',))
+    return len(missing)
+
+
+def _load(conn, sha1s):
+    """Return {sha1: document} of chunks."""
+    table = snapshot_chunk_table
+    documents = {}
+    for batch in _batches(sorted(set(sha1s))):
+        for sha1, data in conn.execute(select(table.c.sha1, table.c.data)
+                                       .where(table.c.sha1.in_(batch))):
+            documents[sha1] = json.loads(zlib.decompress(data))
+    return documents
+
+
+def snapshot(session, resolver, label=None):
+    """Record the current inventory; return (revision, created).
+
+    created is False when the inventory didn't change since the latest
+    snapshot, whose revision is returned.
+    """
+    conn = session.connection()
+    chunks = {}
+
+    def add(document):
+        sha1, data = _encode(document)
+        chunks[sha1] = data
+        return sha1
+
+    group_buckets = [[] for _ in range(BUCKETS)]
+    for group, hosts in export.membership_groups(conn):
+        group_buckets[_bucket(group)].append([group, add(list(hosts))])
+    # The hosts written to the JSON export's _meta.hostvars
+    hostvar_buckets = [[] for _ in range(BUCKETS)]
+    encoded = {}
+    previous = None
+    for _, host, host_vars in variables.iter_effective_vars(conn, resolver):
+        if not host_vars or host == previous:
+            continue
+        previous = host
+        key = id(host_vars)
+        if key not in encoded:
+            encoded[key] = add(host_vars)
+        hostvar_buckets[_bucket(host)].append([host, encoded[key]])
+    manifest = add({'groups': [add(bucket) for bucket in group_buckets],
+                    'hostvars': [add(bucket) for bucket in hostvar_buckets]})
+
+    latest = conn.execute(select(snapshot_table.c.revision,
+                                 snapshot_table.c.manifest)
+                          .order_by(snapshot_table.c.revision.desc())
+                          .limit(1)).first()
+    if latest is not None and latest.manifest == manifest:
+        return latest.revision, False
+
+    _store(session, chunks)
+    revision = session.execute(snapshot_table.insert().values(
+        timestamp=time.time(), label=label,
+        manifest=manifest)).inserted_primary_key[0]
+    return revision, True
+
+
+def snapshots(conn, before=None, limit=None):
+    """Return the (revision, timestamp, label) rows, newest first."""
+    table = snapshot_table
+    query = select(table.c.revision, table.c.timestamp, table.c.label)
+    if before is not None:
+        query = query.where(table.c.timestamp < before)
+    query = query.order_by(table.c.revision.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return conn.execute(query).all()
+
+
+def get_manifest(conn, revision):
+    """Return the manifest of revision, or None if there is no such one."""
+    sha1 = conn.execute(select(snapshot_table.c.manifest)
+                        .where(snapshot_table.c.revision == revision)).scalar()
+    if sha1 is None:
+        return None
+    return _load(conn, [sha1])[sha1]
+
+
+def _unbucket(conn, bucket_sha1s):
+    """Return {name: sha1} of group or hostvars buckets."""
+    sha1s = {}
+    for bucket in _load(conn, bucket_sha1s).values():
+        sha1s.update(bucket)
+    return sha1s
+
+
+def groups(conn, manifest):
+    """Return the (group, hosts) pairs of a manifest, in export order."""
+    group_sha1s = _unbucket(conn, manifest['groups'])
+    hosts = _load(conn, group_sha1s.values())
+    return [(group, hosts[group_sha1s[group]])
+            for group in sorted(group_sha1s)]
+
+
+def hostvars(conn, manifest):
+    """Return the (host, variables) pairs of a manifest, by host name.
+
+    Hosts with the same variables share one dict, like the bulk variables
+    of the live inventory.
+    """
+    host_sha1s = _unbucket(conn, manifest['hostvars'])
+    documents = _load(conn, host_sha1s.values())
+    return [(host, documents[host_sha1s[host]])
+            for host in sorted(host_sha1s)]
+
+
+def _changed(conn, old_buckets, new_buckets):
+    """Return the old and new {name: sha1} of the buckets that differ."""
+    buckets = [(old_sha1, new_sha1) for old_sha1, new_sha1
+               in zip(old_buckets, new_buckets) if old_sha1 != new_sha1]
+    return (_unbucket(conn, [sha1 for sha1, _ in buckets]),
+            _unbucket(conn, [sha1 for _, sha1 in buckets]))
+
+
+def diff(conn, old_revision, new_revision):
+    """Return the changes from old_revision to new_revision.
+
+    Only the chunks that differ are read.  Returns None if a revision
+    doesn't exist, else::
+
+        {'groups': {'added': [group, ...], 'removed': [group, ...],
+                    'changed': {group: {'added': [host, ...],
+                                        'removed': [host, ...]}}},
+         'hostvars': {'added': [host, ...], 'removed': [host, ...],
+                      'changed': [host, ...]}}
+    """
+    old = get_manifest(conn, old_revision)
+    new = get_manifest(conn, new_revision)
+    if old is None or new is None:
+        return None
+
+    old_groups, new_groups = _changed(conn, old['groups'], new['groups'])
+    changed = [group for group, sha1 in new_groups.items()
+               if group in old_groups and old_groups[group] != sha1]
+    documents = _load(conn, [old_groups[group] for group in changed] +
+                      [new_groups[group] for group in changed])
+    group_changes = {}
+    for group in sorted(changed):
+        before = set(documents[old_groups[group]])
+        after = set(documents[new_groups[group]])
+        group_changes[group] = {'added': sorted(after - before),
+                                'removed': sorted(before - after)}
+
+    old_vars, new_vars = _changed(conn, old['hostvars'], new['hostvars'])
+    return {
+        'groups': {'added': sorted(set(new_groups) - set(old_groups)),
+                   'removed': sorted(set(old_groups) - set(new_groups)),
+                   'changed': group_changes},
+        'hostvars': {'added': sorted(set(new_vars) - set(old_vars)),
+                     'removed': sorted(set(old_vars) - set(new_vars)),
+                     'changed': sorted(host for host, sha1 in new_vars.items()
+                                       if old_vars.get(host, sha1) != sha1)},
+    }
+
+
+def collect_garbage(session):
+    """Delete the chunks no snapshot references; return their number."""
+    conn = session.connection()
+    manifests = _load(conn, conn.execute(
+        select(snapshot_table.c.manifest)).scalars().all())
+    referenced = set(manifests)
+    bucket_sha1s = set()
+    for manifest in manifests.values():
+        bucket_sha1s.update(manifest['groups'])
+        bucket_sha1s.update(manifest['hostvars'])
+    referenced.update(bucket_sha1s)
+    referenced.update(_unbucket(conn, bucket_sha1s).values())
+
+    table = snapshot_chunk_table
+    garbage = [sha1 for sha1 in conn.execute(select(table.c.sha1)).scalars()
+               if sha1 not in referenced]
+    for batch in _batches(garbage):
+        session.execute(table.delete().where(table.c.sha1.in_(batch)))
+    return len(garbage)
+
+
+def prune(session, keep=None, before=None):
+    """Delete old snapshots, then their garbage chunks.
+
+    Deletes the snapshots taken before the timestamp before (any time if
+    None) except the newest keep ones (none if None).  Returns the numbers
+    of snapshots and chunks deleted.
+    """
+    table = snapshot_table
+    if keep is None and before is None:
+        return 0, 0
+    statement = table.delete()
+    if keep:
+        newest = session.execute(select(table.c.revision)
+                                 .order_by(table.c.revision.desc())
+                                 .offset(keep - 1).limit(1)).scalar()
+        if newest is None:
+            return 0, 0
+        statement = statement.where(table.c.revision < newest)
+    if before is not None:
+        statement = statement.where(table.c.timestamp < before)
+    deleted = session.execute(statement).rowcount
+    if not deleted:
+        return 0, 0
+    return deleted, collect_garbage(session)
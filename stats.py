@@ -0,0 +1,152 @@
+"""Inventory statistics and capacity metrics for dashboards.
+
+compute() answers the usual dashboard questions, hosts per company, office
+and group, empty groups and hosts in no group, with five aggregate queries
+(GROUP BY and an anti-join) instead of walking the ORM relationships.  The
+result is a dict of JSON compatible values::
+
+    {'totals': {'companies': 2, 'offices': 3, 'groups': 4, 'hosts': 5,
+                'memberships': 6, 'empty_groups': 1, 'ungrouped_hosts': 1},
+     'capacity': {'max_hosts_per_group': 2, 'mean_hosts_per_group': 1.5,
+                  'max_hosts_per_office': 3, 'mean_groups_per_host': 1.2},
+     'companies': [{'company': 'Acme', 'offices': 2, 'groups': 3,
+                    'hosts': 4}, ...],
+     'offices': [{'company': 'Acme', 'office': 'Austin', 'groups': 2,
+                  'hosts': 3}, ...],
+     'groups': [{'company': 'Acme', 'office': 'Austin', 'group': 'IT',
+                 'hosts': 2}, ...],
+     'empty_groups': ['Acme_Austin_Dev', ...],
+     'ungrouped_hosts': [{'company': 'Acme', 'office': 'Austin',
+                          'host': 'wile'}, ...]}
+
+Manager.stats() caches it per data revision (see TABLES).
+"""
+
+import logging
+
+from sqlalchemy import exists, func, select
+
+from inventory import (association_table,
+                       Company,
+                       Group,
+                       Host,
+                       Office,
+                       )
+
+LOG = logging.getLogger('Manager')
+
+# Tables the statistics are computed from (Manager.table_revisions keys)
+TABLES = ('company', 'office', 'group', 'host', 'association')
+
+
+def _mean(total, count):
+    return round(float(total) / count, 3) if count else 0.0
+
+
+def capacity(totals, offices, groups):
+    """Return the capacity metrics of the totals, offices and groups."""
+    return {
+        'max_hosts_per_group': max([group['hosts'] for group in groups] or
+                                   [0]),
+        'mean_hosts_per_group': _mean(sum(group['hosts'] for group in groups),
+                                      len(groups)),
+        'max_hosts_per_office': max([office['hosts'] for office in offices]
+                                    or [0]),
+        'mean_groups_per_host': _mean(totals['memberships'],
+                                      totals['hosts']),
+    }
+
+
+def compute(conn):
+    """Return the statistics of the inventory, see the module docstring."""
+    companies = dict(conn.execute(select(Company.id, Company.name)).all())
+    offices = {}
+    for office_id, company_id, name, hosts in conn.execute(
+            select(Office.id, Office.company_id, Office.name,
+                   func.count(Host.id))
+            .outerjoin(Host, Host.office_id == Office.id)
+            .group_by(Office.id)):
+        offices[office_id] = {'company': companies.get(company_id),
+                              'office': name, 'groups': 0, 'hosts': hosts}
+
+    groups = []
+    for office_id, name, hosts in conn.execute(
+            select(Group.office_id, Group.name,
+                   func.count(association_table.c.host_id.distinct()))
+            .outerjoin(association_table,
+                       association_table.c.group_id == Group.id)
+            .group_by(Group.id)):
+        office = offices.get(office_id)
+        if office is None:
+            continue
+        office['groups'] += 1
+        groups.append({'company': office['company'],
+                       'office': office['office'], 'group': name,
+                       'hosts': hosts})
+    groups.sort(key=lambda group: (group['company'], group['office'],
+                                   group['group']))
+
+    ungrouped = []
+    for office_id, name in conn.execute(
+            select(Host.office_id, Host.name)
+            .where(~exists().where(association_table.c.host_id == Host.id))):
+        office = offices.get(office_id, {})
+        ungrouped.append({'company': office.get('company'),
+                          'office': office.get('office'), 'host': name})
+    ungrouped.sort(key=lambda host: (host['company'] or '',
+                                     host['office'] or '', host['host']))
+
+    memberships = conn.execute(
+        select(func.count()).select_from(association_table)).scalar()
+
+    by_company = dict((name, {'company': name, 'offices': 0, 'groups': 0,
+                              'hosts': 0})
+                      for name in companies.values())
+    for office in offices.values():
+        company = by_company.get(office['company'])
+        if company is not None:
+            company['offices'] += 1
+            company['groups'] += office['groups']
+            company['hosts'] += office['hosts']
+
+    office_list = sorted(offices.values(),
+                         key=lambda office: (office['company'] or '',
+                                             office['office']))
+    empty = ['{company}_{office}_{group}'.format(**group)
+             for group in groups if not group['hosts']]
+    totals = {
+        'companies': len(companies),
+        'offices': len(offices),
+        'groups': len(groups),
+        'hosts': sum(office['hosts'] for office in offices.values()),
+        'memberships': memberships,
+        'empty_groups': len(empty),
+        'ungrouped_hosts': len(ungrouped),
+    }
+    return {
+        'totals': totals,
+        'capacity': capacity(totals, office_list, groups),
+        'companies': [by_company[name] for name in sorted(by_company)],
+        'offices': office_list,
+        'groups': groups,
+        'empty_groups': empty,
+        'ungrouped_hosts': ungrouped,
+    }
+
+
+def merge(all_stats):
+    """Merge the statistics of disjoint inventories (e.g. shards).
+
+    The lists are concatenated: pass the inventories in company order.
+    """
+    merged = {'totals': {}, 'companies': [], 'offices': [], 'groups': [],
+              'empty_groups': [], 'ungrouped_hosts': []}
+    for stats in all_stats:
+        for key, value in stats['totals'].items():
+            merged['totals'][key] = merged['totals'].get(key, 0) + value
+        for key in ('companies', 'offices', 'groups', 'empty_groups',
+                    'ungrouped_hosts'):
+            merged[key].extend(stats[key])
+    merged['capacity'] = capacity(merged['totals'], merged['offices'],
+                                  merged['groups'])
+    return merged
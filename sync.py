@@ -0,0 +1,291 @@
+"""Declarative desired-state sync of a company/office/group/host spec.
+
+A spec is a nested mapping, usually kept as YAML or JSON in git::
+
+    Acme:
+      Austin:
+        IT: [roadrunner, coyote]
+        Dev: [roadrunner]
+    RedHat:
+      Dallas:
+        Ops: [bugs]
+
+plan_sync() reads the current state of the companies named in the spec with
+one set-based query per table and diffs it against the spec.  apply_sync()
+then applies only the needed inserts and deletes, with bulk statements, in a
+single transaction.
+
+Pruning (deleting what the spec does not mention) is scoped to the companies
+named in the spec; other companies are never touched.
+"""
+
+import json
+import logging
+
+from sqlalchemy import and_, bindparam, select
+
+import variables
+from chunks import chunks
+from facts import forget_hosts
+from inventory import (association_table,
+                       Company,
+                       Office,
+                       Group,
+                       Host,
+                       )
+
+LOG = logging.getLogger('Manager')
+
+
+def load_spec(path):
+    """Load a spec from a YAML (.yml/.yaml) or JSON file."""
+    with open(path) as spec_file:
+        if path.endswith(('.yml', '.yaml')):
+            import yaml
+            return yaml.safe_load(spec_file) or {}
+        return json.load(spec_file)
+
+
+class SyncPlan(object):
+    """Differences between a spec and the database, as sets of name tuples.
+
+    * companies: (company,)
+    * offices: (company, office)
+    * groups: (company, office, group)
+    * hosts: (company, office, host)
+    * memberships: (company, office, group, host)
+    """
+
+    KINDS = ('companies', 'offices', 'groups', 'hosts', 'memberships')
+
+    def __init__(self, prune=False):
+        self.prune = prune
+        self.add = dict((kind, set()) for kind in self.KINDS)
+        self.delete = dict((kind, set()) for kind in self.KINDS)
+        # name tuple -> id of the rows that already exist
+        self._ids = dict((kind, {}) for kind in self.KINDS[:-1])
+        self._memberships = {}
+
+    def __bool__(self):
+        return any(self.add.values()) or any(self.delete.values())
+
+    __nonzero__ = __bool__
+
+    def summary(self):
+        """Return {'add': {kind: count}, 'delete': {kind: count}}."""
+        return {'add': dict((k, len(v)) for k, v in self.add.items()),
+                'delete': dict((k, len(v)) for k, v in self.delete.items())}
+
+    def as_dict(self):
+        """Return the plan as sorted lists, e.g. for a JSON dry run."""
+        return {'add': dict((k, sorted(v)) for k, v in self.add.items()),
+                'delete': dict((k, sorted(v))
+                               for k, v in self.delete.items())}
+
+    def host_ids(self):
+        """Return the ids of the hosts added, deleted or regrouped.
+
+        Only complete after apply_sync(), which learns the new host ids.
+        """
+        names = set(self.add['hosts']) | set(self.delete['hosts'])
+        for memberships in (self.add['memberships'],
+                            self.delete['memberships']):
+            names.update(name[:2] + name[3:] for name in memberships)
+        hosts = self._ids['hosts']
+        return [hosts[name] for name in names if name in hosts]
+
+    def __repr__(self):
+        return '<SyncPlan {}>'.format(self.summary())
+
+
+def _desired(spec):
+    desired = dict((kind, set()) for kind in SyncPlan.KINDS)
+    for company, offices in spec.items():
+        desired['companies'].add((company,))
+        for office, groups in (offices or {}).items():
+            desired['offices'].add((company, office))
+            for group, hosts in (groups or {}).items():
+                desired['groups'].add((company, office, group))
+                for host in hosts or ():
+                    desired['hosts'].add((company, office, host))
+                    desired['memberships'].add((company, office, group, host))
+    return desired
+
+
+def _select(kind, company_names):
+    """Return a select of (id, *names) rows for kind, or (group_id, host_id)
+    rows for memberships, restricted to company_names."""
+    if kind == 'companies':
+        query = select(Company.id, Company.name)
+    elif kind == 'offices':
+        query = (select(Office.id, Company.name, Office.name)
+                 .join(Company, Office.company_id == Company.id))
+    elif kind == 'groups':
+        query = (select(Group.id, Company.name, Office.name, Group.name)
+                 .join(Office, Group.office_id == Office.id)
+                 .join(Company, Office.company_id == Company.id))
+    elif kind == 'hosts':
+        query = (select(Host.id, Company.name, Office.name, Host.name)
+                 .join(Office, Host.office_id == Office.id)
+                 .join(Company, Office.company_id == Company.id))
+    else:
+        query = (select(association_table.c.group_id,
+                        association_table.c.host_id)
+                 .join(Group, association_table.c.group_id == Group.id)
+                 .join(Office, Group.office_id == Office.id)
+                 .join(Company, Office.company_id == Company.id))
+    return query.where(Company.name.in_(company_names))
+
+
+def _rows(session, kind, company_names):
+    # Plain Core rows: no ORM entity processing for the bulk reads
+    conn = session.connection()
+    for chunk in chunks(company_names):
+        for row in conn.execute(_select(kind, chunk)):
+            yield row
+
+
+def _load_ids(session, kind, company_names):
+    """Return {name tuple: id} of the existing rows of kind."""
+    return dict((tuple(row[1:]), row[0])
+                for row in _rows(session, kind, company_names))
+
+
+def _load_memberships(session, company_names, ids):
+    """Return {(company, office, group, host): (group_id, host_id)}.
+
+    Memberships are read as id pairs and named through the group and host
+    ids already loaded; a host linked to a group of another office is not
+    a membership the spec can express and is left to check_integrity().
+    """
+    group_names = dict((id, name) for name, id in ids['groups'].items())
+    host_names = dict((id, name) for name, id in ids['hosts'].items())
+    memberships = {}
+    for group_id, host_id in _rows(session, 'memberships', company_names):
+        group = group_names.get(group_id)
+        host = host_names.get(host_id)
+        if group is None or host is None or group[:2] != host[:2]:
+            continue
+        memberships[group + host[2:]] = (group_id, host_id)
+    return memberships
+
+
+def plan_sync(session, spec, prune=False):
+    """Diff spec against the database and return a SyncPlan."""
+    desired = _desired(spec)
+    company_names = [name for name, in desired['companies']]
+    plan = SyncPlan(prune=prune)
+    current = {}
+    for kind in SyncPlan.KINDS[:-1]:
+        plan._ids[kind] = _load_ids(session, kind, company_names)
+        current[kind] = set(plan._ids[kind])
+    plan._memberships = _load_memberships(session, company_names, plan._ids)
+    current['memberships'] = set(plan._memberships)
+
+    for kind in SyncPlan.KINDS:
+        plan.add[kind] = desired[kind] - current[kind]
+        if prune:
+            plan.delete[kind] = current[kind] - desired[kind]
+    return plan
+
+
+def _insert(session, table, rows):
+    if rows:
+        session.execute(table.insert(), rows)
+
+
+def _delete_ids(session, table, column, ids):
+    for chunk in chunks(ids):
+        session.execute(table.delete().where(column.in_(chunk)))
+
+
+def apply_sync(session, plan):
+    """Apply plan in the session's transaction, without committing.
+
+    Returns the names of the tables that were modified.
+    """
+    ids = plan._ids
+    add, delete = plan.add, plan.delete
+    changed = set()
+
+    def refresh_ids(kind):
+        # New rows need their ids before their children can be inserted
+        names = set(name[0] for name in add[kind])
+        ids[kind].update(_load_ids(session, kind, names))
+
+    # Deletes, children first -------------------------------------------------
+    if delete['memberships']:
+        session.execute(
+            association_table.delete().where(and_(
+                association_table.c.group_id == bindparam('g_id'),
+                association_table.c.host_id == bindparam('h_id'))),
+            [{'g_id': plan._memberships[name][0],
+              'h_id': plan._memberships[name][1]}
+             for name in delete['memberships']])
+        changed.add('association')
+
+    for kind, model, column in (
+            ('hosts', Host, association_table.c.host_id),
+            ('groups', Group, association_table.c.group_id)):
+        if delete[kind]:
+            doomed = [ids[kind][name] for name in delete[kind]]
+            for chunk in chunks(doomed):
+                if kind == 'hosts':
+                    forget_hosts(session, chunk)
+                else:
+                    variables.forget(session, 'group', chunk)
+            changed.add('host_var' if kind == 'hosts' else 'group_var')
+            _delete_ids(session, association_table, column, doomed)
+            _delete_ids(session, model.__table__, model.id, doomed)
+            changed.update((model.__tablename__, 'association'))
+
+    for kind, model in (('offices', Office), ('companies', Company)):
+        if delete[kind]:
+            doomed = [ids[kind][name] for name in delete[kind]]
+            for chunk in chunks(doomed):
+                variables.forget(session, model.__tablename__, chunk)
+            _delete_ids(session, model.__table__, model.id, doomed)
+            changed.update((model.__tablename__,
+                            model.__tablename__ + '_var'))
+
+    # Inserts, parents first --------------------------------------------------
+    if add['companies']:
+        _insert(session, Company.__table__,
+                [{'name': name} for name, in add['companies']])
+        refresh_ids('companies')
+        changed.add('company')
+
+    if add['offices']:
+        _insert(session, Office.__table__,
+                [{'name': office,
+                  'company_id': ids['companies'][(company,)]}
+                 for company, office in add['offices']])
+        refresh_ids('offices')
+        changed.add('office')
+
+    if add['groups']:
+        _insert(session, Group.__table__,
+                [{'name': group,
+                  'company_id': ids['companies'][(company,)],
+                  'office_id': ids['offices'][(company, office)]}
+                 for company, office, group in add['groups']])
+        refresh_ids('groups')
+        changed.add('group')
+
+    if add['hosts']:
+        _insert(session, Host.__table__,
+                [{'name': host,
+                  'company_id': ids['companies'][(company,)],
+                  'office_id': ids['offices'][(company, office)]}
+                 for company, office, host in add['hosts']])
+        refresh_ids('hosts')
+        changed.add('host')
+
+    if add['memberships']:
+        _insert(session, association_table,
+                [{'group_id': ids['groups'][(company, office, group)],
+                  'host_id': ids['hosts'][(company, office, host)]}
+                 for company, office, group, host in add['memberships']])
+        changed.add('association')
+
+    return changed
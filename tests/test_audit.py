@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from audit import AuditLog, JsonlSink, TableSink
+from inventory import audit_log_table
+from Manager import Manager
+from sqlalchemy import create_engine, select
+
+LOG = logging.getLogger('Manager')
+
+
+class SlowSink(object):
+    """Sink that blocks until released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.records = []
+
+    def write(self, records):
+        self.release.wait()
+        self.records.extend(records)
+
+
+class TestAudit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def populate(self, manager):
+        manager.add_company(company_name='Acme')
+        manager.add_company(company_name='Acme')      # fails: not audited
+        manager.add_office(office_name='Austin', company_name='Acme')
+        manager.add_group(group_name='IT', company_name='Acme',
+                          office_name='Austin')
+        manager.add_host(hostname='bugs', company_name='Acme',
+                         office_name='Austin', group_names=['IT'])
+        manager.del_host(hostname='bugs', company_name='Acme',
+                         office_name='Austin')
+        manager.sync({'Acme': {'Austin': {'IT': ['coyote']}}})
+
+    def test_jsonl(self):
+        path = os.path.join(self.tmpdir, 'audit.jsonl')
+        manager = Manager(create_engine('sqlite://'),
+                          audit=AuditLog(JsonlSink(path)), actor='tester')
+        self.populate(manager)
+        manager.close()
+
+        with open(path) as audit_file:
+            records = [json.loads(line) for line in audit_file]
+        self.assertEqual([record['method'] for record in records],
+                         ['add_company', 'add_office', 'add_group',
+                          'add_host', 'del_host', 'sync'])
+        self.assertTrue(all(record['actor'] == 'tester'
+                            for record in records))
+        add_host, del_host, sync = records[3:]
+        self.assertEqual(add_host['arguments']['group_names'], ['IT'])
+        self.assertIsNone(add_host['before'])
+        self.assertEqual(add_host['after'], ['Acme', 'Austin', 'bugs'])
+        self.assertEqual(del_host['before'], ['Acme', 'Austin', 'bugs'])
+        self.assertIsNone(del_host['after'])
+        self.assertEqual(sync['arguments'], {'prune': False})
+        self.assertEqual(sync['after']['add']['hosts'], 1)
+
+    def test_batch(self):
+        path = os.path.join(self.tmpdir, 'audit.jsonl')
+        manager = Manager(create_engine('sqlite://'),
+                          audit=AuditLog(JsonlSink(path)))
+        with self.assertRaises(RuntimeError):
+            with manager.batch():
+                manager.add_company(company_name='Acme')
+                raise RuntimeError()
+        with manager.batch():
+            manager.add_company(company_name='RedHat')
+            manager.audit.flush()
+            self.assertFalse(os.path.exists(path))
+        manager.close()
+
+        with open(path) as audit_file:
+            records = [json.loads(line) for line in audit_file]
+        # Only the committed batch
+        self.assertEqual([record['arguments'] for record in records],
+                         [{'company_name': 'RedHat'}])
+
+    def test_shared(self):
+        path = os.path.join(self.tmpdir, 'audit.jsonl')
+        engine = create_engine(
+            'sqlite:///' + os.path.join(self.tmpdir, 'inventory.db'))
+        self.addCleanup(engine.dispose)
+        audit = AuditLog(JsonlSink(path))
+        # Closing a Manager leaves the log to the next one
+        for company_name in ('Acme', 'RedHat'):
+            with Manager(engine, audit=audit) as manager:
+                manager.add_company(company_name=company_name)
+        audit.close()
+        with open(path) as audit_file:
+            self.assertEqual([json.loads(line)['arguments']['company_name']
+                              for line in audit_file], ['Acme', 'RedHat'])
+
+        with Manager(engine, audit=audit) as manager:
+            with self.assertRaises(RuntimeError):
+                manager.add_company(company_name='Warner')
+
+    def test_table(self):
+        engine = create_engine(
+            'sqlite:///' + os.path.join(self.tmpdir, 'inventory.db'))
+        with Manager(engine, audit=AuditLog(TableSink(engine))) as manager:
+            self.populate(manager)
+        with engine.connect() as conn:
+            rows = conn.execute(select(audit_log_table.c.method,
+                                       audit_log_table.c.after)
+                                .order_by(audit_log_table.c.id)).all()
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0], ('add_company', '["Acme"]'))
+        engine.dispose()
+
+    def test_backpressure(self):
+        sink = SlowSink()
+        audit = AuditLog(sink, max_queue=2, batch_size=1, block=False)
+        audit.record('add_company', {'company_name': 'first'})
+        while audit._queue.qsize():
+            time.sleep(0.01)
+        for number in range(9):
+            audit.record('add_company', {'company_name': str(number)})
+        # One record in the writer, two queued, the rest dropped
+        self.assertEqual(audit.dropped, 7)
+
+        sink.release.set()
+        audit.close()
+        self.assertEqual(len(sink.records), 3)
+        self.assertEqual(audit.written, 3)
@@ -0,0 +1,199 @@
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import cli
+import export
+from Manager import Manager
+from sqlalchemy import create_engine
+
+LOG = logging.getLogger('Manager')
+
+
+def operation(op, **arguments):
+    return json.dumps(dict(arguments, op=op))
+
+
+SETUP = [
+    operation('add_company', company_name='Acme'),
+    operation('add_office', office_name='Austin', company_name='Acme'),
+    operation('add_group', group_name='IT', company_name='Acme',
+              office_name='Austin'),
+]
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.url = 'sqlite:///' + os.path.join(self.tmpdir, 'inventory.db')
+
+    def run_cli(self, *argv):
+        out = io.StringIO()
+        status = cli.main(['--db', self.url] + list(argv), out=out)
+        return status, out.getvalue()
+
+    def batch(self, lines, *options):
+        path = os.path.join(self.tmpdir, 'batch.ndjson')
+        with open(path, 'w') as batch_file:
+            batch_file.write('\n'.join(lines) + '\n')
+        status, output = self.run_cli('batch', path, *options)
+        return status, [json.loads(line) for line in output.splitlines()]
+
+    def hosts(self):
+        manager = Manager(create_engine(self.url))
+        try:
+            return [row.host for row in manager.iter_hosts()]
+        finally:
+            manager.close()
+
+    def test_commands(self):
+        self.assertEqual(self.run_cli('add-company', 'Acme')[0], 0)
+        self.run_cli('add-office', 'Austin', '-c', 'Acme')
+        self.run_cli('add-group', 'IT', '-c', 'Acme', '-o', 'Austin')
+        status, output = self.run_cli('add-host', 'coyote', '-c', 'Acme',
+                                      '-o', 'Austin', '-G', 'IT')
+        self.assertEqual(status, 0)
+        self.assertEqual(json.loads(output)['result']['name'], 'coyote')
+
+        status, output = self.run_cli('hosts', '-c', 'Acme')
+        self.assertEqual(json.loads(output)['result'],
+                         [{'company': 'Acme', 'office': 'Austin',
+                           'host': 'coyote'}])
+        status, output = self.run_cli('export', '--format', 'ini')
+        self.assertEqual(output, '[Acme_Austin_IT]\ncoyote\n')
+        self.assertEqual(self.run_cli('export', '--at-revision', '99')[0],
+                         1)
+        status, output = self.run_cli('stats')
+        self.assertEqual(json.loads(output)['result']['groups'],
+                         [{'company': 'Acme', 'office': 'Austin',
+                           'group': 'IT', 'hosts': 1}])
+
+        self.run_cli('set-vars', '--values', '{"ntp": "pool.ntp.org"}',
+                     '-c', 'Acme')
+        self.run_cli('set-vars', '--values', '{"ntp": "10.0.0.1"}',
+                     '-c', 'Acme', '-o', 'Austin', '-g', 'IT')
+        status, output = self.run_cli('effective-vars', 'coyote',
+                                      '-c', 'Acme', '-o', 'Austin')
+        self.assertEqual(json.loads(output)['result'], {'ntp': '10.0.0.1'})
+
+        status, output = self.run_cli('del-host', 'roadrunner', '-c', 'Acme',
+                                      '-o', 'Austin')
+        self.assertEqual(status, 1)
+        self.assertEqual(json.loads(output),
+                         {'ok': False,
+                          'errors': ['Host doesnt exists: roadrunner']})
+
+    def test_search_hosts(self):
+        self.batch(SETUP + [operation('add_host', hostname='host{:02}'.format(
+            number), company_name='Acme', office_name='Austin',
+            group_names=['IT']) for number in range(25)])
+        status, output = self.run_cli('search-hosts', 'host')
+        self.assertEqual(status, 0)
+        # Manager.search_hosts' default limit
+        self.assertEqual(len(json.loads(output)['result']), 20)
+        status, output = self.run_cli('search-hosts', 'host*', '--limit', '2')
+        self.assertEqual([result['host'] for result in
+                          json.loads(output)['result']], ['host00', 'host01'])
+
+    def test_after(self):
+        self.batch(SETUP + [operation('add_office', office_name='Boston',
+                                      company_name='Acme')])
+        status, output = self.run_cli('offices', '--after', 'Acme')
+        self.assertEqual((status, json.loads(output)['result']), (0, []))
+        status, output = self.run_cli('offices', '--after', 'Acme',
+                                      'Austin')
+        self.assertEqual([row['office'] for row in
+                          json.loads(output)['result']], ['Boston'])
+        status, output = self.run_cli('offices', '--after', 'Acme',
+                                      'Austin', 'IT')
+        self.assertNotEqual(status, 0)
+        self.assertIn('ValueError', output)
+
+    @unittest.skipIf(export.msgpack is None, "msgpack is not installed")
+    def test_export_msgpack(self):
+        self.batch(SETUP + [operation('add_host', hostname='coyote',
+                                      company_name='Acme',
+                                      office_name='Austin',
+                                      group_names=['IT'])])
+        path = os.path.join(self.tmpdir, 'inventory.msgpack')
+        self.assertEqual(self.run_cli('export', '--format', 'msgpack',
+                                      '--output', path)[0], 0)
+        with open(path, 'rb') as msgpack_file:
+            data = msgpack_file.read()
+        self.assertEqual(list(export.msgpack.Unpacker(io.BytesIO(data),
+                                                      raw=False)),
+                         [['Acme_Austin_IT', ['coyote']]])
+
+        # Without --output the bytes go to stdout's buffer
+        stdout = io.TextIOWrapper(io.BytesIO())
+        self.assertEqual(cli.main(['--db', self.url, 'export', '--format',
+                                   'msgpack'], out=stdout), 0)
+        self.assertEqual(stdout.buffer.getvalue(), data)
+
+    def test_batch(self):
+        status, results = self.batch(SETUP + [
+            operation('ensure_host', hostname='coyote', company_name='Acme',
+                      office_name='Austin', group_names=['IT']),
+            operation('add_company', company_name='Acme'),
+            'not json',
+            operation('ensure_host', hostname='roadrunner',
+                      company_name='Acme', office_name='Austin'),
+            operation('iter_hosts', company_name='Acme'),
+        ])
+        self.assertEqual(status, 1)
+        self.assertEqual([result['ok'] for result in results],
+                         [True] * 4 + [False, False] + [True] * 2)
+        self.assertEqual(results[4]['errors'], ['Company exists: Acme'])
+        self.assertEqual(results[-1]['line'], 8)
+        self.assertEqual([row['host'] for row in results[-1]['result']],
+                         ['coyote', 'roadrunner'])
+        # The failed lines didn't undo the others
+        self.assertEqual(self.hosts(), ['coyote', 'roadrunner'])
+
+    def test_atomic_batch(self):
+        status, results = self.batch(SETUP + [
+            operation('ensure_host', hostname='coyote', company_name='Acme',
+                      office_name='Austin'),
+            operation('del_group', group_name='Dev', company_name='Acme',
+                      office_name='Austin'),
+            operation('ensure_host', hostname='roadrunner',
+                      company_name='Acme', office_name='Austin'),
+        ], '--atomic')
+        self.assertEqual(status, 1)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(self.hosts(), [])
+        self.assertEqual(self.run_cli('companies')[1].count('Acme'), 0)
+
+
+class TestManagerBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        engine = create_engine(
+            'sqlite:///' + os.path.join(self.tmpdir, 'inventory.db'))
+        self.manager = Manager(engine)
+        self.addCleanup(self.manager.close)
+
+    def test_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with self.manager.batch():
+                self.manager.ensure_company(company_name='Acme')
+                with self.manager.batch():
+                    self.manager.ensure_company(company_name='RedHat')
+                raise RuntimeError()
+        self.assertEqual(list(self.manager.iter_companies()), [])
+
+    def test_commit(self):
+        with self.manager.batch():
+            self.manager.ensure_company(company_name='Acme')
+            self.assertIsNone(self.manager.add_company(company_name='Acme'))
+            self.manager.ensure_company(company_name='RedHat')
+        self.assertEqual([row.company for row in
+                          self.manager.iter_companies()],
+                         ['Acme', 'RedHat'])
@@ -0,0 +1,75 @@
+import configparser
+import io
+import json
+import logging
+import unittest
+import export
+import yaml
+from Manager import Manager
+from sqlalchemy import create_engine
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['roadrunner', 'coyote'],
+                   'Dev': ['roadrunner']},
+    },
+    'RedHat': {
+        'Dallas': {'Ops': ['bugs', 'yes', '1.2.3.4']},
+    },
+}
+
+EXPECTED = {'Acme_Austin_Dev': ['roadrunner'],
+            'Acme_Austin_IT': ['coyote', 'roadrunner'],
+            'RedHat_Dallas_Ops': ['1.2.3.4', 'bugs', 'yes']}
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+        self.manager.sync(SPEC)
+
+    def test_json(self):
+        document = json.loads(self.manager.export('json'))
+        self.assertEqual(document.pop('_meta'), {'hostvars': {}})
+        self.assertEqual(dict((group, value['hosts'])
+                              for group, value in document.items()),
+                         EXPECTED)
+
+    def test_ini(self):
+        parser = configparser.ConfigParser(allow_no_value=True,
+                                           delimiters=('=',))
+        parser.optionxform = str
+        parser.read_string(self.manager.export('ini'))
+        self.assertEqual(dict((group, sorted(parser.options(group)))
+                              for group in parser.sections()),
+                         EXPECTED)
+
+    def test_yaml(self):
+        document = yaml.safe_load(self.manager.export('yaml'))
+        children = document['all']['children']
+        self.assertEqual(dict((group, sorted(value['hosts']))
+                              for group, value in children.items()),
+                         EXPECTED)
+
+    @unittest.skipIf(export.msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        unpacker = export.msgpack.Unpacker(
+            io.BytesIO(self.manager.export('msgpack')), raw=False)
+        self.assertEqual(dict((group, hosts) for group, hosts in unpacker),
+                         EXPECTED)
+
+    def test_empty_and_streaming(self):
+        manager = Manager(create_engine('sqlite://'))
+        self.assertEqual(yaml.safe_load(manager.export('yaml')),
+                         {'all': {'children': {}}})
+        self.assertEqual(json.loads(manager.export('json')),
+                         {'_meta': {'hostvars': {}}})
+
+        out = io.StringIO()
+        self.assertIsNone(self.manager.export('ini', out=out))
+        self.assertTrue(out.getvalue().startswith('[Acme_Austin_Dev]\n'))
+        self.assertIsNone(self.manager.export('toml'))
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import facts
+from audit import AuditLog, JsonlSink
+from Manager import Manager
+from inventory import HostVar
+from sqlalchemy import create_engine, func, select
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['roadrunner', 'coyote']},
+        'Houston': {'Ops': ['roadrunner']},
+    },
+}
+
+
+def fact_document(distribution, memory):
+    return {'ansible_distribution': distribution,
+            'ansible_memtotal_mb': memory,
+            'ansible_default_ipv4': {'address': '10.0.0.1'},
+            'ansible_mounts': [{'mount': '/'}]}
+
+
+class TestFacts(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+        self.manager.sync(SPEC)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, document, mtime=None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as fact_file:
+            if isinstance(document, str):
+                fact_file.write(document)
+            else:
+                json.dump(document, fact_file)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def variables(self, hostname, office_name='Austin'):
+        return self.manager.get_host_vars(hostname, company_name='Acme',
+                                          office_name=office_name)
+
+    def test_ingest(self):
+        self.write('roadrunner', fact_document('Debian', 2048))
+        self.write('coyote', fact_document('RedHat', 4096))
+        self.write('unknown', fact_document('Debian', 1024))
+        self.write('broken', '{"ansible_distribution": ')
+
+        report = self.manager.ingest_facts(self.directory, batch_size=2)
+        self.assertEqual((report.files, report.ingested, report.unknown,
+                          report.errors), (4, 2, 1, 1))
+        # roadrunner is in two offices, both get the facts
+        self.assertEqual(report.variables, 9)
+        self.assertGreater(report.files_per_second, 0)
+
+        expected = {'ansible_distribution': 'Debian',
+                    'ansible_memtotal_mb': 2048,
+                    'ansible_default_ipv4': {'address': '10.0.0.1'}}
+        self.assertEqual(self.variables('roadrunner'), expected)
+        self.assertEqual(self.variables('roadrunner', 'Houston'), expected)
+        self.assertEqual(self.variables('coyote')['ansible_distribution'],
+                         'RedHat')
+
+    def test_skip_unchanged(self):
+        self.write('roadrunner', fact_document('Debian', 2048), mtime=1000)
+        self.write('coyote', fact_document('RedHat', 4096), mtime=1000)
+        self.manager.ingest_facts(self.directory)
+
+        report = self.manager.ingest_facts(self.directory)
+        self.assertEqual((report.skipped, report.unchanged, report.ingested),
+                         (2, 0, 0))
+
+        # Touched but identical: hashed, not parsed
+        self.write('coyote', fact_document('RedHat', 4096), mtime=2000)
+        # Changed: the fact gone from the file is deleted
+        document = fact_document('Debian', 8192)
+        del document['ansible_default_ipv4']
+        self.write('roadrunner', document, mtime=2000)
+        report = self.manager.ingest_facts(self.directory)
+        self.assertEqual((report.skipped, report.unchanged, report.ingested),
+                         (0, 1, 1))
+        self.assertEqual(self.variables('roadrunner'),
+                         {'ansible_distribution': 'Debian',
+                          'ansible_memtotal_mb': 8192})
+
+    def test_audited(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'audit.jsonl')
+        audit = AuditLog(JsonlSink(path))
+        self.addCleanup(audit.close)
+        manager = Manager(self.engine, audit=audit, actor='facts')
+        self.write('roadrunner', fact_document('Debian', 2048), mtime=1000)
+        self.write('coyote', fact_document('RedHat', 4096), mtime=1000)
+        # Several batches, one record
+        manager.ingest_facts(self.directory, batch_size=1)
+        # Nothing changed: not audited
+        manager.ingest_facts(self.directory)
+        manager.close()
+
+        with open(path) as audit_file:
+            records = [json.loads(line) for line in audit_file]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['method'], 'ingest_facts')
+        self.assertEqual(records[0]['arguments'],
+                         {'directory': self.directory, 'prefix': ''})
+        self.assertEqual(records[0]['after'],
+                         {'files': 2, 'skipped': 0, 'unchanged': 0,
+                          'ingested': 2, 'unknown': 0, 'errors': 0,
+                          'variables': 9})
+
+    def test_unknown_retried(self):
+        self.write('bugs', fact_document('Debian', 2048), mtime=1000)
+        self.assertEqual(self.manager.ingest_facts(self.directory).unknown, 1)
+        self.manager.ensure_host(hostname='bugs', company_name='Acme',
+                                 office_name='Austin')
+        report = self.manager.ingest_facts(self.directory)
+        self.assertEqual(report.ingested, 1)
+        self.assertEqual(self.variables('bugs')['ansible_memtotal_mb'], 2048)
+
+    def test_del_host_forgets_facts(self):
+        self.write('coyote', fact_document('RedHat', 4096))
+        self.manager.ingest_facts(self.directory)
+        self.manager.del_host(hostname='coyote', company_name='Acme',
+                              office_name='Austin')
+        count = select(func.count()).select_from(HostVar)
+        self.assertEqual(self.manager.session.execute(count).scalar(), 0)
+
+        # Added again: the unchanged file is ingested again
+        self.manager.ensure_host(hostname='coyote', company_name='Acme',
+                                 office_name='Austin')
+        self.assertEqual(self.manager.ingest_facts(self.directory).ingested,
+                         1)
+
+    def test_keys_and_prefix(self):
+        self.write('facts_coyote', fact_document('RedHat', 4096))
+        self.write('coyote', fact_document('Debian', 1024))
+        report = self.manager.ingest_facts(self.directory, prefix='facts_',
+                                           keys=['ansible_mounts'])
+        self.assertEqual(report.files, 1)
+        self.assertEqual(self.variables('coyote'),
+                         {'ansible_mounts': [{'mount': '/'}]})
+
+    def test_processes(self):
+        self.write('coyote', fact_document('RedHat', 4096))
+        report = facts.ingest_facts(self.manager.session, self.directory,
+                                    workers=2, processes=True)
+        self.assertEqual(report.ingested, 1)
+
+    def test_missing_directory(self):
+        self.assertIsNone(self.manager.ingest_facts(
+            os.path.join(self.directory, 'missing')))
@@ -0,0 +1,119 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from Manager import Manager
+from sqlalchemy import create_engine, event
+
+LOG = logging.getLogger('Manager')
+
+
+class TestGraph(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+
+        self.loadManagerData()
+
+    @classmethod
+    def loadManagerData(self):
+        manager = self.manager
+        manager.add_company(company_name='Acme')
+        manager.add_company(company_name='RedHat')
+        manager.add_office(office_name='Austin', company_name='Acme')
+        manager.add_office(office_name='Dallas', company_name='RedHat')
+        manager.add_group(group_name='IT', company_name='Acme',
+                          office_name='Austin')
+        manager.add_group(group_name='Dev', company_name='Acme',
+                          office_name='Austin')
+        manager.add_group(group_name='Ops', company_name='RedHat',
+                          office_name='Dallas')
+        manager.add_host(hostname='roadrunner', company_name='Acme',
+                         office_name='Austin', group_names=['IT', 'Dev'])
+        manager.add_host(hostname='coyote', company_name='Acme',
+                         office_name='Austin', group_names=['IT', 'Dev'])
+        manager.add_host(hostname='bugs', company_name='RedHat',
+                         office_name='Dallas', group_names=['Ops'])
+
+    def count_queries(self, func, *args, **kwargs):
+        statements = []
+
+        def before_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', before_execute)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', before_execute)
+        return result, len(statements)
+
+    def test_lookups(self):
+        graph = self.manager.get_graph()
+
+        hosts = graph.get_hosts('Acme', 'Austin')
+        self.assertEqual(sorted(h.name for h in hosts), ['coyote', 'roadrunner'])
+        self.assertEqual(graph.get_hosts('Acme', 'Nowhere'), [])
+
+        groups = graph.get_groups('Acme', 'Austin')
+        self.assertEqual(sorted(g.fq_name for g in groups),
+                         ['Acme_Austin_Dev', 'Acme_Austin_IT'])
+
+        self.assertEqual(graph.group_hosts('Acme_Austin_IT'),
+                         ['coyote', 'roadrunner'])
+        self.assertEqual(graph.host_groups('bugs'), ['RedHat_Dallas_Ops'])
+        self.assertEqual(graph.host_groups('coyote', 'Acme', 'Austin'),
+                         ['Acme_Austin_Dev', 'Acme_Austin_IT'])
+        self.assertIsNone(graph.get_host('coyote', 'RedHat', 'Dallas'))
+
+    def test_no_queries_when_unchanged(self):
+        graph = self.manager.get_graph()
+        # Only the revision lookup
+        _, count = self.count_queries(self.manager.get_graph)
+        self.assertEqual(count, 1)
+
+        # Lookups never touch the database
+        _, count = self.count_queries(graph.hosts_by_group)
+        self.assertEqual(count, 0)
+
+    def test_incremental_refresh(self):
+        graph = self.manager.get_graph()
+        self.manager.add_host(hostname='daffy', company_name='RedHat',
+                              office_name='Dallas', group_names=['Ops'])
+
+        changed = graph.refresh(self.manager.session,
+                                self.manager.data_revisions())
+        self.assertEqual(changed, ['host', 'association'])
+        self.assertEqual(graph.group_hosts('RedHat_Dallas_Ops'),
+                         ['bugs', 'daffy'])
+
+        self.manager.del_host(hostname='daffy', company_name='RedHat',
+                              office_name='Dallas')
+        graph = self.manager.get_graph()
+        self.assertEqual(graph.group_hosts('RedHat_Dallas_Ops'), ['bugs'])
+        self.assertEqual(graph.host_groups('daffy'), [])
+
+    def test_other_writer(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        engine = create_engine(
+            'sqlite:///' + os.path.join(tmpdir, 'inventory.db'))
+        self.addCleanup(engine.dispose)
+        reader = Manager(engine)
+        writer = Manager(engine)
+        writer.ensure_host('bugs', 'RedHat', 'Dallas', ['Ops'])
+        graph = reader.get_graph()
+        self.assertEqual(graph.group_hosts('RedHat_Dallas_Ops'), ['bugs'])
+
+        # The reader refreshes the tables the writer changed
+        writer.ensure_host('daffy', 'RedHat', 'Dallas', ['Ops'])
+        self.assertEqual(graph.refresh(reader.session,
+                                       reader.data_revisions()),
+                         ['host', 'association'])
+        self.assertEqual(reader.get_graph().group_hosts('RedHat_Dallas_Ops'),
+                         ['bugs', 'daffy'])
+        reader.close()
+        writer.close()
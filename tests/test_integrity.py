@@ -0,0 +1,100 @@
+import logging
+import unittest
+from Manager import Manager
+from inventory import association_table, Group, Host, HostVar, SambaGroup
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['roadrunner', 'coyote']},
+        'Houston': {'Ops': ['tex']},
+    },
+    'RedHat': {
+        'Dallas': {'Ops': ['bugs']},
+    },
+}
+
+
+class TestIntegrity(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+        self.manager.sync(SPEC)
+        self.graph = self.manager.get_graph()
+
+    def execute(self, statement):
+        with self.engine.begin() as conn:
+            conn.execute(statement)
+
+    def ids(self):
+        graph = self.graph
+        return {'it': graph.group_by_fq_name['Acme_Austin_IT'].id,
+                'ops': graph.group_by_fq_name['RedHat_Dallas_Ops'].id,
+                'roadrunner': graph.get_host('roadrunner', 'Acme',
+                                             'Austin').id,
+                'tex': graph.get_host('tex', 'Acme', 'Houston').id,
+                'acme': graph.get_company('Acme').id,
+                'redhat': graph.get_company('RedHat').id,
+                'austin': graph.get_office('Austin', 'Acme').id}
+
+    def kinds(self):
+        return dict((finding.kind, finding.rows)
+                    for finding in self.manager.check_integrity())
+
+    def test_clean(self):
+        self.assertEqual(self.manager.check_integrity(), [])
+
+    def test_findings_and_repair(self):
+        ids = self.ids()
+        insert = association_table.insert()
+        # tex (Houston) in Austin's IT group
+        self.execute(insert.values(host_id=ids['tex'], group_id=ids['it']))
+        # roadrunner in IT twice: refused by the unique index
+        with self.assertRaises(IntegrityError):
+            self.execute(insert.values(host_id=ids['roadrunner'],
+                                       group_id=ids['it']))
+        # association to a host that doesn't exist
+        self.execute(insert.values(host_id=9999, group_id=ids['ops']))
+        # Acme's IT group in RedHat
+        self.execute(Group.__table__.update()
+                     .where(Group.__table__.c.id == ids['it'])
+                     .values(company_id=ids['redhat']))
+        self.execute(Host.__table__.update()
+                     .where(Host.__table__.c.id == ids['tex'])
+                     .values(company_id=ids['redhat']))
+        self.execute(SambaGroup.__table__.insert().values(
+            name='users', gid=100, company_id=ids['redhat'],
+            office_id=ids['austin']))
+        # variable of a host that doesn't exist
+        self.execute(HostVar.__table__.insert().values(
+            host_id=9999, key='ansible_kernel', value='"5.10"'))
+
+        kinds = self.kinds()
+        self.assertEqual(kinds['cross_office_membership'],
+                         [(ids['tex'], ids['it'])])
+        self.assertEqual(kinds['dangling_membership'], [(9999, ids['ops'])])
+        self.assertEqual(kinds['group_company'],
+                         [(ids['it'], ids['redhat'], ids['acme'])])
+        self.assertEqual(kinds['host_company'],
+                         [(ids['tex'], ids['redhat'], ids['acme'])])
+        self.assertEqual(len(kinds['samba_group_company']), 1)
+        self.assertNotIn('samba_user_company', kinds)
+        self.assertEqual([row[1] for row in kinds['dangling_host_var']],
+                         [9999])
+
+        findings = self.manager.check_integrity(repair=True)
+        self.assertEqual(len(findings), 6)
+        self.assertEqual(self.manager.check_integrity(), [])
+
+        # Valid memberships survive the repair
+        graph = self.manager.get_graph()
+        self.assertEqual(graph.group_hosts('Acme_Austin_IT'),
+                         ['coyote', 'roadrunner'])
+        self.assertEqual(graph.group_hosts('RedHat_Dallas_Ops'), ['bugs'])
+        self.assertEqual(graph.host_groups('tex'), ['Acme_Houston_Ops'])
+        self.assertEqual(self.manager.search_hosts('tex')[0]['company'],
+                         'Acme')
@@ -0,0 +1,94 @@
+import logging
+import unittest
+import loading
+from inventory import Company, Group, Office
+from Manager import Manager
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.exc import InvalidRequestError
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['coyote', 'roadrunner'],
+                   'Web': ['roadrunner']},
+        'Houston': {'Ops': ['tex']},
+    },
+    'RedHat': {
+        'Dallas': {'Ops': ['bugs']},
+    },
+}
+
+AUSTIN = {'company_name': 'Acme', 'office_name': 'Austin'}
+
+
+class TestLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine, strict=True)
+        self.manager.sync(SPEC)
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute',
+                     lambda *args: self.statements.append(args[2]))
+
+    def test_manager_profiles(self):
+        hosts = self.manager.get_hosts(**AUSTIN)
+        self.assertEqual(len(self.statements), 2)
+        self.assertEqual(sorted(host.name for host in hosts),
+                         ['coyote', 'roadrunner'])
+        # Strict: what the profile didn't load raises instead of loading
+        with self.assertRaises(InvalidRequestError):
+            hosts[0].groups
+        self.assertEqual(len(self.statements), 2)
+
+        groups = self.manager.get_groups(**AUSTIN)
+        self.assertEqual(sorted(group.name for group in groups),
+                         ['IT', 'Ops', 'Web'])
+        self.assertEqual(sorted(office.name for office in
+                                self.manager.get_offices('Acme')),
+                         ['Austin', 'Houston'])
+        self.assertEqual(len(self.statements), 4)
+
+    def test_not_strict(self):
+        manager = Manager(self.engine)
+        host = manager.get_hosts(**AUSTIN)[0]
+        self.assertTrue(host.groups)
+        manager.close()
+
+    def test_export(self):
+        session = self.manager.session
+        companies = session.execute(
+            select(Company).order_by(Company.name)
+            .options(*loading.options(
+                'export', (Company.offices, Office.groups, Group.hosts),
+                strict=True))).scalars().all()
+        tree = dict((company.name, dict(
+            (office.name, dict((group.name, sorted(host.name for host
+                                                   in group.hosts))
+                               for group in office.groups))
+            for office in company.offices)) for company in companies)
+        self.assertEqual(tree, SPEC)
+        # One query per level, whatever the number of rows
+        self.assertEqual(len(self.statements), 4)
+
+    def test_bulk_write(self):
+        with self.assertRaises(ValueError):
+            loading.options('bulk-write', (Company.offices,))
+        self.manager.del_host(hostname='roadrunner', **AUSTIN)
+        self.manager.del_group(group_name='IT', **AUSTIN)
+        self.assertEqual(self.manager.hosts_by_group(),
+                         {'Acme_Houston_Ops': ['tex'],
+                          'RedHat_Dallas_Ops': ['bugs']})
+        self.assertEqual(self.manager.check_integrity(), [])
+
+        # Deleting a company or an office with children is refused
+        revision = self.manager.revision
+        self.assertIsNone(self.manager.del_company(company_name='RedHat'))
+        self.assertIsNone(self.manager.del_office(**AUSTIN))
+        self.assertEqual(self.manager.revision, revision)
+        self.manager.del_host(hostname='coyote', **AUSTIN)
+        self.manager.del_group(group_name='Web', **AUSTIN)
+        self.manager.del_office(**AUSTIN)
+        self.assertEqual([row.office for row in
+                          self.manager.iter_offices('Acme')], ['Houston'])
@@ -0,0 +1,58 @@
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from benchmarks import loadtest
+
+LOG = logging.getLogger('Manager')
+
+
+class TestLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_percentile(self):
+        ordered = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(ordered, 0.50), 50)
+        self.assertEqual(loadtest.percentile(ordered, 0.99), 99)
+        self.assertEqual(loadtest.percentile([7], 0.95), 7)
+        self.assertIsNone(loadtest.percentile([], 0.5))
+
+    def test_parse_mix(self):
+        self.assertEqual(loadtest.parse_mix('list=3,add_host=1'),
+                         [('list', 3.0), ('add_host', 1.0)])
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix('drop_table=1')
+
+    def test_run(self):
+        output = os.path.join(self.tmpdir, 'runs.jsonl')
+        argv = ['--db', os.path.join(self.tmpdir, 'load.db'),
+                '--hosts', '50', '--workers', '2', '--duration', '0.5',
+                '--mix', 'list=1,host=1,add_host=1,del_host=1',
+                '--output', output, '--label', 'smoke']
+        out = io.StringIO()
+        self.assertEqual(loadtest.main(argv, out=out), 0)
+        self.assertIn('p99 ms', out.getvalue())
+
+        with open(output) as runs:
+            document = json.loads(runs.readline())
+        self.assertEqual(document['config']['workers'], 2)
+        results = document['results']
+        self.assertEqual(sorted(results),
+                         ['add_host', 'del_host', 'host', 'list'])
+        for stats in results.values():
+            self.assertEqual(stats['errors'], 0)
+            self.assertEqual(stats['ok'] + stats['lock_errors'],
+                             stats['count'])
+        self.assertGreater(results['list']['ok'], 0)
+        self.assertLessEqual(results['list']['p50_ms'],
+                             results['list']['p99_ms'])
+
+        out = io.StringIO()
+        loadtest.main(['--compare', output], out=out)
+        self.assertIn('smoke 2xthread wal', out.getvalue())
@@ -0,0 +1,117 @@
+import logging
+import unittest
+import membership
+from Manager import Manager
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['roadrunner', 'coyote'],
+                   'Dev': ['roadrunner']},
+    },
+    'RedHat': {
+        'Dallas': {'Ops': ['bugs']},
+    },
+}
+
+
+class TestMembership(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+        self.manager.sync(SPEC)
+
+    def assertConsistent(self):
+        report = self.manager.check_membership()
+        self.assertTrue(membership.is_consistent(report), report)
+
+    def execute(self, sql, **params):
+        self.manager.session.execute(text(sql), params)
+        self.manager.session.commit()
+
+    def test_write_paths(self):
+        self.assertEqual(self.manager.hosts_by_group(),
+                         {'Acme_Austin_Dev': ['roadrunner'],
+                          'Acme_Austin_IT': ['coyote', 'roadrunner'],
+                          'RedHat_Dallas_Ops': ['bugs']})
+        self.assertConsistent()
+
+        self.manager.add_host(hostname='daffy', company_name='RedHat',
+                              office_name='Dallas', group_names=['Ops'])
+        self.manager.del_host(hostname='coyote', company_name='Acme',
+                              office_name='Austin')
+        self.manager.ensure_host('tex', 'Acme', 'Houston', ['Ops'])
+        self.manager.del_group(group_name='Dev', company_name='Acme',
+                               office_name='Austin')
+        self.assertEqual(self.manager.hosts_by_group(),
+                         {'Acme_Austin_IT': ['roadrunner'],
+                          'Acme_Houston_Ops': ['tex'],
+                          'RedHat_Dallas_Ops': ['bugs', 'daffy']})
+        self.assertConsistent()
+
+    def test_renames(self):
+        self.execute("UPDATE company SET name = 'ACME' WHERE name = 'Acme'")
+        self.execute("UPDATE office SET name = 'Plano' WHERE name = 'Dallas'")
+        self.execute("UPDATE host SET name = 'bugs2' WHERE name = 'bugs'")
+        self.execute('UPDATE "group" SET name = \'Eng\' WHERE name = \'Dev\'')
+        self.assertEqual(self.manager.hosts_by_group(),
+                         {'ACME_Austin_Eng': ['roadrunner'],
+                          'ACME_Austin_IT': ['coyote', 'roadrunner'],
+                          'RedHat_Plano_Ops': ['bugs2']})
+        self.assertConsistent()
+
+    def test_upsert_keeps_names(self):
+        for number in range(100):
+            self.manager.ensure_host('host{}'.format(number), 'Acme',
+                                     'Austin', ['IT'])
+        connection = self.manager.session.connection()
+        changes = connection.connection.dbapi_connection.total_changes
+        self.manager.ensure_host('host0', 'Acme', 'Austin', ['IT'])
+        connection = self.manager.session.connection()
+        changes = (connection.connection.dbapi_connection.total_changes -
+                   changes)
+        # The upserts and the search index, not the 300 membership rows of
+        # the company, office and group
+        self.assertLess(changes, 50)
+        self.assertConsistent()
+
+    def test_duplicates(self):
+        group_id = self.manager.get_graph().group_by_fq_name[
+            'RedHat_Dallas_Ops'].id
+        host_id = self.manager.get_graph().get_host('bugs', 'RedHat',
+                                                    'Dallas').id
+        with self.assertRaises(IntegrityError):
+            self.execute('INSERT INTO association (host_id, group_id) '
+                         'VALUES (:h, :g)', h=host_id, g=group_id)
+        self.manager.session.rollback()
+        self.assertConsistent()
+        self.assertEqual(self.manager.hosts_by_group('RedHat_Dallas_Ops'),
+                         {'RedHat_Dallas_Ops': ['bugs']})
+
+    def test_check_and_rebuild(self):
+        self.execute('DELETE FROM inventory_membership WHERE host_name = '
+                     "'coyote'")
+        self.execute("UPDATE inventory_membership SET host_name = 'x' "
+                     "WHERE host_name = 'bugs'")
+        report = self.manager.check_membership()
+        self.assertFalse(membership.is_consistent(report))
+        self.assertEqual(len(report['missing']), 2)
+        self.assertEqual(report['extra'], [('RedHat_Dallas_Ops', 'x',
+                                            report['extra'][0][2],
+                                            report['extra'][0][3])])
+
+        self.manager.rebuild_membership()
+        self.assertConsistent()
+
+    def test_index_scan(self):
+        conn = self.manager.session.connection()
+        plan = conn.exec_driver_sql(
+            'EXPLAIN QUERY PLAN SELECT fq_group_name, host_name '
+            'FROM inventory_membership ORDER BY fq_group_name, host_name'
+        ).all()
+        self.assertIn('COVERING INDEX ix_inventory_membership_covering',
+                      plan[0][3])
@@ -0,0 +1,119 @@
+import logging
+import unittest
+from Manager import Manager
+from membership import is_consistent
+from sqlalchemy import create_engine
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['roadrunner', 'coyote', 'wile'],
+                   'Web': ['roadrunner'],
+                   'Lab': ['wile']},
+        'Houston': {'Ops': ['tex', 'coyote'],
+                    'Web': ['tex']},
+    },
+    'RedHat': {
+        'Dallas': {'Ops': ['bugs']},
+    },
+}
+
+AUSTIN = {'company_name': 'Acme', 'office_name': 'Austin'}
+
+
+class TestMoves(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+        self.manager.sync(SPEC)
+
+    def hosts(self, company_name, office_name):
+        return [row.host for row in self.manager.iter_hosts(
+            company_name=company_name, office_name=office_name)]
+
+    def test_move(self):
+        self.manager.set_vars({'rack': 7}, hostname='roadrunner', **AUSTIN)
+        moved = self.manager.move_hosts(
+            {'company_name': 'Acme', 'office_name': 'Austin',
+             'hostnames': ['roadrunner']},
+            to_company='Acme', to_office='Houston',
+            group_mapping={'IT': 'Ops'})
+        self.assertEqual(moved, 1)
+        self.assertEqual(self.hosts('Acme', 'Austin'), ['coyote', 'wile'])
+        self.assertEqual(self.hosts('Acme', 'Houston'),
+                         ['coyote', 'roadrunner', 'tex'])
+        groups = self.manager.hosts_by_group()
+        self.assertEqual(groups['Acme_Houston_Ops'],
+                         ['coyote', 'roadrunner', 'tex'])
+        self.assertEqual(groups['Acme_Houston_Web'], ['roadrunner', 'tex'])
+        self.assertNotIn('Acme_Austin_Web', groups)
+        # The variables moved with the host
+        self.assertEqual(self.manager.get_host_vars(
+            'roadrunner', company_name='Acme', office_name='Houston'),
+            {'rack': 7})
+        result = self.manager.search_hosts('roadrunner')[0]
+        self.assertEqual(result['office'], 'Houston')
+        self.assertEqual(self.manager.check_integrity(), [])
+        self.assertTrue(is_consistent(self.manager.check_membership()))
+
+    def test_move_to_company(self):
+        moved = self.manager.move_hosts(
+            {'company_name': 'Acme', 'group_name': 'Lab'},
+            to_company='RedHat', to_office='Dallas',
+            group_mapping={'IT': 'Ops', 'Lab': None})
+        self.assertEqual(moved, 1)
+        self.assertEqual(self.hosts('RedHat', 'Dallas'), ['bugs', 'wile'])
+        self.assertEqual(self.manager.hosts_by_group('RedHat_Dallas_Ops'),
+                         {'RedHat_Dallas_Ops': ['bugs', 'wile']})
+        self.assertEqual(self.manager.check_integrity(), [])
+
+    def test_move_conflicts(self):
+        # coyote is in both offices; Lab doesn't exist in Houston
+        revision = self.manager.revision
+        self.assertIsNone(self.manager.move_hosts(
+            dict(AUSTIN), to_company='Acme', to_office='Houston',
+            group_mapping={'IT': 'Ops'}))
+        self.assertIsNone(self.manager.move_hosts(
+            dict(AUSTIN, hostnames=['wile']), to_company='Acme',
+            to_office='Houston', group_mapping={'IT': 'Ops'}))
+        self.assertIsNone(self.manager.move_hosts(
+            dict(AUSTIN, hostnames=['nobody']), to_company='Acme',
+            to_office='Houston'))
+        self.assertIsNone(self.manager.move_hosts(
+            dict(AUSTIN, colour='red'), to_company='Acme',
+            to_office='Houston'))
+        self.assertEqual(self.manager.revision, revision)
+        self.assertEqual(self.hosts('Acme', 'Austin'),
+                         ['coyote', 'roadrunner', 'wile'])
+
+    def test_rename(self):
+        self.assertEqual(self.manager.rename_hosts(
+            {'roadrunner': 'beep', 'coyote': 'wile-e'}, **AUSTIN), 2)
+        self.assertEqual(self.hosts('Acme', 'Austin'),
+                         ['beep', 'wile', 'wile-e'])
+        # Only Austin's coyote was renamed
+        self.assertEqual(self.hosts('Acme', 'Houston'), ['coyote', 'tex'])
+        self.assertEqual(self.manager.hosts_by_group('Acme_Austin_IT'),
+                         {'Acme_Austin_IT': ['beep', 'wile', 'wile-e']})
+        self.assertEqual(self.manager.search_hosts('beep')[0]['host'],
+                         'beep')
+        self.assertTrue(is_consistent(self.manager.check_membership()))
+
+    def test_rename_swap_and_conflicts(self):
+        self.assertEqual(self.manager.rename_hosts(
+            {'roadrunner': 'wile', 'wile': 'roadrunner'}, **AUSTIN), 2)
+        self.assertEqual(self.manager.hosts_by_group('Acme_Austin_Lab'),
+                         {'Acme_Austin_Lab': ['roadrunner']})
+
+        revision = self.manager.revision
+        self.assertIsNone(self.manager.rename_hosts({'wile': 'coyote'},
+                                                    **AUSTIN))
+        self.assertIsNone(self.manager.rename_hosts(
+            {'wile': 'x', 'coyote': 'x'}, **AUSTIN))
+        self.assertIsNone(self.manager.rename_hosts({'nobody': 'x'}))
+        self.assertEqual(self.manager.revision, revision)
+
+        # Without company and office every host of that name is renamed
+        self.assertEqual(self.manager.rename_hosts({'coyote': 'acme'}), 2)
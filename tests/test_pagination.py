@@ -0,0 +1,99 @@
+import logging
+import unittest
+from Manager import Manager
+from sqlalchemy import create_engine, event
+
+LOG = logging.getLogger('Manager')
+
+
+class TestPagination(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+        spec = {}
+        for c in range(3):
+            company = spec.setdefault('company{}'.format(c), {})
+            for o in range(4):
+                company['office{}'.format(o)] = dict(
+                    ('group{}'.format(g),
+                     ['host{:02}'.format(h) for h in range(g, 10)])
+                    for g in range(5))
+        self.manager.sync(spec)
+
+    def count_queries(self, func, *args, **kwargs):
+        statements = []
+
+        def before_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', before_execute)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', before_execute)
+        return result, len(statements)
+
+    def test_companies(self):
+        rows = list(self.manager.iter_companies())
+        self.assertEqual([row.company for row in rows],
+                         ['company0', 'company1', 'company2'])
+        rows = list(self.manager.iter_companies(after='company0', limit=1))
+        self.assertEqual([row.company for row in rows], ['company1'])
+        rows = list(self.manager.iter_companies(like='%2'))
+        self.assertEqual([row.company for row in rows], ['company2'])
+
+    def test_keyset_pages(self):
+        everything = list(self.manager.iter_groups())
+        self.assertEqual(len(everything), 60)
+        self.assertEqual(everything, sorted(everything))
+
+        # One query per page, no lazy loads
+        rows, count = self.count_queries(
+            lambda: list(self.manager.iter_groups(page_size=7)))
+        self.assertEqual(rows, everything)
+        self.assertEqual(count, 9)
+
+        # Resume after any row
+        rows = list(self.manager.iter_groups(after=everything[24], limit=10))
+        self.assertEqual(rows, everything[25:35])
+
+    def test_partial_cursor(self):
+        # A shorter cursor continues after every row starting with it
+        rows = list(self.manager.iter_offices(after='company0', limit=1))
+        self.assertEqual([tuple(row) for row in rows],
+                         [('company1', 'office0')])
+        rows = list(self.manager.iter_groups(after=('company2', 'office2')))
+        self.assertEqual([tuple(row)[:2] for row in rows],
+                         [('company2', 'office3')] * 5)
+        rows = list(self.manager.iter_hosts(after=('company1', 'office3'),
+                                            limit=1))
+        self.assertEqual(tuple(rows[0]), ('company2', 'office0', 'host00'))
+        with self.assertRaises(ValueError) as raised:
+            self.manager.iter_offices(after=('company0', 'office0', 'x'))
+        self.assertIn('Company.name, Office.name', str(raised.exception))
+
+    def test_filters(self):
+        rows = list(self.manager.iter_offices(company_name='company1'))
+        self.assertEqual([tuple(row) for row in rows],
+                         [('company1', 'office{}'.format(o))
+                          for o in range(4)])
+
+        rows = list(self.manager.iter_groups(company_name='company1',
+                                             office_name='office2'))
+        self.assertEqual(len(rows), 5)
+
+        rows = list(self.manager.iter_hosts(company_name='company2',
+                                            office_name='office0',
+                                            group_name='group8'))
+        self.assertEqual(rows, [])
+        rows = list(self.manager.iter_hosts(company_name='company2',
+                                            office_name='office0',
+                                            group_name='group4'))
+        self.assertEqual([row.host for row in rows],
+                         ['host04', 'host05', 'host06', 'host07', 'host08',
+                          'host09'])
+
+        rows = list(self.manager.iter_hosts(like='host0_', page_size=4))
+        self.assertEqual(len(rows), 120)
@@ -0,0 +1,212 @@
+import logging
+import re
+import unittest
+import warnings
+from Manager import Manager
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import SAWarning
+
+LOG = logging.getLogger('Manager')
+
+# Tables that grow with the number of hosts: a SCAN of one of them is a
+# regression unless the operation reads the whole table on purpose
+LARGE_TABLES = ('host', 'group', 'association', 'inventory_membership',
+                'host_var', 'host_search')
+
+# Statements without a query plan
+UNPLANNED = re.compile(r'\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|PRAGMA|'
+                       r'CREATE|DROP)\b', re.IGNORECASE)
+SCAN = re.compile(r'SCAN (?:TABLE )?"?(\w+)"?'
+                  r'(?: VIRTUAL TABLE INDEX \d+:(\S*))?')
+
+
+def make_spec(companies=3, offices=3, groups=4, hosts=40):
+    spec = {}
+    for c in range(companies):
+        company = spec.setdefault('company{}'.format(c), {})
+        for o in range(offices):
+            office = company.setdefault('office{}'.format(o), {})
+            for h in range(hosts):
+                for g in (h % groups, (h + 1) % groups):
+                    office.setdefault('group{}'.format(g), []).append(
+                        'host{}'.format(h))
+    return spec
+
+
+class QueryCapture(object):
+    """Record the statements an engine executes inside a with block."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    def queries(self):
+        """Return the captured statements that have a query plan."""
+        return [(statement, parameters)
+                for statement, parameters in self.statements
+                if not UNPLANNED.match(statement)]
+
+
+def scanned_table(detail):
+    """Return the table a query plan line scans in full, or None.
+
+    Virtual (FTS) tables are scanned in full when the module was given no
+    constraint, i.e. an empty index string.
+    """
+    match = SCAN.match(detail)
+    if not match:
+        return None
+    table, index = match.groups()
+    if index:
+        return None
+    return table
+
+
+def query_plan(conn, statement, parameters):
+    """Return the detail lines of EXPLAIN QUERY PLAN statement."""
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[3] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+SPEC = make_spec()
+# Deletable without children
+SPEC['company9'] = {}
+SPEC['company1']['office9'] = {}
+
+# Filters of the office1 office of company1
+OFFICE = {'company_name': 'company1', 'office_name': 'office1'}
+
+# name: (call, large tables it reads in full, number of queries)
+OPERATIONS = {
+    'get_company': (lambda m: m.get_company('company1'), (), 1),
+    'get_office': (lambda m: m.get_office('office1', 'company1'), (), 1),
+    'get_offices': (lambda m: list(m.get_offices('company1')), (), 1),
+    'get_group': (lambda m: m.get_group('group1', **OFFICE), (), 1),
+    'get_groups': (lambda m: list(m.get_groups(**OFFICE)), (), 1),
+    'get_hosts': (lambda m: list(m.get_hosts(**OFFICE)), (), 2),
+    'get_host': (lambda m: m.get_host('host7', **OFFICE), (), 1),
+    'get_host_vars': (lambda m: m.get_host_vars('host7', **OFFICE), (), 2),
+    'add_company': (lambda m: m.add_company('company10'), (), 2),
+    'del_company': (lambda m: m.del_company('company9'), (), 4),
+    'add_office': (lambda m: m.add_office('office10', 'company1'), (), 3),
+    'del_office': (lambda m: m.del_office('office9', 'company1'), (), 4),
+    'add_group': (lambda m: m.add_group('group10', **OFFICE), (), 4),
+    'del_group': (lambda m: m.del_group('group1', **OFFICE), (), 6),
+    'add_host': (lambda m: m.add_host('host100', group_names=['group1',
+                                                              'group2'],
+                                      **OFFICE), (), 8),
+    'del_host': (lambda m: m.del_host('host7', **OFFICE), (), 7),
+    'move_hosts': (lambda m: m.move_hosts(
+        dict(OFFICE, group_name='group1'), to_company='company1',
+        to_office='office9', group_mapping=dict.fromkeys(
+            ['group0', 'group1', 'group2', 'group3'])), (), 9),
+    'rename_hosts': (lambda m: m.rename_hosts({'host7': 'host70',
+                                               'host8': 'host7'}, **OFFICE),
+                     (), 7),
+    'ensure_company': (lambda m: m.ensure_company('company1'), (), 2),
+    'ensure_office': (lambda m: m.ensure_office('office1', 'company1'), (),
+                      4),
+    'ensure_group': (lambda m: m.ensure_group('group1', **OFFICE), (), 6),
+    'ensure_host': (lambda m: m.ensure_host('host7', group_names=['group1'],
+                                            **OFFICE), (), 11),
+    'iter_companies': (lambda m: list(m.iter_companies()), (), 1),
+    'iter_offices': (lambda m: list(m.iter_offices('company1')), (), 1),
+    'iter_groups': (lambda m: list(m.iter_groups(**OFFICE)), (), 1),
+    'iter_hosts': (lambda m: list(m.iter_hosts(**OFFICE)), (), 1),
+    'iter_hosts_of_group': (lambda m: list(m.iter_hosts(group_name='group1',
+                                                        **OFFICE)), (), 1),
+    'iter_hosts_page': (lambda m: list(m.iter_hosts(limit=10)), ('host',),
+                        1),
+    'hosts_by_group': (lambda m: m.hosts_by_group('company1_office1_group1'),
+                       (), 1),
+    'hosts_by_group_all': (lambda m: m.hosts_by_group(),
+                           ('inventory_membership',), 1),
+    'export': (lambda m: m.export(),
+               ('association', 'group', 'host', 'host_var',
+                'inventory_membership'), 9),
+    'snapshot': (lambda m: m.snapshot(),
+                 ('association', 'group', 'host', 'host_var',
+                  'inventory_membership'), 13),
+    'search_hosts': (lambda m: m.search_hosts('host7'), (), 1),
+    'search_hosts_prefix': (lambda m: m.search_hosts('host1*'), (), 1),
+    'sync_unchanged': (lambda m: m.sync(SPEC), (), 5),
+    'sync_company': (lambda m: m.sync({'company1': SPEC['company1'],
+                                       'company11': {'office1': {
+                                           'group1': ['host1']}}}),
+                     (), 16),
+    'check_integrity': (lambda m: m.check_integrity(),
+                        ('association', 'group', 'host', 'host_var'), 10),
+    'check_membership': (lambda m: m.check_membership(),
+                         ('association', 'inventory_membership'), 4),
+    'get_graph': (lambda m: m.get_graph(),
+                  ('association', 'group', 'host'), 6),
+    'stats': (lambda m: m.stats(), ('association', 'group', 'host'), 6),
+}
+
+
+class TestQueryPlans(unittest.TestCase):
+    """EXPLAIN QUERY PLAN every statement of the Manager operations.
+
+    Fails on cartesian products, on full scans of the LARGE_TABLES an
+    operation shouldn't read in full and when an operation runs another
+    number of queries than pinned in OPERATIONS (an N+1 regression, or an
+    improvement: update the count). The Manager is strict, see loading.py,
+    and the flush must not load relationships either.
+    """
+
+    def check(self, call, scans, count):
+        # A fresh inventory per operation: the writes change it
+        engine = create_engine('sqlite://', echo=False)
+        manager = Manager(engine, strict=True)
+        manager.sync(SPEC)
+        lazy_loads = []
+
+        def record(state):
+            if state.is_select and state.lazy_loaded_from is not None:
+                lazy_loads.append(str(state.statement))
+
+        event.listen(manager.session, 'do_orm_execute', record)
+        try:
+            with warnings.catch_warnings():
+                # SQLAlchemy warns about FROM elements without join condition
+                warnings.simplefilter('error', SAWarning)
+                with QueryCapture(engine) as capture:
+                    call(manager)
+            manager.session.rollback()
+            self.assertEqual(lazy_loads, [])
+            queries = capture.queries()
+            with engine.connect() as conn:
+                for statement, parameters in queries:
+                    plan = query_plan(conn, statement, parameters)
+                    for detail in plan:
+                        table = scanned_table(detail)
+                        if table in LARGE_TABLES:
+                            self.assertIn(table, scans, '{}\n{}'.format(
+                                statement, '\n'.join(plan)))
+            if count is not None:
+                self.assertEqual(len(queries), count, '\n\n'.join(
+                    statement for statement, _ in queries))
+        finally:
+            manager.close()
+
+    def test_operations(self):
+        for name in sorted(OPERATIONS):
+            with self.subTest(operation=name):
+                self.check(*OPERATIONS[name])
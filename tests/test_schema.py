@@ -0,0 +1,91 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import schema
+from Manager import Manager
+from schema import (SCHEMA_VERSION,
+                    SchemaVersionError,
+                    check_schema,
+                    create_schema,
+                    get_version,
+                    upgrade_schema)
+from sqlalchemy import create_engine, event, inspect
+
+LOG = logging.getLogger('Manager')
+
+
+class TestSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.url = 'sqlite:///' + os.path.join(self.tmpdir, 'inventory.db')
+        self.engine = create_engine(self.url)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def test_create(self):
+        self.assertIsNone(get_version(self.engine))
+        self.assertEqual(create_schema(self.engine), SCHEMA_VERSION)
+        self.assertEqual(get_version(self.engine), SCHEMA_VERSION)
+
+        # Creating again is a no-op
+        self.assertEqual(create_schema(self.engine), SCHEMA_VERSION)
+
+    def test_manager_single_query_startup(self):
+        create_schema(self.engine)
+        statements = []
+
+        def before_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', before_execute)
+        Manager(self.engine)
+        event.remove(self.engine, 'before_cursor_execute', before_execute)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('inventory_schema', statements[0])
+
+    def test_upgrade_legacy(self):
+        # A database created before versioning: tables, no indexes
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql('CREATE TABLE company '
+                                 '(id INTEGER PRIMARY KEY, name VARCHAR)')
+            conn.exec_driver_sql('CREATE TABLE association '
+                                 '(host_id INTEGER, group_id INTEGER)')
+            conn.exec_driver_sql('INSERT INTO association VALUES '
+                                 '(1, 1), (1, 1), (1, 2)')
+            for table in ('office', 'group', 'host'):
+                conn.exec_driver_sql(
+                    'CREATE TABLE "{}" (id INTEGER PRIMARY KEY, '
+                    'name VARCHAR NOT NULL, company_id INTEGER, '
+                    'office_id INTEGER)'.format(table))
+
+        with self.assertRaises(SchemaVersionError):
+            check_schema(self.engine)
+        self.assertEqual(get_version(self.engine), 1)
+
+        self.assertEqual(upgrade_schema(self.engine), SCHEMA_VERSION)
+        indexes = [index['name']
+                   for index in inspect(self.engine).get_indexes('association')]
+        self.assertIn('ix_association_group_id', indexes)
+        # The duplicated association was reduced to one row
+        self.assertIn('ix_association_host_group', indexes)
+        with self.engine.connect() as conn:
+            self.assertEqual(sorted(conn.exec_driver_sql(
+                'SELECT host_id, group_id FROM association').all()),
+                [(1, 1), (1, 2)])
+        columns = [column['name']
+                   for column in inspect(self.engine).get_columns('group')]
+        self.assertIn('priority', columns)
+        self.assertEqual(check_schema(self.engine), SCHEMA_VERSION)
+
+    def test_newer_schema(self):
+        create_schema(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(schema.schema_version_table.update()
+                         .values(version=SCHEMA_VERSION + 1))
+        with self.assertRaises(SchemaVersionError):
+            Manager(self.engine)
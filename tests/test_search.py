@@ -0,0 +1,86 @@
+import logging
+import unittest
+from unittest import mock
+from Manager import Manager
+from sqlalchemy import create_engine
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['db-07', 'db-070', 'web-01'],
+                   'Databases': ['db-07']},
+    },
+    'RedHat': {
+        'Dallas': {'Ops': ['db-07', 'mail']},
+    },
+}
+
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+        self.manager.sync(SPEC)
+
+    def hosts(self, query, **kwargs):
+        return [(r['company'], r['host'])
+                for r in self.manager.search_hosts(query, **kwargs)]
+
+    def test_substring(self):
+        results = self.manager.search_hosts('db-07')
+        self.assertEqual(len(results), 3)
+        # Exact host names first
+        self.assertEqual(results[0]['host'], 'db-07')
+        acme = [r for r in results
+                if r['company'] == 'Acme' and r['host'] == 'db-07'][0]
+        self.assertEqual(acme['office'], 'Austin')
+        self.assertEqual(acme['groups'],
+                         ['Acme_Austin_Databases', 'Acme_Austin_IT'])
+
+        self.assertEqual(self.hosts('b-0', limit=1), [self.hosts('b-0')[0]])
+
+    def test_prefix(self):
+        self.assertEqual(sorted(self.hosts('web*')), [('Acme', 'web-01')])
+        self.assertEqual(self.hosts('eb*'), [])
+        self.assertEqual(len(self.hosts('db*')), 3)
+        self.assertEqual(len(self.manager.search_hosts('db*', limit=1)), 1)
+        self.assertEqual(len(self.manager.search_hosts('db*', limit=None)),
+                         3)
+
+    def test_group_office_company(self):
+        self.assertEqual(self.hosts('Databases'), [('Acme', 'db-07')])
+        self.assertEqual(sorted(self.hosts('redhat')),
+                         [('RedHat', 'db-07'), ('RedHat', 'mail')])
+        # Shorter than a trigram
+        self.assertEqual(self.hosts('ma'), [('RedHat', 'mail')])
+
+    def test_write_paths(self):
+        self.manager.add_host(hostname='db-99', company_name='RedHat',
+                              office_name='Dallas', group_names=['Ops'])
+        self.assertEqual(self.hosts('db-99'), [('RedHat', 'db-99')])
+
+        self.manager.del_group(group_name='Databases', company_name='Acme',
+                               office_name='Austin')
+        self.assertEqual(self.hosts('Databases'), [])
+
+        spec = {'RedHat': {'Dallas': {'Ops': ['db-07']}}}
+        self.manager.sync(spec, prune=True)
+        self.assertEqual(self.hosts('db-99'), [])
+        self.assertEqual(self.hosts('mail'), [])
+
+        self.manager.rebuild_search()
+        self.assertEqual(sorted(self.hosts('db-07')),
+                         [('Acme', 'db-07'), ('Acme', 'db-070'),
+                          ('RedHat', 'db-07')])
+
+    def test_without_index(self):
+        with mock.patch('search.has_index', return_value=False):
+            self.assertEqual(sorted(self.hosts('db-07')),
+                             [('Acme', 'db-07'), ('Acme', 'db-070'),
+                              ('RedHat', 'db-07')])
+            self.assertEqual(self.hosts('Databases'), [('Acme', 'db-07')])
+            self.assertEqual(self.hosts('web*'), [('Acme', 'web-01')])
+            result = self.manager.search_hosts('mail')[0]
+            self.assertEqual(result['groups'], ['RedHat_Dallas_Ops'])
@@ -0,0 +1,179 @@
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from sharding import ShardedManager, ShardRouter
+from sqlalchemy import event
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['roadrunner', 'coyote'],
+                   'Dev': ['roadrunner']},
+    },
+    'Red Hat': {
+        'Dallas': {'Ops': ['bugs']},
+    },
+    'Warner': {
+        'Burbank': {'Ops': ['bugs', 'daffy']},
+    },
+}
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.manager = ShardedManager(ShardRouter(self.tmpdir))
+        self.manager.sync(SPEC)
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_one_file_per_company(self):
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['Acme.db', 'Red%20Hat.db', 'Warner.db'])
+        self.assertEqual([row.company for row in
+                          self.manager.iter_companies()],
+                         ['Acme', 'Red Hat', 'Warner'])
+
+    def test_routing(self):
+        self.assertIsNotNone(self.manager.add_company(company_name='Zeta'))
+        self.assertIsNotNone(self.manager.add_office(office_name='Paris',
+                                                     company_name='Zeta'))
+        self.manager.add_group('IT', company_name='Zeta', office_name='Paris')
+        self.manager.add_host('zed', company_name='Zeta', office_name='Paris',
+                              group_names=['IT'])
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'Zeta.db')))
+        self.assertEqual(self.manager.get_host('zed', company_name='Zeta',
+                                               office_name='Paris').name,
+                         'zed')
+        self.assertIsNotNone(self.manager.ensure_host('x', 'New', 'Paris',
+                                                      ['IT']))
+
+        # Reads don't create shards
+        self.assertIsNone(self.manager.get_company('Nowhere'))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir,
+                                                     'Nowhere.db')))
+        with self.assertRaises(AttributeError):
+            self.manager.get_graph()
+
+    def test_fan_out(self):
+        groups = list(self.manager.iter_groups())
+        self.assertEqual([tuple(row) for row in groups],
+                         [('Acme', 'Austin', 'Dev'), ('Acme', 'Austin', 'IT'),
+                          ('Red Hat', 'Dallas', 'Ops'),
+                          ('Warner', 'Burbank', 'Ops')])
+        self.assertEqual(list(self.manager.iter_groups(after=groups[1],
+                                                       limit=1)),
+                         groups[2:3])
+        self.assertEqual(len(list(self.manager.iter_hosts())), 5)
+        self.assertEqual(
+            [row.host for row in self.manager.iter_hosts(
+                company_name='Warner')], ['bugs', 'daffy'])
+
+        self.manager.set_vars({'studio': 'Warner'}, company_name='Warner')
+        document = json.loads(self.manager.export('json'))
+        self.assertEqual(document['Warner_Burbank_Ops'],
+                         {'hosts': ['bugs', 'daffy']})
+        self.assertEqual(len(document), 5)
+        self.assertEqual(document['_meta']['hostvars'],
+                         {'bugs': {'studio': 'Warner'},
+                          'daffy': {'studio': 'Warner'}})
+
+        results = self.manager.search_hosts('bugs')
+        self.assertEqual(sorted(result['company'] for result in results),
+                         ['Red Hat', 'Warner'])
+        self.assertEqual(self.manager.check_integrity(), {})
+
+        stats = self.manager.stats()
+        self.assertEqual(stats['totals']['hosts'], 5)
+        self.assertEqual([row['company'] for row in stats['companies']],
+                         ['Acme', 'Red Hat', 'Warner'])
+        self.assertEqual(stats['capacity']['max_hosts_per_group'], 2)
+
+    def test_export_streams(self):
+        events = []
+        for name, manager in self.manager.shards():
+            event.listen(manager.session.get_bind(), 'before_cursor_execute',
+                         lambda *args, name=name: events.append(name))
+
+        class Out(object):
+            def write(self, text):
+                events.append('write')
+
+        self.manager.export('ini', out=Out())
+        # One shard at a time, written before the next one is read
+        self.assertEqual([key for key, _ in itertools.groupby(events)],
+                         ['Acme', 'write', 'Red Hat', 'write', 'Warner',
+                          'write'])
+
+    def test_sync_dry_run(self):
+        plans = self.manager.sync({'Acme': {'Austin': {'IT': ['wile']}},
+                                   'Brand New': {'HQ': {'IT': ['x']}}},
+                                  dry_run=True)
+        self.assertEqual(plans['Acme'].add['hosts'],
+                         {('Acme', 'Austin', 'wile')})
+        self.assertEqual(plans['Brand New'].summary()['add']['hosts'], 1)
+        self.assertNotIn('Brand New',
+                         [row.company for row in
+                          self.manager.iter_companies()])
+
+    def test_per_shard(self):
+        # Moves stay within a company's shard
+        self.assertIsNone(self.manager.move_hosts(
+            {'company_name': 'Acme', 'hostnames': ['coyote']},
+            to_company='Warner', to_office='Burbank'))
+        self.assertIsNone(self.manager.move_hosts(
+            {'hostnames': ['coyote']}, to_company='Acme',
+            to_office='Austin'))
+        self.manager.add_office(office_name='Houston', company_name='Acme')
+        self.manager.add_group('Lab', company_name='Acme',
+                               office_name='Houston')
+        self.assertEqual(self.manager.move_hosts(
+            {'company_name': 'Acme', 'hostnames': ['coyote']},
+            to_company='Acme', to_office='Houston',
+            group_mapping={'IT': 'Lab'}), 1)
+        self.assertEqual(
+            [row.host for row in self.manager.iter_hosts(
+                company_name='Acme', office_name='Houston')], ['coyote'])
+
+        revisions = self.manager.snapshot(label='first')
+        self.assertEqual(sorted(revisions), ['Acme', 'Red Hat', 'Warner'])
+        self.assertEqual(
+            [row.label for row in self.manager.list_snapshots(
+                company_name='Warner')], ['first'])
+        self.assertEqual(
+            len(self.manager.list_snapshots()['Red Hat']), 1)
+        # Revisions are numbered per shard
+        self.assertIsNone(self.manager.diff_snapshots(revisions['Acme'],
+                                                      revisions['Acme']))
+        self.assertIsNotNone(self.manager.diff_snapshots(
+            revisions['Acme'], revisions['Acme'], company_name='Acme'))
+        self.assertIsNone(self.manager.export('json',
+                                              at_revision=revisions['Acme']))
+        self.assertEqual(sorted(self.manager.prune_snapshots(keep=1)),
+                         ['Acme', 'Red Hat', 'Warner'])
+
+        self.manager.set_vars({'studio': 'Warner'}, company_name='Warner')
+        self.assertEqual(list(self.manager.iter_effective_vars()),
+                         [('bugs', {}), ('bugs', {'studio': 'Warner'}),
+                          ('coyote', {}), ('daffy', {'studio': 'Warner'}),
+                          ('roadrunner', {})])
+
+    def test_ingest_facts(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'daffy'), 'w') as fact_file:
+            json.dump({'ansible_distribution': 'Debian'}, fact_file)
+        reports = self.manager.ingest_facts(directory)
+        self.assertEqual(reports['Warner'].ingested, 1)
+        self.assertEqual(reports['Acme'].ingested, 0)
+        self.assertEqual(self.manager.get_host_vars(
+            'daffy', company_name='Warner', office_name='Burbank'),
+            {'ansible_distribution': 'Debian'})
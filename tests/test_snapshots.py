@@ -0,0 +1,117 @@
+import json
+import logging
+import time
+import unittest
+from Manager import Manager
+from inventory import snapshot_chunk_table
+from sqlalchemy import create_engine, func, select
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['roadrunner', 'coyote'],
+                   'Web': ['roadrunner']},
+        'Houston': {'Ops': ['tex']},
+    },
+}
+
+AUSTIN = {'company_name': 'Acme', 'office_name': 'Austin'}
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+        self.manager.sync(SPEC)
+        self.manager.set_vars({'ntp': 'pool.ntp.org'}, company_name='Acme')
+
+    def chunks(self):
+        return self.manager.session.execute(
+            select(func.count()).select_from(snapshot_chunk_table)).scalar()
+
+    def change(self):
+        self.manager.ensure_host(hostname='wile', group_names=['IT'],
+                                 **AUSTIN)
+        self.manager.set_vars({'ntp': '10.0.0.1'}, group_name='Web',
+                              **AUSTIN)
+
+    def test_export_at_revision(self):
+        before = self.manager.export()
+        first = self.manager.snapshot(label='before')
+        self.change()
+        second = self.manager.snapshot()
+        self.assertEqual(second, first + 1)
+
+        self.assertEqual(self.manager.export(at_revision=first), before)
+        self.assertEqual(self.manager.export(at_revision=second),
+                         self.manager.export())
+        for format in ('ini', 'yaml'):
+            self.assertNotEqual(
+                self.manager.export(format, at_revision=first),
+                self.manager.export(format))
+        inventory = json.loads(self.manager.export(at_revision=first))
+        self.assertEqual(inventory['Acme_Austin_IT']['hosts'],
+                         ['coyote', 'roadrunner'])
+        self.assertIsNone(self.manager.export(at_revision=99))
+
+    def test_deduplicated(self):
+        first = self.manager.snapshot()
+        chunks = self.chunks()
+        # Unchanged: no new revision, no new chunk
+        self.assertEqual(self.manager.snapshot(), first)
+        self.assertEqual(self.chunks(), chunks)
+
+        self.manager.ensure_host(hostname='wile', company_name='Acme',
+                                 office_name='Houston', group_names=['Ops'])
+        self.manager.snapshot()
+        # The Ops hosts, the buckets of Ops and of wile, the manifest
+        self.assertEqual(self.chunks(), chunks + 4)
+        self.assertEqual([row.revision
+                          for row in self.manager.list_snapshots()],
+                         [first + 1, first])
+
+    def test_diff(self):
+        first = self.manager.snapshot()
+        self.change()
+        second = self.manager.snapshot()
+        self.assertEqual(self.manager.diff_snapshots(first, second), {
+            'groups': {'added': [], 'removed': [],
+                       'changed': {'Acme_Austin_IT': {'added': ['wile'],
+                                                      'removed': []}}},
+            'hostvars': {'added': ['wile'], 'removed': [],
+                         'changed': ['roadrunner']},
+        })
+        self.assertEqual(self.manager.diff_snapshots(second, second),
+                         {'groups': {'added': [], 'removed': [],
+                                     'changed': {}},
+                          'hostvars': {'added': [], 'removed': [],
+                                       'changed': []}})
+        self.assertIsNone(self.manager.diff_snapshots(first, 99))
+
+    def test_prune(self):
+        first = self.manager.snapshot()
+        self.change()
+        second = self.manager.snapshot()
+        self.manager.del_host(hostname='wile', **AUSTIN)
+        third = self.manager.snapshot()
+
+        self.assertEqual(self.manager.prune_snapshots(),
+                         {'snapshots': 0, 'chunks': 0})
+        self.assertEqual(self.manager.prune_snapshots(
+            keep=1, before=time.time() - 3600), {'snapshots': 0, 'chunks': 0})
+        result = self.manager.prune_snapshots(keep=2)
+        self.assertEqual(result['snapshots'], 1)
+        self.assertGreater(result['chunks'], 0)
+        self.assertEqual([row.revision
+                          for row in self.manager.list_snapshots()],
+                         [third, second])
+        self.assertIsNone(self.manager.export(at_revision=first))
+        # The chunks of the kept snapshots are all there
+        self.assertEqual(self.manager.export(at_revision=third),
+                         self.manager.export())
+
+        self.manager.prune_snapshots(keep=0)
+        self.assertEqual(self.manager.list_snapshots(), [])
+        self.assertEqual(self.chunks(), 0)
@@ -0,0 +1,121 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from inventory import Company
+from Manager import Manager
+from sqlalchemy import create_engine, event
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['roadrunner', 'coyote'],
+                   'Web': ['roadrunner'],
+                   'Lab': [],
+                   'Tmp': ['wile']},
+        'Houston': {'Ops': ['tex']},
+    },
+    'RedHat': {},
+}
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+        self.manager.sync(SPEC)
+        # wile is left in no group
+        self.manager.del_group(group_name='Tmp', company_name='Acme',
+                               office_name='Austin')
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute',
+                     lambda *args: self.statements.append(args[2]))
+
+    def test_stats(self):
+        stats = self.manager.stats()
+        self.assertEqual(stats['totals'],
+                         {'companies': 2, 'offices': 2, 'groups': 4,
+                          'hosts': 4, 'memberships': 4, 'empty_groups': 1,
+                          'ungrouped_hosts': 1})
+        self.assertEqual(stats['companies'],
+                         [{'company': 'Acme', 'offices': 2, 'groups': 4,
+                           'hosts': 4},
+                          {'company': 'RedHat', 'offices': 0, 'groups': 0,
+                           'hosts': 0}])
+        self.assertEqual(stats['offices'],
+                         [{'company': 'Acme', 'office': 'Austin',
+                           'groups': 3, 'hosts': 3},
+                          {'company': 'Acme', 'office': 'Houston',
+                           'groups': 1, 'hosts': 1}])
+        self.assertEqual([(row['group'], row['hosts'])
+                          for row in stats['groups']],
+                         [('IT', 2), ('Lab', 0), ('Web', 1), ('Ops', 1)])
+        self.assertEqual(stats['empty_groups'], ['Acme_Austin_Lab'])
+        self.assertEqual(stats['ungrouped_hosts'],
+                         [{'company': 'Acme', 'office': 'Austin',
+                           'host': 'wile'}])
+        self.assertEqual(stats['capacity'],
+                         {'max_hosts_per_group': 2,
+                          'mean_hosts_per_group': 1.0,
+                          'max_hosts_per_office': 3,
+                          'mean_groups_per_host': 1.0})
+
+    def test_cached_per_revision(self):
+        stats = self.manager.stats()
+        queries = len(self.statements)
+        self.assertIs(self.manager.stats(), stats)
+        # Only the revision lookup
+        self.assertEqual(len(self.statements), queries + 1)
+
+        # Variables don't change the statistics
+        self.manager.set_vars({'rack': 1}, company_name='Acme')
+        self.assertIs(self.manager.stats(), stats)
+
+        self.manager.add_host(hostname='bugs', company_name='Acme',
+                              office_name='Houston', group_names=['Ops'])
+        stats = self.manager.stats()
+        self.assertEqual(stats['totals']['hosts'], 5)
+        self.assertEqual(stats['offices'][1]['hosts'], 2)
+        self.assertEqual(stats['capacity']['mean_groups_per_host'], 1.0)
+
+    def test_other_writer(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        engine = create_engine(
+            'sqlite:///' + os.path.join(tmpdir, 'inventory.db'))
+        self.addCleanup(engine.dispose)
+        reader = Manager(engine)
+        writer = Manager(engine)
+        writer.sync(SPEC)
+        stats = reader.stats()
+        self.assertEqual(stats['totals']['hosts'], 4)
+        self.assertIs(reader.stats(), stats)
+
+        # The reader sees the commits of the writer
+        writer.add_host(hostname='bugs', company_name='Acme',
+                        office_name='Houston', group_names=['Ops'])
+        stats = reader.stats()
+        self.assertEqual(stats['totals']['hosts'], 5)
+        writer.set_vars({'rack': 1}, company_name='Acme')
+        self.assertIs(reader.stats(), stats)
+
+        # Plain SQLAlchemy writes count too, rolled back ones don't
+        with engine.connect() as conn:
+            conn.execute(Company.__table__.insert().values(name='Warner'))
+            conn.rollback()
+        self.assertIs(reader.stats(), stats)
+        with engine.begin() as conn:
+            conn.execute(Company.__table__.insert().values(name='Warner'))
+        self.assertEqual(reader.stats()['totals']['companies'], 3)
+        reader.close()
+        writer.close()
+
+    def test_empty(self):
+        manager = Manager(create_engine('sqlite://', echo=False))
+        stats = manager.stats()
+        self.assertEqual(set(stats['totals'].values()), set([0]))
+        self.assertEqual(stats['capacity']['mean_hosts_per_group'], 0.0)
+        self.assertEqual(stats['groups'], [])
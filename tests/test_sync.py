@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import tempfile
+import unittest
+from Manager import Manager
+from sqlalchemy import create_engine
+from sync import load_spec
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['roadrunner', 'coyote'],
+                   'Dev': ['roadrunner']},
+        'Houston': {},
+    },
+    'RedHat': {
+        'Dallas': {'Ops': ['bugs']},
+    },
+}
+
+
+class TestSync(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+
+    def hosts_by_group(self):
+        return self.manager.get_graph().hosts_by_group()
+
+    def test_initial_sync(self):
+        plan = self.manager.sync(SPEC)
+        self.assertEqual(plan.summary()['add'],
+                         {'companies': 2, 'offices': 3, 'groups': 3,
+                          'hosts': 3, 'memberships': 4})
+        self.assertEqual(self.hosts_by_group(),
+                         {'Acme_Austin_IT': ['coyote', 'roadrunner'],
+                          'Acme_Austin_Dev': ['roadrunner'],
+                          'RedHat_Dallas_Ops': ['bugs']})
+
+        # Re-syncing an unchanged spec is a no-op
+        plan = self.manager.sync(SPEC)
+        self.assertFalse(plan)
+
+    def test_dry_run(self):
+        plan = self.manager.sync(SPEC, dry_run=True)
+        self.assertIn(('Acme', 'Austin', 'IT', 'coyote'),
+                      plan.as_dict()['add']['memberships'])
+        self.assertIsNone(self.manager.get_company('Acme'))
+
+    def test_existing_objects_are_kept(self):
+        self.manager.add_company(company_name='Acme')
+        self.manager.add_office(office_name='Austin', company_name='Acme')
+        self.manager.add_group(group_name='IT', company_name='Acme',
+                               office_name='Austin')
+        plan = self.manager.sync(SPEC)
+        self.assertEqual(plan.summary()['add']['companies'], 1)
+        self.assertEqual(plan.summary()['add']['groups'], 2)
+        self.assertEqual(self.hosts_by_group()['Acme_Austin_IT'],
+                         ['coyote', 'roadrunner'])
+
+    def test_prune(self):
+        self.manager.sync(SPEC)
+        self.manager.add_company(company_name='Other')
+
+        spec = json.loads(json.dumps(SPEC))
+        spec['Acme']['Austin'] = {'IT': ['roadrunner'], 'QA': ['coyote']}
+        del spec['Acme']['Houston']
+
+        # Without prune nothing is removed
+        plan = self.manager.sync(spec, dry_run=True)
+        self.assertEqual(plan.summary()['delete']['memberships'], 0)
+
+        plan = self.manager.sync(spec, prune=True)
+        self.assertEqual(plan.delete['groups'], {('Acme', 'Austin', 'Dev')})
+        self.assertEqual(plan.delete['offices'], {('Acme', 'Houston')})
+        self.assertEqual(self.hosts_by_group(),
+                         {'Acme_Austin_IT': ['roadrunner'],
+                          'Acme_Austin_QA': ['coyote'],
+                          'RedHat_Dallas_Ops': ['bugs']})
+
+        # Companies that aren't in the spec are left alone
+        self.assertIsNotNone(self.manager.get_company('Other'))
+
+    def test_load_spec(self):
+        handle, path = tempfile.mkstemp(suffix='.yml')
+        try:
+            with os.fdopen(handle, 'w') as spec_file:
+                spec_file.write('Acme:\n  Austin:\n    IT: [roadrunner]\n')
+            self.assertEqual(load_spec(path),
+                             {'Acme': {'Austin': {'IT': ['roadrunner']}}})
+        finally:
+            os.remove(path)
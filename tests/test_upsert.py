@@ -0,0 +1,180 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from audit import AuditLog, JsonlSink
+from Manager import Manager
+from inventory import association_table, Company, Group, Host, Office
+from sqlalchemy import create_engine, func, select
+from upsert import add_memberships
+
+LOG = logging.getLogger('Manager')
+
+WORKERS = 4
+HOSTS = 25
+
+
+def _stress(url, worker):
+    """Every worker ensures the same hosts, in a different order."""
+    engine = create_engine(url, connect_args={'timeout': 60})
+    manager = Manager(engine)
+    failures = 0
+    names = ['host{:02}'.format(h) for h in range(HOSTS)]
+    if worker % 2:
+        names.reverse()
+    for name in names:
+        if manager.ensure_host(hostname=name, company_name='Acme',
+                               office_name='Austin',
+                               group_names=['IT', 'group{}'.format(worker)]
+                               ) is None:
+            failures += 1
+    manager.session.close()
+    engine.dispose()
+    return failures
+
+
+class TestUpsert(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+
+    def count(self, table):
+        return self.manager.session.execute(
+            select(func.count()).select_from(table)).scalar()
+
+    def test_ensure_is_idempotent(self):
+        company_id = self.manager.ensure_company('Acme')
+        self.assertIsNotNone(company_id)
+        self.assertEqual(self.manager.ensure_company('Acme'), company_id)
+
+        office_id = self.manager.ensure_office('Austin', 'Acme')
+        self.assertEqual(self.manager.ensure_office('Austin', 'Acme'),
+                         office_id)
+        # Same office name in another company is another office
+        self.assertNotEqual(self.manager.ensure_office('Austin', 'RedHat'),
+                            office_id)
+
+        group_id = self.manager.ensure_group('IT', 'Acme', 'Austin')
+        self.assertEqual(self.manager.ensure_group('IT', 'Acme', 'Austin'),
+                         group_id)
+
+        host_id = self.manager.ensure_host('bugs', 'Acme', 'Austin', ['IT'])
+        self.assertEqual(
+            self.manager.ensure_host('bugs', 'Acme', 'Austin', ['IT', 'Dev']),
+            host_id)
+        self.assertEqual(self.count(Host.__table__), 1)
+        self.assertEqual(self.count(Company.__table__), 2)
+        self.assertEqual(self.count(Office.__table__), 2)
+        self.assertEqual(self.count(Group.__table__), 2)
+        self.assertEqual(self.count(association_table), 2)
+        self.assertEqual(self.manager.get_graph().host_groups('bugs'),
+                         ['Acme_Austin_Dev', 'Acme_Austin_IT'])
+
+    def test_missing_arguments(self):
+        self.assertIsNone(self.manager.ensure_company(None))
+        self.assertIsNone(self.manager.ensure_office('Austin', None))
+        self.assertIsNone(self.manager.ensure_host('bugs', 'Acme', None))
+
+    def test_existing_row(self):
+        self.manager.ensure_company('Acme')
+        dbapi_connection = \
+            self.manager.session.connection().connection.dbapi_connection
+        changes = dbapi_connection.total_changes
+        with mock.patch.object(self.manager.session, 'execute',
+                               wraps=self.manager.session.execute) as execute:
+            self.manager.ensure_company('Acme')
+            # The INSERT does nothing, a SELECT reads the id
+            self.assertEqual(execute.call_count, 2)
+        self.assertEqual(dbapi_connection.total_changes, changes)
+
+    def test_unchanged_is_not_bumped(self):
+        path = os.path.join(tempfile.mkdtemp(), 'audit.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        audit = AuditLog(JsonlSink(path))
+        self.addCleanup(audit.close)
+        manager = Manager(self.engine, audit=audit)
+        manager.ensure_host('bugs', 'Acme', 'Austin', ['IT'])
+        revision = manager.revision
+        table_revisions = dict(manager.table_revisions)
+        data_revisions = manager.data_revisions()
+
+        manager.ensure_company('Acme')
+        manager.ensure_office('Austin', 'Acme')
+        manager.ensure_group('IT', 'Acme', 'Austin')
+        manager.ensure_host('bugs', 'Acme', 'Austin', ['IT'])
+        self.assertEqual(manager.revision, revision)
+        self.assertEqual(manager.data_revisions(), data_revisions)
+
+        # A new membership only bumps the tables it wrote
+        manager.ensure_host('bugs', 'Acme', 'Austin', ['IT', 'Dev'])
+        table_revisions['group'] += 1
+        table_revisions['association'] += 1
+        self.assertEqual(manager.revision, revision + 1)
+        self.assertEqual(manager.table_revisions, table_revisions)
+        self.assertEqual(manager.search_hosts('Acme_Austin_Dev')[0]['host'],
+                         'bugs')
+        manager.close()
+
+        with open(path) as audit_file:
+            records = [json.loads(line) for line in audit_file]
+        self.assertEqual([record['method'] for record in records],
+                         ['ensure_host', 'ensure_host'])
+
+    def test_fallback_dialect(self):
+        with mock.patch('upsert._dialect_insert', return_value=None):
+            host_id = self.manager.ensure_host('bugs', 'Acme', 'Austin',
+                                               ['IT'])
+            self.assertEqual(self.manager.ensure_host('bugs', 'Acme',
+                                                      'Austin', ['IT']),
+                             host_id)
+        self.assertEqual(self.count(Host.__table__), 1)
+
+    def test_add_memberships(self):
+        host_id = self.manager.ensure_host('bugs', 'Acme', 'Austin', ['IT'])
+        group_ids = [self.manager.ensure_group(name, 'Acme', 'Austin')
+                     for name in ('IT', 'Dev', 'Ops')]
+        session = self.manager.session
+        # The existing link conflicts and is skipped, not duplicated
+        self.assertEqual(add_memberships(session, host_id, group_ids[:2]),
+                         [group_ids[1]])
+        with mock.patch('upsert._dialect_insert', return_value=None):
+            self.assertEqual(add_memberships(session, host_id, group_ids),
+                             [group_ids[2]])
+        self.assertEqual(add_memberships(session, host_id, group_ids), [])
+        session.commit()
+        self.assertEqual(self.count(association_table), 3)
+
+    def test_concurrent_writers(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            url = 'sqlite:///' + os.path.join(tmpdir, 'inventory.db')
+            engine = create_engine(url)
+            Manager(engine).session.close()
+
+            pool = multiprocessing.Pool(WORKERS)
+            try:
+                failures = pool.starmap(_stress, [(url, worker)
+                                                  for worker in range(WORKERS)])
+            finally:
+                pool.close()
+                pool.join()
+            self.assertEqual(failures, [0] * WORKERS)
+
+            with engine.connect() as conn:
+                def count(table):
+                    return conn.execute(
+                        select(func.count()).select_from(table)).scalar()
+                self.assertEqual(count(Company.__table__), 1)
+                self.assertEqual(count(Office.__table__), 1)
+                self.assertEqual(count(Host.__table__), HOSTS)
+                self.assertEqual(count(Group.__table__), WORKERS + 1)
+                self.assertEqual(count(association_table),
+                                 HOSTS * (WORKERS + 1))
+            engine.dispose()
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,132 @@
+import json
+import logging
+import unittest
+import variables
+from Manager import Manager
+from inventory import CompanyVar, GroupVar
+from sqlalchemy import create_engine
+
+LOG = logging.getLogger('Manager')
+
+SPEC = {
+    'Acme': {
+        'Austin': {'IT': ['roadrunner', 'coyote'],
+                   'Web': ['roadrunner', 'wile']},
+        'Houston': {'Ops': ['tex']},
+    },
+}
+
+AUSTIN = {'company_name': 'Acme', 'office_name': 'Austin'}
+
+
+class TestVariables(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', echo=False)
+        self.manager = Manager(self.engine)
+        self.manager.sync(SPEC)
+        self.manager.set_vars({'ntp': 'pool.ntp.org', 'dns': '8.8.8.8',
+                               'tier': 'company'}, company_name='Acme')
+        self.manager.set_vars({'dns': '10.0.0.53', 'tier': 'office'},
+                              **AUSTIN)
+        self.manager.set_vars({'tier': 'IT', 'admins': ['bugs']},
+                              group_name='IT', **AUSTIN)
+        self.manager.set_vars({'tier': 'Web', 'port': 80},
+                              group_name='Web', **AUSTIN)
+
+    def effective(self, hostname, office_name='Austin'):
+        return self.manager.effective_vars(hostname, company_name='Acme',
+                                           office_name=office_name)
+
+    def test_merge_order(self):
+        # Equal priorities: groups merge by name, Web after IT
+        self.assertEqual(self.effective('roadrunner'),
+                         {'ntp': 'pool.ntp.org', 'dns': '10.0.0.53',
+                          'tier': 'Web', 'admins': ['bugs'], 'port': 80})
+        self.assertEqual(self.effective('coyote')['tier'], 'IT')
+        self.assertEqual(self.effective('tex', 'Houston'),
+                         {'ntp': 'pool.ntp.org', 'dns': '8.8.8.8',
+                          'tier': 'company'})
+
+        # The host variables win over every group
+        self.manager.set_vars({'tier': 'host'}, hostname='roadrunner',
+                              **AUSTIN)
+        self.assertEqual(self.effective('roadrunner')['tier'], 'host')
+
+    def test_group_priority(self):
+        self.assertEqual(self.manager.set_group_priority(
+            5, group_name='IT', **AUSTIN), 5)
+        self.assertEqual(self.effective('roadrunner')['tier'], 'IT')
+        self.assertIsNone(self.manager.set_group_priority(
+            5, group_name='Dev', **AUSTIN))
+
+    def test_delete_and_cache(self):
+        resolver = self.manager.get_resolver()
+        self.assertIs(self.manager.get_resolver(), resolver)
+        self.assertEqual(self.manager.set_vars({'dns': None}, **AUSTIN), 1)
+        self.assertIsNot(self.manager.get_resolver(), resolver)
+        self.assertEqual(self.effective('wile')['dns'], '8.8.8.8')
+        self.assertIsNone(self.manager.set_vars({'dns': None},
+                                                office_name='Dallas',
+                                                company_name='Acme'))
+        self.assertIsNone(self.effective('bugs'))
+
+    def test_memoized(self):
+        it = self.manager.get_group('IT', **AUSTIN)
+        web = self.manager.get_group('Web', **AUSTIN)
+        resolver = variables.VariableResolver(
+            self.manager.session.connection())
+        first = resolver.merged(it.company_id, it.office_id, [it.id, web.id])
+        merges = resolver.merges
+        self.assertIs(resolver.merged(it.company_id, it.office_id,
+                                      [web.id, it.id]), first)
+        self.assertEqual(resolver.merges, merges)
+        # company, office, IT, Web
+        self.assertEqual(merges, 4)
+
+    def test_export_hostvars(self):
+        self.manager.set_vars({'port': 8080}, hostname='wile', **AUSTIN)
+        inventory = json.loads(self.manager.export())
+        hostvars = inventory['_meta']['hostvars']
+        self.assertEqual(sorted(hostvars),
+                         ['coyote', 'roadrunner', 'tex', 'wile'])
+        self.assertEqual(hostvars['wile']['port'], 8080)
+        self.assertEqual(hostvars['roadrunner']['port'], 80)
+        self.assertEqual(inventory['Acme_Austin_IT']['hosts'],
+                         ['coyote', 'roadrunner'])
+
+    def test_paged(self):
+        # Two coyotes: the pages break between hosts of the same name
+        self.manager.ensure_host('coyote', 'Acme', 'Houston', ['Ops'])
+        self.manager.set_vars({'port': 8080}, hostname='wile', **AUSTIN)
+        conn = self.manager.session.connection()
+        resolver = variables.VariableResolver(conn)
+        expected = [(host_id, name, variables.effective_vars(conn, resolver,
+                                                             host_id))
+                    for host_id, name, _ in variables.iter_effective_vars(
+                        conn, resolver)]
+        self.assertEqual([name for _, name, _ in expected],
+                         ['coyote', 'coyote', 'roadrunner', 'tex', 'wile'])
+        for page_size in (1, 2, 5):
+            self.assertEqual(list(variables.iter_effective_vars(
+                conn, resolver, page_size=page_size)), expected)
+
+    def test_delete_owner(self):
+        self.manager.add_company(company_name='RedHat')
+        self.manager.set_vars({'ntp': 'ntp.redhat.com'},
+                              company_name='RedHat')
+        self.manager.del_company(company_name='RedHat')
+        self.manager.del_group(group_name='Web', **AUSTIN)
+        session = self.manager.session
+        self.assertEqual(session.query(CompanyVar).count(), 3)
+        self.assertEqual(session.query(GroupVar).count(), 2)
+        self.assertEqual(self.manager.check_integrity(), [])
+
+    def test_dangling(self):
+        with self.engine.begin() as conn:
+            conn.execute(CompanyVar.__table__.insert().values(
+                company_id=9999, key='ntp', value='"pool.ntp.org"'))
+        findings = self.manager.check_integrity(repair=True)
+        self.assertEqual([finding.kind for finding in findings],
+                         ['dangling_company_var'])
+        self.assertEqual(self.manager.check_integrity(), [])
@@ -0,0 +1,175 @@
+"""Dialect-level upserts against the inventory UniqueConstraints.
+
+upsert() inserts a row with INSERT ... ON CONFLICT DO NOTHING RETURNING id
+on SQLite (3.35+) and PostgreSQL, so concurrent writers can't both pass an
+existence check and then collide on the constraint; when the row exists
+nothing is written and a SELECT reads its id.  Other dialects fall back to
+a SELECT and an INSERT inside a savepoint, retried once on IntegrityError.
+It tells the caller whether it inserted the row.
+
+upsert_rows() does the same for many rows and overwrites the other columns
+of the existing ones, as one executemany.  insert_missing() leaves the
+existing rows alone.  add_memberships() links a host to groups against the
+unique (host_id, group_id) index of the association table.
+"""
+
+import logging
+
+from sqlalchemy import and_, bindparam, select
+from sqlalchemy.exc import IntegrityError
+
+from inventory import (association_table,
+                       Company,
+                       Office,
+                       Group,
+                       Host,
+                       )
+
+LOG = logging.getLogger('Manager')
+
+# Columns of the unique constraint each ensure_* upserts against
+CONFLICT_COLUMNS = {
+    Company.__table__: ('name',),
+    Office.__table__: ('name', 'company_id'),            # _company_office_uc
+    Group.__table__: ('name', 'company_id', 'office_id'),  # _company_office_group_uc
+    Host.__table__: ('name', 'company_id', 'office_id'),   # _company_office_host_uc
+    association_table: ('host_id', 'group_id'),  # ix_association_host_group
+}
+
+
+def _dialect_insert(dialect_name):
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert
+
+
+def upsert(session, table, **values):
+    """Insert values into table unless they exist.
+
+    Return (row id, True when the row was inserted).
+    """
+    columns = CONFLICT_COLUMNS[table]
+    query = select(table.c.id).where(
+        and_(*[table.c[column] == values[column] for column in columns]))
+    insert = _dialect_insert(session.get_bind().dialect.name)
+    if insert is None:
+        return _select_or_insert(session, table, query, values)
+
+    # RETURNING yields nothing on conflict: the row was there already
+    id = session.execute(insert(table).values(**values)
+                         .on_conflict_do_nothing(index_elements=columns)
+                         .returning(table.c.id)).scalar()
+    if id is not None:
+        return id, True
+    return session.execute(query).scalar_one(), False
+
+
+def _select_or_insert(session, table, query, values):
+    for attempt in (1, 2):
+        id = session.execute(query).scalar()
+        if id is not None:
+            return id, False
+        try:
+            with session.begin_nested():
+                return session.execute(
+                    table.insert().values(**values)
+                ).inserted_primary_key[0], True
+        except IntegrityError:
+            # Another writer won the race, its row is there now
+            if attempt == 2:
+                raise
+
+
+def upsert_rows(session, table, rows, columns):
+    """Insert rows into table, updating the rows that conflict on columns.
+
+    Every row must have the same keys; the keys not in columns are
+    overwritten on conflict.
+    """
+    if not rows:
+        return
+    update = [key for key in rows[0] if key not in columns]
+    insert = _dialect_insert(session.get_bind().dialect.name)
+    if insert is None:
+        _update_or_insert(session, table, rows, columns, update)
+        return
+
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=columns,
+        set_=dict((key, statement.excluded[key]) for key in update))
+    session.execute(statement, rows)
+
+
+def _update_or_insert(session, table, rows, columns, update):
+    # Parameter names must differ from the column names in an UPDATE
+    statement = (table.update()
+                 .where(and_(*[table.c[column] == bindparam('_' + column)
+                               for column in columns]))
+                 .values(dict((key, bindparam('_' + key)) for key in update)))
+    for row in rows:
+        params = dict(('_' + key, value) for key, value in row.items())
+        if not session.execute(statement, params).rowcount:
+            session.execute(table.insert().values(**row))
+
+
+def insert_missing(session, table, rows, columns):
+    """Insert rows into table, skipping the rows that conflict on columns."""
+    if not rows:
+        return
+    insert = _dialect_insert(session.get_bind().dialect.name)
+    if insert is None:
+        for row in rows:
+            try:
+                with session.begin_nested():
+                    session.execute(table.insert().values(**row))
+            except IntegrityError:
+                # Another writer inserted it
+                pass
+        return
+
+    session.execute(insert(table).on_conflict_do_nothing(
+        index_elements=columns), rows)
+
+
+def add_memberships(session, host_id, group_ids):
+    """Link host_id to group_ids, skipping the links that already exist.
+
+    Return the ids of the groups host_id was linked to.
+    """
+    columns = CONFLICT_COLUMNS[association_table]
+    rows = [{'host_id': host_id, 'group_id': group_id}
+            for group_id in sorted(set(group_ids))]
+    if not rows:
+        return []
+    insert = _dialect_insert(session.get_bind().dialect.name)
+    if insert is None:
+        return _insert_memberships(session, host_id, rows)
+
+    # RETURNING yields the links that didn't conflict
+    return session.execute(insert(association_table).values(rows)
+                           .on_conflict_do_nothing(index_elements=columns)
+                           .returning(association_table.c.group_id)
+                           ).scalars().all()
+
+
+def _insert_memberships(session, host_id, rows):
+    existing = set(session.execute(
+        select(association_table.c.group_id)
+        .where(association_table.c.host_id == host_id)).scalars())
+    added = []
+    for row in rows:
+        if row['group_id'] in existing:
+            continue
+        try:
+            with session.begin_nested():
+                session.execute(association_table.insert().values(**row))
+        except IntegrityError:
+            # Another writer linked them
+            continue
+        added.append(row['group_id'])
+    return added
@@ -0,0 +1,212 @@
+"""Variables of companies, offices, groups and hosts, merged per host.
+
+Variables are set on a company (company_var), an office (office_var), a
+group (group_var) or a host (host_var, which also holds the facts ingested
+by facts.py), as JSON values.  The effective variables of a host are merged
+the way Ansible merges inventory variables, each level replacing the
+top-level keys of the levels before it::
+
+    company < office < the host's groups < host
+
+A host's groups are merged in (Group.priority, name) order: like
+``ansible_group_priority`` the group with the highest priority (default 1)
+wins and equal priorities are decided by name.
+
+VariableResolver memoizes every merged prefix of a host's path: the
+company, the company and office, then the office plus each of the host's
+sorted groups in turn.  Hosts sharing a path share one merged dict, so
+resolving a whole inventory costs one merge per distinct prefix, plus one
+per host that has variables of its own.
+"""
+
+import json
+import logging
+
+from sqlalchemy import and_, bindparam, select, tuple_
+
+from inventory import (association_table,
+                       CompanyVar,
+                       Group,
+                       GroupVar,
+                       Host,
+                       HostVar,
+                       OfficeVar,
+                       )
+from upsert import upsert_rows
+
+LOG = logging.getLogger('Manager')
+
+# level: (model, owner id column)
+LEVELS = {
+    'company': (CompanyVar, 'company_id'),
+    'office': (OfficeVar, 'office_id'),
+    'group': (GroupVar, 'group_id'),
+    'host': (HostVar, 'host_id'),
+}
+
+# The variables tables, one per level
+VAR_TABLES = tuple(model.__tablename__ for model, _ in LEVELS.values())
+
+# Tables a VariableResolver is built from (Manager.table_revisions keys)
+TABLES = ('company_var', 'office_var', 'group_var', 'group')
+
+# Hosts per page of iter_effective_vars()
+PAGE_SIZE = 1000
+
+_EMPTY = {}
+
+
+def _load(conn, level, owner_ids=None):
+    """Return {owner id: {key: value}} of the variables of a level."""
+    model, column = LEVELS[level]
+    owner = getattr(model, column)
+    query = select(owner, model.key, model.value)
+    if owner_ids is not None:
+        query = query.where(owner.in_(owner_ids))
+    variables = {}
+    for owner_id, key, value in conn.execute(query):
+        variables.setdefault(owner_id, {})[key] = json.loads(value)
+    return variables
+
+
+class VariableResolver(object):
+    """Merge the company, office and group variables of host paths.
+
+    Built from one read of the company_var, office_var, group_var and group
+    tables; merged() and resolve() return shared dicts that callers must
+    not modify.
+    """
+
+    def __init__(self, conn):
+        self.company_vars = _load(conn, 'company')
+        self.office_vars = _load(conn, 'office')
+        self.group_vars = _load(conn, 'group')
+        # group id: merge order
+        self.group_order = dict(
+            (group_id, (priority, name, group_id))
+            for group_id, priority, name in conn.execute(
+                select(Group.id, Group.priority, Group.name)))
+        self._merged = {}
+        # Number of dicts merged, to see the memoization at work
+        self.merges = 0
+
+    def _order(self, group_id):
+        return self.group_order.get(group_id, (1, '', group_id))
+
+    def merged(self, company_id, office_id=None, group_ids=()):
+        """Return the merged variables of a company/office/groups path."""
+        group_ids = tuple(sorted(group_ids, key=self._order))
+        return self._prefix(company_id, office_id, group_ids)
+
+    def _prefix(self, company_id, office_id, group_ids):
+        key = (company_id, office_id, group_ids)
+        merged = self._merged.get(key)
+        if merged is not None:
+            return merged
+
+        if group_ids:
+            parent = self._prefix(company_id, office_id, group_ids[:-1])
+            variables = self.group_vars.get(group_ids[-1])
+        elif office_id is not None:
+            parent = self._prefix(company_id, None, ())
+            variables = self.office_vars.get(office_id)
+        else:
+            parent = _EMPTY
+            variables = self.company_vars.get(company_id)
+        merged = parent
+        if variables:
+            merged = dict(parent)
+            merged.update(variables)
+            self.merges += 1
+        self._merged[key] = merged
+        return merged
+
+    def resolve(self, company_id, office_id, group_ids, host_vars=None):
+        """Return the effective variables of a host."""
+        merged = self.merged(company_id, office_id, group_ids)
+        if host_vars:
+            merged = dict(merged)
+            merged.update(host_vars)
+            self.merges += 1
+        return merged
+
+
+def effective_vars(conn, resolver, host_id):
+    """Return the effective variables of host_id, or None without host."""
+    host = conn.execute(select(Host.company_id, Host.office_id)
+                        .where(Host.id == host_id)).first()
+    if host is None:
+        return None
+    group_ids = conn.execute(
+        select(association_table.c.group_id)
+        .where(association_table.c.host_id == host_id)).scalars().all()
+    host_vars = _load(conn, 'host', [host_id]).get(host_id)
+    return dict(resolver.resolve(host.company_id, host.office_id, group_ids,
+                                 host_vars))
+
+
+def iter_effective_vars(conn, resolver, page_size=PAGE_SIZE):
+    """Yield (host_id, host_name, variables) of every host, by host name.
+
+    The bulk mode of effective_vars(): the hosts are read one keyset page
+    of (name, id) at a time, with one query for the memberships and one
+    for the host variables of the hosts in the page's key range, so memory
+    use is bounded by page_size however large the inventory.  The
+    variables are shared dicts.
+    """
+    key = tuple_(Host.name, Host.id)
+    query = (select(Host.name, Host.id, Host.company_id, Host.office_id)
+             .order_by(Host.name, Host.id).limit(page_size))
+    after = None
+    while True:
+        page = query if after is None else query.where(key > after)
+        hosts = conn.execute(page).all()
+        if not hosts:
+            return
+        last = tuple_(hosts[-1].name, hosts[-1].id)
+        in_page = key <= last if after is None else and_(key > after,
+                                                         key <= last)
+        group_ids = {}
+        for host_id, group_id in conn.execute(
+                select(association_table.c.host_id,
+                       association_table.c.group_id)
+                .join(Host, Host.id == association_table.c.host_id)
+                .where(in_page)):
+            group_ids.setdefault(host_id, []).append(group_id)
+        host_vars = {}
+        for host_id, name, value in conn.execute(
+                select(HostVar.host_id, HostVar.key, HostVar.value)
+                .join(Host, Host.id == HostVar.host_id).where(in_page)):
+            host_vars.setdefault(host_id, {})[name] = json.loads(value)
+        for name, host_id, company_id, office_id in hosts:
+            yield host_id, name, resolver.resolve(company_id, office_id,
+                                                  group_ids.get(host_id, ()),
+                                                  host_vars.get(host_id))
+        if len(hosts) < page_size:
+            return
+        after = last
+
+
+def set_vars(session, level, owner_id, variables):
+    """Upsert the variables of one owner; None values delete the key."""
+    model, column = LEVELS[level]
+    table = model.__table__
+    upsert_rows(session, table,
+                [{column: owner_id, 'key': key,
+                  'value': json.dumps(value, sort_keys=True)}
+                 for key, value in sorted(variables.items())
+                 if value is not None],
+                (column, 'key'))
+    deleted = [{'o_id': owner_id, 'k': key}
+               for key, value in variables.items() if value is None]
+    if deleted:
+        session.execute(table.delete().where(and_(
+            table.c[column] == bindparam('o_id'),
+            table.c.key == bindparam('k'))), deleted)
+
+
+def forget(session, level, owner_ids):
+    """Delete the variables of owners being deleted."""
+    model, column = LEVELS[level]
+    session.execute(model.__table__.delete().where(
+        getattr(model, column).in_(list(owner_ids))))